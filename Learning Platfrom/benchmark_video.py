@@ -0,0 +1,56 @@
+from server.agents.media_agent.media import MediaAgent, VIDEO_WORKERS, shutdown_render_pool
+from server.agents.media_agent.tts import TTSService, SilentTTSBackend
+from server.agents.media_agent.encoder import find_ffmpeg
+import asyncio
+import os
+import sys
+import time
+
+# Renders the same synthetic lecture with each encoder and compares wall time.
+# TTS uses the offline silent backend, so only slide rendering and encoding are measured.
+#   python benchmark_video.py [segments]
+# Segments render in the process pool (VIDEO_WORKERS processes); set VIDEO_WORKERS=1 for a single-core baseline.
+
+SEGMENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+
+def main():
+    print("--- Video Encoder Benchmark ---")
+    print(f"Segments: {SEGMENTS}, workers: {VIDEO_WORKERS}, ffmpeg: {find_ffmpeg() or 'not found'}")
+
+    texts = [
+        f"Segment {i + 1}. This is a sample narration sentence used to measure how long it takes "
+        f"to render and encode one slide of a lecture video, number {i + 1}."
+        for i in range(SEGMENTS)
+    ]
+
+    results = {}
+    for encoder in ("ffmpeg", "moviepy"):
+        agent = MediaAgent(with_llm=False)
+        agent.tts = TTSService(SilentTTSBackend())
+        agent.encoder = encoder
+        try:
+            start = time.perf_counter()
+            video_path = asyncio.run(agent._render(f"benchmark_{encoder}", texts, lambda **fields: None))
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            print(f"{encoder}: CRASH: {e}")
+            continue
+        if not video_path:
+            print(f"{encoder}: FAILURE (see logs)")
+            continue
+        output_path = os.path.join("client", video_path.lstrip("/"))
+        size_mb = os.path.getsize(output_path) / (1024 * 1024)
+        results[encoder] = elapsed
+        print(f"{encoder}: {elapsed:.2f}s total, {elapsed / SEGMENTS * 1000:.0f} ms/segment, {size_mb:.1f} MB")
+        os.remove(output_path)
+
+    if len(results) == 2:
+        print(f"\nffmpeg is {results['moviepy'] / results['ffmpeg']:.1f}x faster than moviepy")
+
+    shutdown_render_pool()
+
+
+# Render processes are spawned and re-import this module, so the benchmark must not run on import
+if __name__ == "__main__":
+    main()
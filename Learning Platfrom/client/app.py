@@ -1,5 +1,8 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import requests
+import json
+import time
 
 # Configuration
 API_URL = "http://localhost:8001"
@@ -17,6 +20,83 @@ except FileNotFoundError:
     st.warning("CSS file not found. Ensure client/static/style.css exists.")
 
 
+def iter_sse(path, payload):
+    """POSTs to a Server-Sent Events endpoint and yields (event, data) pairs."""
+    event = None
+    with requests.post(f"{API_URL}{path}", json=payload, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                yield event, json.loads(line[len("data:"):].strip())
+
+
+def stream_chapter(payload, placeholder):
+    """Reads the chapter SSE stream, rendering content_markdown as it arrives."""
+    markdown = ""
+    for event, data in iter_sse("/generate/chapter/stream", payload):
+        if event == "delta":
+            markdown += data
+            placeholder.markdown(markdown + " ▌")
+        elif event == "done":
+            placeholder.empty()
+            return data
+        elif event == "error":
+            raise Exception(data)
+    raise Exception("Stream ended before the chapter was complete")
+
+
+def hls_player(url):
+    """Plays an HLS stream that is still being written (hls.js; Safari plays HLS natively)."""
+    components.html(f"""
+        <video id="player" controls autoplay muted style="width: 100%; max-height: 400px;"></video>
+        <script src="https://cdn.jsdelivr.net/npm/hls.js@1"></script>
+        <script>
+            const video = document.getElementById("player");
+            const url = {json.dumps(url)};
+            if (window.Hls && Hls.isSupported()) {{
+                const hls = new Hls();
+                hls.loadSource(url);
+                hls.attachMedia(video);
+            }} else {{
+                video.src = url;
+            }}
+        </script>
+    """, height=420)
+
+
+def wait_for_video(job, progress, player):
+    """
+    Polls a video job until it finishes, updating the progress bar. Starts
+    the HLS stream in `player` as soon as the first segment is ready.
+    Returns (video URL, whether the stream was shown).
+    """
+    stream_url = job.get('stream_url')
+    streaming = False
+    while job['status'] not in ("done", "failed"):
+        if stream_url and not streaming:
+            with player:
+                hls_player(f"{API_URL}{stream_url}")
+            streaming = True
+        time.sleep(2)
+        response = requests.get(f"{API_URL}/jobs/{job['job_id']}")
+        response.raise_for_status()
+        job = response.json()
+        info = job.get('progress', {})
+        stream_url = stream_url or info.get('stream_url')
+        stage = info.get('stage', job['status'])
+        if info.get('segments_total'):
+            fraction = info['segments_done'] / info['segments_total']
+            progress.progress(min(0.95, 0.1 + 0.8 * fraction), text=f"{stage.capitalize()}: segment {info['segments_done']}/{info['segments_total']}...")
+        else:
+            progress.progress(0.95 if stage == "encode" else 0.05, text=f"{stage.capitalize()}...")
+    if job['status'] == "failed":
+        raise Exception(job.get('error') or "Video generation failed")
+    progress.progress(1.0, text="Done")
+    return job.get('video_url') or job.get('result'), streaming
+
+
 # Session State Initialization
 if 'roadmap' not in st.session_state:
     st.session_state['roadmap'] = None
@@ -24,6 +104,8 @@ if 'content_cache' not in st.session_state:
     st.session_state['content_cache'] = {}
 if 'current_chapter_index' not in st.session_state:
     st.session_state['current_chapter_index'] = None
+if 'roadmap_id' not in st.session_state:
+    st.session_state['roadmap_id'] = None
 
 st.title("EduCore: AI Learning Platform")
 
@@ -40,13 +122,45 @@ with st.sidebar:
                 response = requests.post(f"{API_URL}/generate/course", json=payload)
                 response.raise_for_status()
                 data = response.json()
+                # Stop the server prefetching chapters of the roadmap we're leaving
+                if st.session_state['roadmap_id'] and st.session_state['roadmap_id'] != data.get('roadmap_id'):
+                    try:
+                        requests.delete(f"{API_URL}/prefetch/{st.session_state['roadmap_id']}", timeout=5)
+                    except requests.RequestException:
+                        pass
                 st.session_state['roadmap'] = data['roadmap']
+                st.session_state['roadmap_id'] = data.get('roadmap_id')
                 st.session_state['content_cache'] = {} # Reset cache
                 st.session_state['current_chapter_index'] = None
                 st.success("Roadmap Generated!")
             except Exception as e:
                 st.error(f"Error: {e}")
 
+    if st.button("Generate Full Course"):
+        progress = st.progress(0.0, text="Planning roadmap...")
+        try:
+            total = 0
+            finished = 0
+            for event, data in iter_sse("/generate/course/full", {"topic": topic, "grade_level": grade}):
+                if event == "roadmap":
+                    st.session_state['roadmap'] = data
+                    st.session_state['content_cache'] = {}
+                    st.session_state['current_chapter_index'] = None
+                    total = len(data['chapters'])
+                elif event in ("chapter", "chapter_failed"):
+                    finished += 1
+                    if event == "chapter":
+                        numbers = [c['chapter_number'] for c in st.session_state['roadmap']['chapters']]
+                        st.session_state['content_cache'][numbers.index(data['chapter_number'])] = data['content']
+                    else:
+                        st.warning(f"Chapter {data['chapter_number']} failed: {data['error']}")
+                    progress.progress(finished / max(total, 1), text=f"{finished}/{total} chapters ready")
+                elif event == "error":
+                    raise Exception(data)
+            st.success("Course Generated!")
+        except Exception as e:
+            st.error(f"Error: {e}")
+
     st.divider()
     st.header("Proctoring Status")
     st.info("Camera inactive (Streamlit Dumb Terminal). In production, this would stream to WS.")
@@ -75,20 +189,24 @@ if st.session_state['roadmap']:
             if idx in st.session_state['content_cache']:
                 content = st.session_state['content_cache'][idx]
             else:
-                with st.spinner(f"Generating comprehensive content for: {chapter['title']}..."):
-                    try:
-                        payload = {
-                            "chapter": chapter,
-                            "topic": roadmap['topic'],
-                            "grade_level": grade # Note: technically grade might have changed in sidebar, but acceptable for MVP
-                        }
-                        response = requests.post(f"{API_URL}/generate/chapter", json=payload)
-                        response.raise_for_status()
-                        content = response.json()
-                        st.session_state['content_cache'][idx] = content
-                    except Exception as e:
-                        st.error(f"Failed to generate content: {e}")
-                        content = None
+                st.header(chapter['title'])
+                stream_placeholder = st.empty()
+                stream_placeholder.caption(f"Generating comprehensive content for: {chapter['title']}...")
+                try:
+                    payload = {
+                        "chapter": chapter,
+                        "topic": roadmap['topic'],
+                        "grade_level": grade # Note: technically grade might have changed in sidebar, but acceptable for MVP
+                    }
+                    content = stream_chapter(payload, stream_placeholder)
+                    st.session_state['content_cache'][idx] = content
+                except Exception as e:
+                    st.error(f"Failed to generate content: {e}")
+                    content = None
+
+                if content:
+                    # Re-render from the cache so the streamed preview is replaced cleanly
+                    st.rerun()
 
             if content:
                 st.header(content['chapter_title'])
@@ -108,19 +226,22 @@ if st.session_state['roadmap']:
                     st.video(video_url)
                 else:
                     if st.button("Generate Video Summary", key=f"gen_vid_{idx}"):
-                        with st.spinner("Generating video (this may take a minute)..."):
-                            try:
-                                vid_payload = {
-                                    "topic": content['chapter_title'],
-                                    "content_markdown": content['content_markdown']
-                                }
-                                vid_resp = requests.post(f"{API_URL}/generate/video", json=vid_payload)
-                                vid_resp.raise_for_status()
-                                vid_data = vid_resp.json()
-                                st.session_state[video_key] = vid_data['video_url']
-                                st.rerun()
-                            except Exception as e:
-                                st.error(f"Video generation failed: {e}")
+                        try:
+                            vid_payload = {
+                                "topic": content['chapter_title'],
+                                "content_markdown": content['content_markdown']
+                            }
+                            vid_resp = requests.post(f"{API_URL}/generate/video", json=vid_payload)
+                            vid_resp.raise_for_status()
+                            job = vid_resp.json()
+                            video_url, streamed = wait_for_video(job, st.progress(0.0, text="Queued..."), st.empty())
+                            st.session_state[video_key] = video_url
+                        except Exception as e:
+                            st.error(f"Video generation failed: {e}")
+                            streamed = False
+                        # A viewer already watching the stream keeps it; the MP4 shows on the next rerun
+                        if st.session_state[video_key] and not streamed:
+                            st.rerun()
 
                 st.divider()
                 st.subheader("Knowledge Check")
@@ -1,6 +1,7 @@
 from server.agents.content_agent.content import ContentAgent
 from server.shared.schemas import Chapter
 import json
+import asyncio
 
 print("--- Debugging Content Agent ---")
 try:
@@ -17,7 +18,7 @@ try:
     print(f"Requesting detailed content for: {chapter.title}")
     
     # Call the agent
-    content = agent.generate_chapter_content(chapter)
+    content = asyncio.run(agent.generate_chapter_content(chapter))
     
     if content:
         print("\nSUCCESS! Content generated:")
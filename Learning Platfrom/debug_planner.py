@@ -1,5 +1,6 @@
 from server.agents.planner_agent.planner import PlannerAgent
 import json
+import asyncio
 
 print("--- Debugging Planner Agent ---")
 try:
@@ -12,7 +13,7 @@ try:
     
     # We will verify the LLM response by monkey-patching or just calling it
     # But first, let's just try the normal method
-    roadmap = agent.generate_roadmap(topic, grade)
+    roadmap = asyncio.run(agent.generate_roadmap(topic, grade))
     
     if roadmap:
         print("\nSUCCESS! Roadmap generated:")
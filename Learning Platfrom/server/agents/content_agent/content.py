@@ -1,40 +1,85 @@
-import json
+import time
 from server.core.llm import LLMService
+from server.core.scheduler import PRIORITY_INTERACTIVE, Priority
+from server.core.json_parser import IncrementalJsonParser, parse_agent_output
+from server.core.metrics import AGENT_STAGE_SECONDS, stage_timer
 from server.shared.schemas import Chapter, ChapterContent, QuizQuestion
-from typing import Optional
+from typing import AsyncIterator, Optional, Tuple
+
+SYSTEM_PROMPT = (
+    "You are an expert world-class educator. Write a COMPREHENSIVE, DEEP STYLED lecture "
+    "for the provided chapter. The content must be at least 1000 words long. "
+    "Structure it with: 1. Introduction, 2. Core Concepts (detailed), 3. Real-world Examples, "
+    "4. Interactive scenarios/Thought Experiments, 5. Summary. "
+    "Also generate a challenging 5-question quiz. "
+    "Return ONLY valid JSON. IMPORTANT: The 'content_markdown' field must be a SINGLE line string with all newlines escaped as \\n. "
+    "Do not put raw newlines inside the JSON string values. "
+    "For Math/Equations: Always use LaTeX. Use '$' for inline math (e.g., $E=mc^2$) and '$$' for block math. "
+    "Format: { \"chapter_title\": String, \"content_markdown\": String, "
+    "\"quiz\": [{ \"question\": String, \"options\": [String], \"correct_answer\": Int }] }"
+)
 
 class ContentAgent:
     def __init__(self):
         self.llm = LLMService()
 
-    def generate_chapter_content(self, chapter: Chapter) -> Optional[ChapterContent]:
-        system_prompt = (
-            "You are an expert world-class educator. Write a COMPREHENSIVE, DEEP STYLED lecture "
-            "for the provided chapter. The content must be at least 1000 words long. "
-            "Structure it with: 1. Introduction, 2. Core Concepts (detailed), 3. Real-world Examples, "
-            "4. Interactive scenarios/Thought Experiments, 5. Summary. "
-            "Also generate a challenging 5-question quiz. "
-            "Return ONLY valid JSON. IMPORTANT: The 'content_markdown' field must be a SINGLE line string with all newlines escaped as \\n. "
-            "Do not put raw newlines inside the JSON string values. "
-            "For Math/Equations: Always use LaTeX. Use '$' for inline math (e.g., $E=mc^2$) and '$$' for block math. "
-            "Format: { \"chapter_title\": String, \"content_markdown\": String, "
-            "\"quiz\": [{ \"question\": String, \"options\": [String], \"correct_answer\": Int }] }"
-        )
-        user_prompt = f"Write content for Chapter {chapter.chapter_number}: {chapter.title}. Description: {chapter.description}"
-        
-        response_text = self.llm.generate(user_prompt, system_prompt, json_mode=True)
+    def _user_prompt(self, chapter: Chapter) -> str:
+        return f"Write content for Chapter {chapter.chapter_number}: {chapter.title}. Description: {chapter.description}"
+
+    async def generate_chapter_content(self, chapter: Chapter, priority: Priority = PRIORITY_INTERACTIVE) -> Optional[ChapterContent]:
+        user_prompt = self._user_prompt(chapter)
+
+        with stage_timer("ContentAgent", "llm"):
+            response_text = await self.llm.agenerate(user_prompt, SYSTEM_PROMPT, json_mode=True, priority=priority)
         
         if not response_text:
             return None
 
-        cleaned_text = response_text.replace("```json", "").replace("```", "").strip()
+        return await self._parse_content(user_prompt, response_text, priority)
+
+    async def stream_chapter_content(self, chapter: Chapter,
+                                     priority: Priority = PRIORITY_INTERACTIVE) -> AsyncIterator[Tuple[str, object]]:
+        """
+        Streams a chapter as it is generated. Yields (event, payload) pairs:
+          ("delta", str)          - next piece of content_markdown
+          ("quiz", list)          - the quiz, as soon as it has been received
+          ("done", ChapterContent)
+          ("error", str)
+        """
+        user_prompt = self._user_prompt(chapter)
+        parser = IncrementalJsonParser(stream_keys=["content_markdown"])
+        parts = []
 
+        start = time.perf_counter()
         try:
-            data = json.loads(cleaned_text)
-            return ChapterContent(**data)
-        except json.JSONDecodeError:
-            print(f"Failed to parse JSON content: {cleaned_text}")
-            return None
+            async for chunk in self.llm.astream(user_prompt, SYSTEM_PROMPT, json_mode=True, priority=priority):
+                if not parts:
+                    AGENT_STAGE_SECONDS.observe(time.perf_counter() - start, agent="ContentAgent", stage="first_token")
+                parts.append(chunk)
+                for event in parser.feed(chunk):
+                    if event[0] == "delta":
+                        yield "delta", event[2]
+                    elif event[1] == "quiz":
+                        yield "quiz", event[2]
         except Exception as e:
-            print(f"Validation error: {e}")
-            return None
+            print(f"Chapter stream failed: {e}")
+            yield "error", "Failed to generate chapter content"
+            return
+        AGENT_STAGE_SECONDS.observe(time.perf_counter() - start, agent="ContentAgent", stage="stream")
+
+        content = await self._parse_content(user_prompt, "".join(parts), priority) if parts else None
+        if content:
+            yield "done", content
+        else:
+            yield "error", "Failed to generate chapter content"
+
+    async def _parse_content(self, user_prompt: str, response_text: str,
+                             priority: Priority = PRIORITY_INTERACTIVE) -> Optional[ChapterContent]:
+        # Long chapters are the outputs most likely to hit the token limit mid-string
+        content = await parse_agent_output(
+            response_text, ChapterContent, "ContentAgent",
+            continue_fn=lambda partial: self.llm.acontinue(partial, SYSTEM_PROMPT, priority=priority),
+        )
+        if content is None:
+            self.llm.invalidate(user_prompt, SYSTEM_PROMPT, json_mode=True)
+        return content
@@ -0,0 +1,94 @@
+import os
+import time
+import asyncio
+from server.agents.planner_agent.planner import PlannerAgent
+from server.agents.content_agent.content import ContentAgent
+from server.shared.schemas import Chapter, ChapterContent, CourseRoadmap
+from server.core.logger import log
+from typing import AsyncIterator, Awaitable, Callable, Optional, Tuple
+
+COURSE_MAX_CONCURRENCY = int(os.getenv("COURSE_MAX_CONCURRENCY", "4"))
+COURSE_CHAPTER_RETRIES = int(os.getenv("COURSE_CHAPTER_RETRIES", "2"))
+
+class CourseAgent:
+    """
+    Orchestrates a whole course: the roadmap from the PlannerAgent, then every
+    chapter from the ContentAgent, generated concurrently under a cap.
+
+    `plan_roadmap` / `generate_chapter` default to the agents' own methods; the
+    API passes its coalesced versions so a full-course run shares in-flight
+    work with the single roadmap/chapter endpoints.
+    """
+
+    def __init__(self, planner: Optional[PlannerAgent] = None, content: Optional[ContentAgent] = None,
+                 plan_roadmap: Optional[Callable[[str, str, str], Awaitable[Optional[CourseRoadmap]]]] = None,
+                 generate_chapter: Optional[Callable[[Chapter], Awaitable[Optional[ChapterContent]]]] = None):
+        self.planner = planner or PlannerAgent()
+        self.content = content or ContentAgent()
+        # (topic, grade_level, framework); the planner itself does not use the framework
+        self.plan_roadmap = plan_roadmap or (lambda topic, grade_level, framework: self.planner.generate_roadmap(topic, grade_level))
+        self.generate_chapter = generate_chapter or self.content.generate_chapter_content
+
+    async def generate_full_course(self, topic: str, grade_level: str, framework: str = "General",
+                                   max_concurrency: Optional[int] = None,
+                                   retries: int = COURSE_CHAPTER_RETRIES) -> AsyncIterator[Tuple[str, object]]:
+        """
+        Yields (event, payload) pairs as work completes:
+          ("roadmap", CourseRoadmap)
+          ("chapter", {"chapter_number", "content"})   - in completion order
+          ("chapter_failed", {"chapter_number", "title", "error"})
+          ("done", {"completed", "failed", "elapsed_seconds"})
+          ("error", str)                               - roadmap could not be planned
+        """
+        start = time.monotonic()
+        try:
+            roadmap = await self.plan_roadmap(topic, grade_level, framework)
+        except Exception as e:
+            print(f"Roadmap failed: {e}")
+            roadmap = None
+        if not roadmap:
+            yield "error", "Failed to generate roadmap"
+            return
+        yield "roadmap", roadmap
+
+        semaphore = asyncio.Semaphore(max(1, max_concurrency or COURSE_MAX_CONCURRENCY))
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def run(chapter: Chapter):
+            async with semaphore:
+                error = "empty response"
+                for attempt in range(retries + 1):
+                    try:
+                        content = await self.generate_chapter(chapter)
+                    except Exception as e:
+                        content, error = None, str(e)
+                    if content:
+                        await results.put(("chapter", {"chapter_number": chapter.chapter_number, "content": content}))
+                        return
+                    log.warning("course.chapter_retry", topic=topic, chapter=chapter.chapter_number, attempt=attempt, error=error)
+                    if attempt < retries:
+                        await asyncio.sleep(0.5 * 2 ** attempt)
+                await results.put(("chapter_failed", {
+                    "chapter_number": chapter.chapter_number,
+                    "title": chapter.title,
+                    "error": error,
+                }))
+
+        tasks = [asyncio.ensure_future(run(chapter)) for chapter in roadmap.chapters]
+        completed, failed = 0, []
+        try:
+            for _ in tasks:
+                event, payload = await results.get()
+                if event == "chapter":
+                    completed += 1
+                else:
+                    failed.append(payload["chapter_number"])
+                yield event, payload
+        finally:
+            # Client went away: stop the remaining chapters
+            for task in tasks:
+                task.cancel()
+
+        elapsed = time.monotonic() - start
+        log.info("course.full_done", topic=topic, completed=completed, failed=failed, elapsed=elapsed)
+        yield "done", {"completed": completed, "failed": failed, "elapsed_seconds": round(elapsed, 2)}
@@ -0,0 +1,164 @@
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from server.shared.schemas import Chapter, ChapterContent, CourseRoadmap
+from server.core.scheduler import PRIORITY_BACKGROUND
+from server.core.logger import log
+from typing import Awaitable, Callable, Dict, Optional
+
+# How many chapters ahead of the reader to generate
+PREFETCH_CHAPTERS = int(os.getenv("PREFETCH_CHAPTERS", "3"))
+PREFETCH_VIDEO_SCRIPTS = os.getenv("PREFETCH_VIDEO_SCRIPTS", "0") == "1"
+# A roadmap nobody has opened a chapter of for this long counts as abandoned
+PREFETCH_IDLE_SECONDS = float(os.getenv("PREFETCH_IDLE_SECONDS", "600"))
+PREFETCH_MAX_ROADMAPS = int(os.getenv("PREFETCH_MAX_ROADMAPS", "50"))
+
+
+def roadmap_id(roadmap: CourseRoadmap) -> str:
+    return hashlib.sha256(roadmap.model_dump_json().encode("utf-8")).hexdigest()[:16]
+
+
+class _PrefetchJob:
+    def __init__(self, roadmap: CourseRoadmap):
+        self.roadmap = roadmap
+        self.last_touched = time.monotonic()
+        self.cursor = 0            # index of the chapter the reader last opened
+        self.done = set()          # chapter indexes already generated
+        self.task: Optional[asyncio.Task] = None
+        self.wakeup = asyncio.Event()
+
+
+class ChapterPrefetcher:
+    """
+    Speculatively generates the next chapters of a roadmap at background
+    priority, so the reader's next /generate/chapter is a cache hit.
+
+    The window follows the reader: opening chapter n prefetches n+1..n+K.
+    Work for a roadmap stops when it is cancelled explicitly, after
+    PREFETCH_IDLE_SECONDS without a chapter request, or when it is the oldest
+    of more than PREFETCH_MAX_ROADMAPS tracked roadmaps.
+    """
+
+    def __init__(self, generate_chapter: Callable[..., Awaitable[Optional[ChapterContent]]],
+                 generate_script: Optional[Callable[[str], Awaitable[object]]] = None,
+                 chapters: int = PREFETCH_CHAPTERS, idle_seconds: float = PREFETCH_IDLE_SECONDS,
+                 max_roadmaps: int = PREFETCH_MAX_ROADMAPS):
+        self.generate_chapter = generate_chapter
+        self.generate_script = generate_script if PREFETCH_VIDEO_SCRIPTS else None
+        self.chapters = chapters
+        self.idle_seconds = idle_seconds
+        self.max_roadmaps = max_roadmaps
+        self._jobs: "OrderedDict[str, _PrefetchJob]" = OrderedDict()
+        self._chapter_index: Dict[str, tuple] = {}  # chapter key -> (roadmap id, chapter index)
+
+        self.prefetched = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.hits = 0
+
+    def schedule(self, roadmap: CourseRoadmap) -> str:
+        rid = roadmap_id(roadmap)
+        self._reap()
+        job = self._jobs.get(rid)
+        if job is None:
+            job = self._jobs[rid] = _PrefetchJob(roadmap)
+            for idx, chapter in enumerate(roadmap.chapters):
+                self._chapter_index[self._chapter_key(chapter)] = (rid, idx)
+            job.task = asyncio.ensure_future(self._run(rid, job))
+            while len(self._jobs) > self.max_roadmaps:
+                oldest = next(iter(self._jobs))
+                self.cancel(oldest)
+        else:
+            job.last_touched = time.monotonic()
+        self._jobs.move_to_end(rid)
+        return rid
+
+    def touch(self, chapter: Chapter):
+        """Called on every chapter request: keeps the roadmap alive and slides the window."""
+        found = self._chapter_index.get(self._chapter_key(chapter))
+        if not found:
+            return
+        rid, idx = found
+        job = self._jobs.get(rid)
+        if job is None:
+            return
+        if idx in job.done:
+            self.hits += 1
+        job.last_touched = time.monotonic()
+        job.cursor = max(job.cursor, idx)
+        job.wakeup.set()
+        self._jobs.move_to_end(rid)
+
+    def cancel(self, rid: str) -> bool:
+        job = self._jobs.pop(rid, None)
+        if job is None:
+            return False
+        for chapter in job.roadmap.chapters:
+            self._chapter_index.pop(self._chapter_key(chapter), None)
+        if job.task and not job.task.done():
+            job.task.cancel()
+            self.cancelled += 1
+        log.info("prefetch.cancelled", roadmap_id=rid)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "active_roadmaps": len(self._jobs),
+            "prefetched": self.prefetched,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "hits": self.hits,
+        }
+
+    def _chapter_key(self, chapter: Chapter) -> str:
+        return f"{chapter.chapter_number}|{' '.join(chapter.title.lower().split())}"
+
+    def _reap(self):
+        now = time.monotonic()
+        for rid in [rid for rid, job in self._jobs.items() if now - job.last_touched > self.idle_seconds]:
+            self.cancel(rid)
+
+    async def _run(self, rid: str, job: _PrefetchJob):
+        chapters = job.roadmap.chapters
+        while True:
+            if time.monotonic() - job.last_touched > self.idle_seconds:
+                self.cancel(rid)
+                return
+            window = range(job.cursor, min(len(chapters), job.cursor + self.chapters + 1))
+            pending = [idx for idx in window if idx not in job.done]
+            if not pending:
+                if all(idx in job.done for idx in range(job.cursor, len(chapters))):
+                    # Everything from the reader's position to the end is generated
+                    return
+                job.wakeup.clear()
+                try:
+                    await asyncio.wait_for(job.wakeup.wait(), timeout=self.idle_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            idx = pending[0]
+            chapter = chapters[idx]
+            try:
+                content = await self.generate_chapter(chapter, priority=PRIORITY_BACKGROUND)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                content = None
+                log.warning("prefetch.chapter_failed", roadmap_id=rid, chapter=chapter.chapter_number, error=str(e))
+            job.done.add(idx)
+            if not content:
+                self.failed += 1
+                continue
+            self.prefetched += 1
+            log.info("prefetch.chapter_ready", roadmap_id=rid, chapter=chapter.chapter_number)
+
+            if self.generate_script:
+                try:
+                    await self.generate_script(content.content_markdown)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    log.warning("prefetch.script_failed", roadmap_id=rid, chapter=chapter.chapter_number, error=str(e))
@@ -0,0 +1,211 @@
+import os
+import re
+import wave
+import shutil
+import subprocess
+import numpy as np
+from typing import Iterable, List, Optional, Tuple
+from server.core.logger import log
+
+VIDEO_ENCODER = os.getenv("VIDEO_ENCODER", "auto")  # "ffmpeg", "moviepy" or "auto" (ffmpeg if available)
+VIDEO_SIZE = (1280, 720)
+# Slides are static, so a couple of frames per second is plenty
+VIDEO_STILL_FPS = int(os.getenv("VIDEO_STILL_FPS", "2"))
+SEGMENT_PAUSE_SECONDS = 0.5
+AUDIO_SAMPLE_RATE = 44100
+
+_DURATION_RE = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+_fallback_logged = False  # the moviepy fallback is reported once per process, not per segment
+
+
+def find_ffmpeg() -> Optional[str]:
+    """System ffmpeg, else the binary bundled with imageio-ffmpeg (a moviepy dependency)."""
+    path = shutil.which("ffmpeg")
+    if path:
+        return path
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return None
+
+
+def audio_duration(ffmpeg: Optional[str], path: str) -> float:
+    if path.endswith(".wav"):
+        with wave.open(path, "rb") as f:
+            return f.getnframes() / float(f.getframerate())
+    # No ffprobe in imageio-ffmpeg: read the duration from ffmpeg's input banner
+    result = subprocess.run([ffmpeg, "-hide_banner", "-i", path], capture_output=True, text=True)
+    match = _DURATION_RE.search(result.stderr)
+    if not match:
+        raise Exception(f"Could not read duration of {path}")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def segment_duration(ffmpeg: Optional[str], audio_path: str) -> float:
+    """Length of a segment: its narration plus the pause after it."""
+    return audio_duration(ffmpeg, audio_path) + SEGMENT_PAUSE_SECONDS
+
+
+class Encoder:
+    """
+    Turns (slide frame, narration audio path) pairs into one video file;
+    frames are RGB uint8 arrays. Segments are encoded independently (so
+    they can be spread across processes) and joined in order at the end.
+    """
+
+    name = ""
+
+    def encode_segment(self, frame: np.ndarray, audio_path: str, output_path: str,
+                       duration: Optional[float] = None, ts_offset: Optional[float] = None) -> float:
+        """
+        Encodes one segment to `output_path`; returns its duration in seconds.
+        `duration` skips probing the audio when already known; `ts_offset`
+        (MPEG-TS output only) is where the segment starts in the whole video.
+        """
+        raise NotImplementedError
+
+    def concat(self, segment_paths: List[str], output_path: str, workdir: str):
+        raise NotImplementedError
+
+    def encode(self, segments: Iterable[Tuple[np.ndarray, str]], output_path: str, workdir: str) -> int:
+        """Sequential encode of a whole video; returns the number of segments."""
+        paths = []
+        for idx, (frame, audio_path) in enumerate(segments):
+            segment_path = os.path.join(workdir, f"segment_{idx:04d}.mp4")
+            self.encode_segment(frame, audio_path, segment_path)
+            paths.append(segment_path)
+        if not paths:
+            raise Exception("No segments to encode")
+        self.concat(paths, output_path, workdir)
+        return len(paths)
+
+
+class FfmpegEncoder(Encoder):
+    """
+    Encodes each segment once from its still frame, piped in as raw RGB
+    and held with tpad for the narration's length (x264 stillimage tuning
+    at VIDEO_STILL_FPS), then joins the segments with the concat demuxer
+    and stream copy, with no second encode. Each segment is its own ffmpeg
+    process, so segments encode in parallel when spread across a pool.
+    """
+
+    name = "ffmpeg"
+
+    def __init__(self, ffmpeg: Optional[str] = None):
+        self.ffmpeg = ffmpeg or find_ffmpeg()
+        if not self.ffmpeg:
+            raise Exception("ffmpeg not found")
+
+    def encode_segment(self, frame: np.ndarray, audio_path: str, output_path: str,
+                       duration: Optional[float] = None, ts_offset: Optional[float] = None) -> float:
+        if duration is None:
+            duration = segment_duration(self.ffmpeg, audio_path)
+        height, width = frame.shape[:2]
+        # HLS segments carry their position in the lecture, so players see one continuous timeline
+        ts_args = ["-f", "mpegts", "-output_ts_offset", f"{ts_offset:.3f}"] if ts_offset is not None else []
+        cmd = [
+            self.ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}",
+            "-framerate", str(VIDEO_STILL_FPS), "-i", "pipe:0",
+            "-i", audio_path,
+            "-vf", f"tpad=stop_mode=clone:stop_duration={duration:.3f},scale={VIDEO_SIZE[0]}:{VIDEO_SIZE[1]}",
+            "-af", f"apad=pad_dur={SEGMENT_PAUSE_SECONDS}",
+            "-t", f"{duration:.3f}",
+            *self._output_args(),
+            *ts_args,
+            output_path,
+        ]
+        self._run(cmd, np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+        return duration
+
+    def concat(self, segment_paths: List[str], output_path: str, workdir: str):
+        list_path = os.path.join(workdir, "segments.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for path in segment_paths:
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        self._run([
+            self.ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-c", "copy", "-movflags", "+faststart",
+            output_path,
+        ])
+
+    def _output_args(self) -> List[str]:
+        # Identical parameters for every segment, so they can be joined without re-encoding
+        return [
+            "-c:v", "libx264", "-preset", "veryfast", "-tune", "stillimage",
+            "-r", str(VIDEO_STILL_FPS), "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", "128k", "-ar", str(AUDIO_SAMPLE_RATE), "-ac", "2",
+        ]
+
+    def _run(self, cmd: List[str], stdin: Optional[bytes] = None):
+        result = subprocess.run(cmd, input=stdin, capture_output=True)
+        if result.returncode != 0:
+            stderr = result.stderr.decode("utf-8", "replace").strip()
+            raise Exception(f"ffmpeg failed ({result.returncode}): {stderr[-500:]}")
+
+
+class MoviePyEncoder(Encoder):
+    """The original moviepy pipeline (24 fps), one file per segment, re-encoded again when joined."""
+
+    name = "moviepy"
+
+    def encode_segment(self, frame: np.ndarray, audio_path: str, output_path: str,
+                       duration: Optional[float] = None, ts_offset: Optional[float] = None) -> float:
+        from moviepy.editor import AudioFileClip, ColorClip, ImageClip
+
+        audio_clip = AudioFileClip(audio_path)
+        duration = audio_clip.duration + SEGMENT_PAUSE_SECONDS
+        try:
+            video_clip = ImageClip(frame).set_duration(duration)
+        except Exception as e:
+            print(f"Error creating image clip: {e}. Fallback to black.")
+            video_clip = ColorClip(size=VIDEO_SIZE, color=(0, 0, 0), duration=duration)
+        try:
+            self._write(video_clip.set_audio(audio_clip), output_path)
+        finally:
+            audio_clip.close()
+        return duration
+
+    def concat(self, segment_paths: List[str], output_path: str, workdir: str):
+        from moviepy.editor import VideoFileClip, concatenate_videoclips
+
+        clips = [VideoFileClip(path) for path in segment_paths]
+        try:
+            self._write(concatenate_videoclips(clips), output_path)
+        finally:
+            for clip in clips:
+                clip.close()
+
+    def _write(self, clip, output_path: str):
+        # Keep moviepy's temporary audio file next to the output (the job's workdir), never in the cwd
+        temp_audio = os.path.splitext(output_path)[0] + "_audio.m4a"
+        clip.write_videofile(output_path, fps=24, codec="libx264", audio_codec="aac",
+                             temp_audiofile=temp_audio, logger=None)
+
+
+def encoder_name(name: Optional[str] = None) -> str:
+    """The encoder `name` ("auto" included) resolves to on this machine."""
+    name = name or VIDEO_ENCODER
+    if name in ("moviepy", "ffmpeg"):
+        return name
+    return "ffmpeg" if find_ffmpeg() else "moviepy"
+
+
+def get_encoder(name: Optional[str] = None) -> Encoder:
+    name = name or VIDEO_ENCODER
+    if name == "moviepy":
+        return MoviePyEncoder()
+    if name == "ffmpeg":
+        return FfmpegEncoder()
+    ffmpeg = find_ffmpeg()
+    if ffmpeg:
+        return FfmpegEncoder(ffmpeg)
+    global _fallback_logged
+    if not _fallback_logged:
+        _fallback_logged = True
+        log.warning("video.encoder_fallback", encoder="moviepy", reason="ffmpeg not found")
+    return MoviePyEncoder()
@@ -0,0 +1,76 @@
+import os
+import math
+from typing import List
+
+VIDEO_HLS = os.getenv("VIDEO_HLS", "1") == "1"  # progressive HLS alongside the MP4 (ffmpeg encoder only)
+HLS_PLAYLIST = "index.m3u8"
+
+
+class HlsPlaylist:
+    """
+    An EVENT playlist that grows while a video renders.
+
+    Segments finish out of order (they encode in parallel), but a segment
+    is only listed once every segment before it is listed, so the playlist
+    is always a playable prefix of the lecture. Durations are known up front
+    from the narration audio, which fixes the target duration and lets each
+    segment be encoded at its final timestamp offset.
+    """
+
+    def __init__(self, directory: str, durations: List[float]):
+        self.directory = directory
+        self.durations = durations
+        self.offsets = [sum(durations[:idx]) for idx in range(len(durations))]
+        # Must cover every segment, including those not listed yet
+        self.target_duration = max(1, math.ceil(max(durations, default=1)))
+        self.published = 0
+        self._done = [False] * len(durations)
+        self._ended = False
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, HLS_PLAYLIST)
+
+    def segment_name(self, idx: int) -> str:
+        return f"seg_{idx:04d}.ts"
+
+    def segment_path(self, idx: int) -> str:
+        return os.path.join(self.directory, self.segment_name(idx))
+
+    def segment_paths(self) -> List[str]:
+        return [self.segment_path(idx) for idx in range(len(self.durations))]
+
+    def complete(self, idx: int) -> int:
+        """Marks segment `idx` as written; returns how many segments are now listed."""
+        self._done[idx] = True
+        published = self.published
+        while published < len(self._done) and self._done[published]:
+            published += 1
+        if published != self.published:
+            self.published = published
+            self._write()
+        return self.published
+
+    def finish(self):
+        self._ended = True
+        self._write()
+
+    def _write(self):
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+        ]
+        for idx in range(self.published):
+            lines.append(f"#EXTINF:{self.durations[idx]:.3f},")
+            lines.append(self.segment_name(idx))
+        if self._ended:
+            lines.append("#EXT-X-ENDLIST")
+        # Players re-fetch the playlist while it grows; never let them read it half written
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
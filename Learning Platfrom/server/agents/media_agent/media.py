@@ -1,197 +1,222 @@
 
 import os
+import time
+import shutil
 import asyncio
+import tempfile
 import nest_asyncio
-import edge_tts
-from moviepy.editor import TextClip, AudioFileClip, CompositeVideoClip, ColorClip, concatenate_videoclips, ImageClip
 from server.core.llm import LLMService
-from PIL import Image, ImageDraw, ImageFont
-import textwrap
-import random
+from server.core.scheduler import PRIORITY_BACKGROUND
+from server.core.json_parser import parse_agent_output
+from server.core.metrics import VIDEO_ENCODE_SECONDS, stage_timer
+from server.shared.schemas import ScriptSegment
+from typing import Callable, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from server.core.logger import log
+from server.agents.media_agent.tts import TTSService
+from server.agents.media_agent.encoder import (
+    VIDEO_SIZE, VIDEO_STILL_FPS, SEGMENT_PAUSE_SECONDS, encoder_name, find_ffmpeg, get_encoder, segment_duration,
+)
+from server.agents.media_agent.hls import VIDEO_HLS, HlsPlaylist
+from server.agents.media_agent.slides import SLIDE_FONT_SIZE, SlideRenderer
+from server.agents.media_agent.video_cache import VideoCache, video_cache_key
+import numpy as np
 
 # Patch for nested asyncio loops (needed for edge-tts in some envs)
 nest_asyncio.apply()
 
+# Segments are rendered and encoded in parallel across this many processes
+VIDEO_WORKERS = int(os.getenv("VIDEO_WORKERS", str(os.cpu_count() or 2)))
+RENDER_TMP_DIR = os.getenv("RENDER_TMP_DIR", os.path.join("media_cache", "tmp"))
+
+_render_pool: Optional[ProcessPoolExecutor] = None
+_slide_renderer: Optional[SlideRenderer] = None
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    if _render_pool is None:
+        # spawn: a forked copy of the API process (event loop, sockets, threads) is not safe to reuse
+        _render_pool = ProcessPoolExecutor(max_workers=VIDEO_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _render_pool
+
+
+def shutdown_render_pool():
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=False, cancel_futures=True)
+        _render_pool = None
+
+
+def _render_segment(text: str, audio_path: str, output_path: str, encoder_name: Optional[str],
+                    duration: Optional[float] = None, ts_offset: Optional[float] = None) -> float:
+    """Runs in a render process: slide plus encode for one segment. Returns its duration."""
+    global _slide_renderer
+    if _slide_renderer is None:
+        # One renderer per process keeps its fonts and background pool warm across segments and jobs
+        _slide_renderer = SlideRenderer(VIDEO_SIZE)
+
+    # Increase text length limit for visuals since segments might be longer
+    display_text = text[:150] + "..." if len(text) > 150 else text
+    try:
+        frame = _slide_renderer.render(display_text)
+    except Exception as e:
+        print(f"Error creating slide: {e}. Fallback to black.")
+        frame = np.zeros((VIDEO_SIZE[1], VIDEO_SIZE[0], 3), dtype=np.uint8)
+    return get_encoder(encoder_name).encode_segment(frame, audio_path, output_path, duration, ts_offset)
+
+
+def _concat_segments(segment_paths: List[str], output_path: str, workdir: str, encoder_name: Optional[str]):
+    get_encoder(encoder_name).concat(segment_paths, output_path, workdir)
+
+
 class MediaAgent:
-    def __init__(self):
-        self.llm = LLMService()
+    def __init__(self, with_llm: bool = True):
+        self.llm = LLMService() if with_llm else None
+        self.tts = TTSService()
+        self.encoder = None  # VIDEO_ENCODER unless overridden
         self.output_dir = os.path.join(os.getcwd(), "client", "static", "videos")
         os.makedirs(self.output_dir, exist_ok=True)
-        
-    def _create_text_image(self, text, output_path, size=(1280, 720)):
-        # Create gradient background
-        width, height = size
-        img = Image.new('RGB', size, color='black')
-        draw = ImageDraw.Draw(img)
-        
-        # Simple gradient effect (vertical)
-        top_color = (random.randint(0, 50), random.randint(0, 50), random.randint(50, 150))
-        bottom_color = (random.randint(0, 30), random.randint(0, 30), random.randint(20, 80))
-        
-        for y in range(height):
-            r = int(top_color[0] + (bottom_color[0] - top_color[0]) * y / height)
-            g = int(top_color[1] + (bottom_color[1] - top_color[1]) * y / height)
-            b = int(top_color[2] + (bottom_color[2] - top_color[2]) * y / height)
-            draw.line([(0, y), (width, y)], fill=(r, g, b))
-            
-        # Draw text
-        try:
-            # Try to load a nice font, fallback to default
-            font = ImageFont.truetype("arial.ttf", 40)
-        except:
-            font = ImageFont.load_default()
-            
-        # Wrap text
-        lines = textwrap.wrap(text, width=50) # Adjust width based on font size roughly
-        
-        # Calculate text height to center it
-        text_height = 0
-        line_spacing = 10
-        for line in lines:
-            bbox = draw.textbbox((0, 0), line, font=font)
-            text_height += bbox[3] - bbox[1] + line_spacing
-            
-        current_y = (height - text_height) // 2
-        
-        for line in lines:
-            bbox = draw.textbbox((0, 0), line, font=font)
-            line_width = bbox[2] - bbox[0]
-            x = (width - line_width) // 2
-            
-            # Draw shadow/outline for readability
-            shadow_offset = 2
-            draw.text((x+shadow_offset, current_y+shadow_offset), line, font=font, fill='black')
-            draw.text((x, current_y), line, font=font, fill='white')
-            
-            current_y += bbox[3] - bbox[1] + line_spacing
-            
-        img.save(output_path)
-
-
-    async def generate_video(self, topic: str, content_markdown: str) -> str:
+        self.videos = VideoCache(self.output_dir, RENDER_TMP_DIR, audio_dir=self.tts.cache_dir)
+
+    def video_key(self, content_markdown: str) -> str:
+        """Cache key of the video for this content with the current voice and render settings."""
+        return video_cache_key(
+            content_markdown,
+            tts=self.tts.backend.name,
+            voice=self.tts.voice,
+            rate=self.tts.rate,
+            encoder=encoder_name(self.encoder),
+            size=list(VIDEO_SIZE),
+            fps=VIDEO_STILL_FPS,
+            pause=SEGMENT_PAUSE_SECONDS,
+            font_size=SLIDE_FONT_SIZE,
+        )
+
+    async def generate_video(self, topic: str, content_markdown: str,
+                             progress: Optional[Callable[..., None]] = None) -> str:
         """
         Generates a video summary for the given content.
-        Returns the relative path to the generated video.
+        Returns the relative path to the generated video; a video already
+        rendered from the same content and settings is returned as is.
+
+        The script and the TTS calls run on the event loop (they are network
+        bound); slides and encoding run in the render process pool, so they
+        never block the API. `progress(**fields)` receives stage and segment
+        updates.
         """
         print(f"DEBUG: Starting video generation for {topic}")
-        
+        report = progress or (lambda **fields: None)
+        key = self.video_key(content_markdown)
+        cached = self.videos.lookup(key)
+        if cached:
+            log.info("media.video_cached", topic=topic, key=key)
+            return cached
+
         # 1. Generate Script
-        script = self._generate_script(content_markdown)
+        report(stage="script")
+        with stage_timer("MediaAgent", "script"):
+            script = await self._generate_script(content_markdown)
         if not script:
             raise Exception("Failed to generate video script")
-            
-        print(f"DEBUG: Script generated. Type: {type(script)}")
-        import json
-        try:
-            print(f"DEBUG: Script preview: {json.dumps(script)[:500]}")
-        except:
-             print(f"DEBUG: Script preview (raw): {script}")
-
-        # Ensure script is a list
-        if isinstance(script, dict):
-             # Handle case where LLM returns {"script": [...]} or similar
-             if "script" in script and isinstance(script["script"], list):
-                 script = script["script"]
-             elif "segments" in script and isinstance(script["segments"], list):
-                 script = script["segments"]
-             else:
-                 # Try to find any list value
-                 found_list = False
-                 for key, val in script.items():
-                     if isinstance(val, list):
-                         script = val
-                         found_list = True
-                         break
-                 if not found_list:
-                     print("DEBUG: Dictionary returned but no list found. Wrapping in list.")
-                     script = [script]
-
-        if not isinstance(script, list):
-            print("DEBUG: Script is not a list. Wrapping in list.")
-            script = [script]
-            
-        print(f"DEBUG: Processing {len(script)} segments")
-        
-        # 2. Generate Audio and Clips
-        clips = []
+
+        texts = [segment["text"] for segment in script if segment["text"].strip()]
+        print(f"DEBUG: Processing {len(texts)} segments")
+
+        with stage_timer("MediaAgent", "render"):
+            return await self._render(topic, texts, report, filename=self.videos.filename(key))
+
+    async def _render(self, topic: str, texts: List[str], progress: Callable[..., None],
+                      filename: Optional[str] = None) -> Optional[str]:
+        """Audio, slides and encoding for an already written script."""
+        loop = asyncio.get_running_loop()
+        pool = get_render_pool()
+        os.makedirs(RENDER_TMP_DIR, exist_ok=True)
+        # Per-job scratch space: concurrent renders never share file names
+        workdir = tempfile.mkdtemp(prefix="render_", dir=RENDER_TMP_DIR)
+        self.videos.register(workdir)
+        stream_dir = None
         try:
-            for idx, segment in enumerate(script):
-                print(f"DEBUG: Processing segment {idx+1}/{len(script)}")
-                text = ""
-                if isinstance(segment, str):
-                    text = segment
-                elif isinstance(segment, dict):
-                    text = segment.get('text', '')
-                    if not text:
-                         # Try other common keys
-                         text = segment.get('content', '') or segment.get('narration', '') or segment.get('script', '')
-                else:
-                    print(f"DEBUG: Unknown segment type: {type(segment)}")
-                    continue
-                
-                if not text:
-                    print(f"DEBUG: Empty text for segment {idx}")
-                    continue
-
-                print(f"DEBUG: Segment text length: {len(text)}")
-                
-                # Increase text length limit for visuals since segments might be longer
-                display_text = text[:150] + "..." if len(text) > 150 else text
-                
-                # Audio
-                audio_path = os.path.join(self.output_dir, f"temp_{idx}.mp3")
-                communicate = edge_tts.Communicate(text, "en-US-AriaNeural")
-                await communicate.save(audio_path)
-                
-                audio_clip = AudioFileClip(audio_path)
-                duration = audio_clip.duration + 0.5 # Add small pause
-                
-                # Visual (Pillow Image with Text)
-                try:
-                    # Create image using PIL
-                    img_path = os.path.join(self.output_dir, f"frame_{idx}.png")
-                    self._create_text_image(display_text, img_path)
-                    
-                    # Create ImageClip
-                    video_clip = ImageClip(img_path).set_duration(duration)
-                except Exception as e:
-                    print(f"Error creating image clip: {e}. Fallback to black.")
-                    video_clip = ColorClip(size=(1280, 720), color=(0,0,0), duration=duration)
-
-                video_clip = video_clip.set_audio(audio_clip)
-                clips.append(video_clip)
-            
-            if not clips:
-                raise Exception("No clips were generated! Check script content.")
-
-            # 3. Concatenate and Write
-            final_video = concatenate_videoclips(clips)
-            filename = f"video_{topic.replace(' ', '_')}_{int(asyncio.get_event_loop().time())}.mp4"
-            output_path = os.path.join(self.output_dir, filename)
-            
-            final_video.write_videofile(output_path, fps=24, codec="libx264", audio_codec="aac")
-            
-            # Cleanup temp files
-            for idx in range(len(script)):
+            # 2. Generate Audio (all segments concurrently, cached by text/voice/rate)
+            with stage_timer("MediaAgent", "tts"):
+                audio_paths = await self.tts.synthesize_all(
+                    texts, lambda done, total: progress(stage="tts", segments_done=done, segments_total=total)
+                )
+
+            # 3. Slides and per-segment encodes, in parallel across the pool
+            filename = filename or f"video_{topic.replace(' ', '_')}_{int(time.time())}.mp4"
+            if VIDEO_HLS and encoder_name(self.encoder) == "ffmpeg":
+                # Progressive output: segments are published to an HLS playlist as they finish,
+                # so playback can start long before the MP4 exists
+                ffmpeg = find_ffmpeg()
+                durations = await asyncio.gather(*(asyncio.to_thread(segment_duration, ffmpeg, path) for path in audio_paths))
+                stream_dir = self.videos.stream_dir(filename)
+                self.videos.register(stream_dir)
+                playlist = HlsPlaylist(stream_dir, list(durations))
+                segment_paths = playlist.segment_paths()
+            else:
+                playlist = None
+                segment_paths = [os.path.join(workdir, f"segment_{idx:04d}.mp4") for idx in range(len(texts))]
+
+            async def encode(idx: int):
+                if playlist is None:
+                    await loop.run_in_executor(pool, _render_segment, texts[idx], audio_paths[idx],
+                                               segment_paths[idx], self.encoder)
+                    return
+                # Written under a temporary name: players must never fetch a half-written segment
+                part_path = segment_paths[idx][:-len(".ts")] + ".part.ts"
+                await loop.run_in_executor(pool, _render_segment, texts[idx], audio_paths[idx], part_path,
+                                           self.encoder, playlist.durations[idx], playlist.offsets[idx])
+                os.replace(part_path, segment_paths[idx])
+                was_playable = playlist.published > 0
+                playlist.complete(idx)
+                if not was_playable and playlist.published:
+                    progress(stream_url=self.videos.stream_url(filename))
+                    log.info("media.stream_ready", topic=topic, segments=len(texts))
+
+            progress(stage="segments", segments_done=0, segments_total=len(texts))
+            tasks = [asyncio.ensure_future(encode(idx)) for idx in range(len(texts))]
+            done = 0
+            with VIDEO_ENCODE_SECONDS.time():
                 try:
-                    os.remove(os.path.join(self.output_dir, f"temp_{idx}.mp3"))
-                    os.remove(os.path.join(self.output_dir, f"frame_{idx}.png"))
-                except:
-                    pass
-                    
+                    for task in asyncio.as_completed(tasks):
+                        await task
+                        done += 1
+                        progress(stage="segments", segments_done=done, segments_total=len(texts))
+                except BaseException:
+                    for task in tasks:
+                        task.cancel()
+                    raise
+                if playlist:
+                    playlist.finish()
+
+                # 4. Join in script order (the MP4 is a stream copy of the HLS segments when streaming)
+                progress(stage="encode", segments_done=done, segments_total=len(texts))
+                tmp_output = os.path.join(workdir, filename)
+                await loop.run_in_executor(pool, _concat_segments, segment_paths, tmp_output, workdir, self.encoder)
+            os.replace(tmp_output, os.path.join(self.output_dir, filename))
+            log.info("media.video_ready", topic=topic, segments=len(texts), workers=VIDEO_WORKERS)
+
             # Return relative path for frontend
             return f"/static/videos/{filename}"
 
         except Exception as e:
             error_msg = f"Error in video generation: {e}"
             print(error_msg)
-            with open("debug_media.txt", "a") as f:
-                f.write(error_msg + "\n")
-                import traceback
-                f.write(traceback.format_exc() + "\n")
+            import traceback
+            log.error("media.video_failed", topic=topic, error=str(e), traceback=traceback.format_exc())
+            if stream_dir:
+                shutil.rmtree(stream_dir, ignore_errors=True)
             return None
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+            self.videos.release(workdir)
+            if stream_dir:
+                # Kept for viewers still on the stream; the janitor removes it once it goes stale
+                self.videos.release(stream_dir)
 
-    def _generate_script(self, content: str):
+    async def _generate_script(self, content: str):
         prompt = (
             "You are an expert educational content creator. Your task is to produce a comprehensive **5-minute video lecture script** based on the following topic/content.\n"
             "CRITICAL INSTRUCTION: Even if the input content is short or summary-level, you MUST expand upon it, add examples, context, historical background, and deep explanations to reach the 5-minute target (approx. 800-1000 words).\n"
@@ -199,22 +224,15 @@ class MediaAgent:
             "Return ONLY a JSON array of objects, where each object has a 'text' field.\n"
             "Example: [{'text': 'Welcome to this in-depth lecture on...'}, {'text': 'To truly understand this, we must look at...'}]\n"
         )
-        response = self.llm.generate(content[:6000], prompt, json_mode=True)
+        response = await self.llm.agenerate(content[:6000], prompt, json_mode=True, priority=PRIORITY_BACKGROUND)
         if response:
             print(f"DEBUG: LLM Response (first 200 chars): {response[:200]}")
-            import json
-            try:
-                clean_json = response.replace("```json", "").replace("```", "").strip()
-                # Find the first '[' and last ']' to handle potential extra text
-                start = clean_json.find('[')
-                end = clean_json.rfind(']')
-                if start != -1 and end != -1:
-                     clean_json = clean_json[start:end+1]
-                elif clean_json.startswith('{'):
-                     # Might be a single object or wrapped in { "script": ... }
-                     pass 
-                
-                return json.loads(clean_json)
-            except Exception as e:
-                print(f"Failed to parse script JSON: {response[:500]}... Error: {e}")
+            # Handles {"script": [...]} wrappers and single-quoted output; a truncated array is continued
+            segments = await parse_agent_output(
+                response, List[ScriptSegment], "MediaAgent",
+                continue_fn=lambda partial: self.llm.acontinue(partial, prompt, priority=PRIORITY_BACKGROUND),
+            )
+            if segments:
+                return [segment.model_dump() for segment in segments]
+            self.llm.invalidate(content[:6000], prompt, json_mode=True)
         return None
@@ -0,0 +1,98 @@
+import os
+import random
+import textwrap
+import functools
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from typing import Dict, List, Tuple
+
+SLIDE_FONTS = ("arial.ttf", "DejaVuSans.ttf")
+SLIDE_FONT_SIZE = 40
+SLIDE_LINE_SPACING = 10
+SLIDE_WRAP_CHARS = 50
+# Distinct pre-rendered gradient backgrounds kept per slide size
+SLIDE_BACKGROUND_POOL = int(os.getenv("SLIDE_BACKGROUND_POOL", "8"))
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(size: int = SLIDE_FONT_SIZE):
+    """Loaded once per process instead of once per slide."""
+    for name in SLIDE_FONTS:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def gradient(size: Tuple[int, int], top: Tuple[int, int, int], bottom: Tuple[int, int, int]) -> np.ndarray:
+    """Vertical gradient as an (height, width, 3) uint8 array, built in one broadcast."""
+    width, height = size
+    t = (np.arange(height, dtype=np.float32) / height)[:, None]
+    rows = np.asarray(top, dtype=np.float32) + (np.asarray(bottom, dtype=np.float32) - np.asarray(top, dtype=np.float32)) * t
+    return np.broadcast_to(rows.astype(np.uint8)[:, None, :], (height, width, 3))
+
+
+class SlideRenderer:
+    """
+    Renders a narration slide (centered, shadowed text on a gradient) to an
+    in-memory RGB array for the encoder.
+
+    Gradients come from a small pool built on first use, fonts are loaded
+    once, and word widths are cached, so a slide costs one background copy
+    plus the text draw.
+    """
+
+    def __init__(self, size: Tuple[int, int] = (1280, 720), font_size: int = SLIDE_FONT_SIZE,
+                 pool_size: int = SLIDE_BACKGROUND_POOL):
+        self.size = size
+        self.font = load_font(font_size)
+        self.pool_size = pool_size
+        self._backgrounds: List[np.ndarray] = []
+        self._word_widths: Dict[str, float] = {}
+        self._space_width = self._text_width(" ")
+        ascent, descent = self.font.getmetrics() if hasattr(self.font, "getmetrics") else (font_size, 0)
+        self._line_height = ascent + descent
+
+    def background(self) -> np.ndarray:
+        if not self._backgrounds:
+            for _ in range(self.pool_size):
+                # Same palette ranges as the original per-slide random gradient
+                top = (random.randint(0, 50), random.randint(0, 50), random.randint(50, 150))
+                bottom = (random.randint(0, 30), random.randint(0, 30), random.randint(20, 80))
+                self._backgrounds.append(np.ascontiguousarray(gradient(self.size, top, bottom)))
+        return random.choice(self._backgrounds)
+
+    def render(self, text: str) -> np.ndarray:
+        img = Image.fromarray(self.background())  # copies, the pooled array stays untouched
+        draw = ImageDraw.Draw(img)
+        width, height = self.size
+
+        lines = textwrap.wrap(text, width=SLIDE_WRAP_CHARS)
+        step = self._line_height + SLIDE_LINE_SPACING
+        current_y = (height - step * len(lines)) // 2
+
+        for line in lines:
+            x = int((width - self._line_width(line)) // 2)
+            # Draw shadow/outline for readability
+            draw.text((x + 2, current_y + 2), line, font=self.font, fill='black')
+            draw.text((x, current_y), line, font=self.font, fill='white')
+            current_y += step
+
+        return np.asarray(img)
+
+    def _line_width(self, line: str) -> float:
+        words = line.split(" ")
+        return sum(self._text_width(w) for w in words) + self._space_width * (len(words) - 1)
+
+    def _text_width(self, word: str) -> float:
+        width = self._word_widths.get(word)
+        if width is None:
+            if hasattr(self.font, "getlength"):
+                width = self.font.getlength(word)
+            else:
+                bbox = self.font.getbbox(word)
+                width = bbox[2] - bbox[0]
+            if len(self._word_widths) < 50000:
+                self._word_widths[word] = width
+        return width
@@ -0,0 +1,143 @@
+import os
+import json
+import uuid
+import wave
+import asyncio
+import hashlib
+from typing import Callable, Dict, List, Optional
+from server.core.logger import log
+
+TTS_BACKEND = os.getenv("TTS_BACKEND", "edge")  # "edge" or "silent" (offline stand-in)
+TTS_VOICE = os.getenv("TTS_VOICE", "en-US-AriaNeural")
+TTS_RATE = os.getenv("TTS_RATE", "+0%")
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "8"))
+TTS_RETRIES = int(os.getenv("TTS_RETRIES", "2"))
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", os.path.join("media_cache", "audio"))
+
+
+class TTSBackend:
+    """A speech synthesizer: writes the audio for `text` to `output_path`."""
+
+    name = ""
+    extension = ".mp3"
+
+    async def synthesize(self, text: str, voice: str, rate: str, output_path: str):
+        raise NotImplementedError
+
+
+class EdgeTTSBackend(TTSBackend):
+    name = "edge"
+    extension = ".mp3"
+
+    async def synthesize(self, text: str, voice: str, rate: str, output_path: str):
+        import edge_tts
+        communicate = edge_tts.Communicate(text, voice, rate=rate)
+        await communicate.save(output_path)
+
+
+class SilentTTSBackend(TTSBackend):
+    """
+    Offline stand-in for tests and benchmarks: silence lasting roughly as
+    long as the text would take to read aloud (~150 words per minute).
+    """
+
+    name = "silent"
+    extension = ".wav"
+    sample_rate = 16000
+
+    async def synthesize(self, text: str, voice: str, rate: str, output_path: str):
+        seconds = max(1.0, len(text.split()) / 2.5)
+        with wave.open(output_path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(self.sample_rate)
+            f.writeframes(b"\x00\x00" * int(seconds * self.sample_rate))
+
+
+BACKENDS: Dict[str, type] = {
+    "edge": EdgeTTSBackend,
+    "silent": SilentTTSBackend,
+}
+
+
+def get_tts_backend(name: Optional[str] = None) -> TTSBackend:
+    name = name or TTS_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown TTS backend: {name}")
+    return BACKENDS[name]()
+
+
+class TTSService:
+    """
+    Synthesizes many segments concurrently (at most `concurrency` requests in
+    flight) through a content-addressed disk cache: audio is keyed by
+    (backend, voice, rate, text), so re-rendering a video or repeating a
+    sentence in another video reuses the file.
+    """
+
+    def __init__(self, backend: Optional[TTSBackend] = None, cache_dir: str = AUDIO_CACHE_DIR,
+                 concurrency: int = TTS_CONCURRENCY, voice: str = TTS_VOICE, rate: str = TTS_RATE):
+        self.backend = backend or get_tts_backend()
+        self.cache_dir = cache_dir
+        self.concurrency = concurrency
+        self.voice = voice
+        self.rate = rate
+        self.hits = 0
+        self.misses = 0
+
+    def cache_key(self, text: str, voice: str, rate: str) -> str:
+        payload = json.dumps([self.backend.name, voice, rate, text], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + self.backend.extension)
+
+    async def synthesize(self, text: str, voice: Optional[str] = None, rate: Optional[str] = None,
+                         semaphore: Optional[asyncio.Semaphore] = None) -> str:
+        voice = voice or self.voice
+        rate = rate or self.rate
+        path = self.cache_path(self.cache_key(text, voice, rate))
+        if os.path.exists(path):
+            self.hits += 1
+            os.utime(path)  # keeps recently used audio at the back of the eviction order
+            return path
+
+        self.misses += 1
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a unique name and rename, so concurrent renders never read a partial file
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp{self.backend.extension}"
+        semaphore = semaphore or asyncio.Semaphore(1)
+        async with semaphore:
+            for attempt in range(TTS_RETRIES + 1):
+                try:
+                    await self.backend.synthesize(text, voice, rate, tmp_path)
+                    break
+                except Exception as e:
+                    log.warning("tts.retry", backend=self.backend.name, attempt=attempt, error=str(e))
+                    if attempt == TTS_RETRIES:
+                        if os.path.exists(tmp_path):
+                            os.remove(tmp_path)
+                        raise
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+        os.replace(tmp_path, path)
+        return path
+
+    async def synthesize_all(self, texts: List[str], progress: Optional[Callable[[int, int], None]] = None) -> List[str]:
+        """Audio paths in the order of `texts`; `progress(done, total)` is called as each finishes."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        unique = list(dict.fromkeys(texts))  # a repeated sentence is synthesized once
+        done = 0
+
+        async def one(text: str) -> str:
+            nonlocal done
+            path = await self.synthesize(text, semaphore=semaphore)
+            done += 1
+            if progress:
+                progress(done, len(unique))
+            return path
+
+        paths = dict(zip(unique, await asyncio.gather(*(one(text) for text in unique))))
+        return [paths[text] for text in texts]
+
+    def stats(self) -> dict:
+        return {"backend": self.backend.name, "hits": self.hits, "misses": self.misses}
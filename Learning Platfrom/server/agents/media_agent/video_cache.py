@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+import hashlib
+import threading
+from typing import Callable, List, Optional, Set
+from server.core.logger import log
+from server.agents.media_agent.hls import HLS_PLAYLIST
+
+# Disk budgets; least recently used files are evicted past these
+VIDEO_CACHE_MAX_MB = float(os.getenv("VIDEO_CACHE_MAX_MB", "2048"))
+AUDIO_CACHE_MAX_MB = float(os.getenv("AUDIO_CACHE_MAX_MB", "512"))
+VIDEO_JANITOR_INTERVAL = float(os.getenv("VIDEO_JANITOR_INTERVAL", "600"))
+# Scratch files older than this with no render using them are leftovers of a crash
+ORPHAN_MAX_AGE_SECONDS = float(os.getenv("ORPHAN_MAX_AGE_SECONDS", "3600"))
+# Bump when a rendering change makes existing videos stale
+RENDER_VERSION = 1
+
+VIDEO_EXTENSION = ".mp4"
+STREAM_DIR_SUFFIX = "_hls"
+# moviepy names its temp audio "<output>TEMP_MPY_wvf_snd.<ext>" in the cwd when not told otherwise
+_MOVIEPY_TEMP_MARKER = "TEMP_MPY_"
+
+
+def video_cache_key(content_markdown: str, **settings) -> str:
+    """Hash of the content plus everything that changes the rendered output (voice, encoder, size...)."""
+    payload = json.dumps([RENDER_VERSION, content_markdown, settings], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _files(directory: str, extensions: Optional[tuple] = None) -> List[os.DirEntry]:
+    entries = []
+    if not os.path.isdir(directory):
+        return entries
+    for entry in os.scandir(directory):
+        if entry.is_dir(follow_symlinks=False):
+            entries.extend(_files(entry.path, extensions))
+        elif entry.is_file(follow_symlinks=False) and (extensions is None or entry.name.endswith(extensions)):
+            entries.append(entry)
+    return entries
+
+
+def _remove(path: str) -> bool:
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        return True
+    except OSError as e:
+        log.warning("media.cleanup_failed", path=path, error=str(e))
+        return False
+
+
+def evict_lru(directory: str, max_bytes: int, extensions: Optional[tuple] = None,
+              on_evict: Optional[Callable[[str], None]] = None) -> dict:
+    """
+    Deletes the least recently used files (oldest mtime; cache hits touch
+    their file) until `directory` fits in `max_bytes`.
+    """
+    entries = []
+    for entry in _files(directory, extensions):
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue  # removed while scanning
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    freed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if _remove(path):
+            total -= size
+            freed += size
+            evicted += 1
+            if on_evict:
+                on_evict(path)
+    return {"files": len(entries) - evicted, "bytes": total, "evicted": evicted, "freed": freed}
+
+
+class VideoCache:
+    """
+    Content-addressed store of rendered videos: a video is saved as
+    `video_<key>.mp4` where the key hashes the content and render settings,
+    so a repeated request is answered with the existing file.
+
+    sweep() (run periodically by the janitor) keeps the videos and the TTS
+    audio cache within their disk budgets, least recently used first, and
+    removes scratch files left behind by interrupted renders along with
+    HLS streams that are no longer being written.
+    """
+
+    def __init__(self, output_dir: str, scratch_dir: str, audio_dir: Optional[str] = None,
+                 max_bytes: int = int(VIDEO_CACHE_MAX_MB * 1024 * 1024),
+                 audio_max_bytes: int = int(AUDIO_CACHE_MAX_MB * 1024 * 1024),
+                 orphan_max_age: float = ORPHAN_MAX_AGE_SECONDS):
+        self.output_dir = output_dir
+        self.scratch_dir = scratch_dir
+        self.audio_dir = audio_dir
+        self.max_bytes = max_bytes
+        self.audio_max_bytes = audio_max_bytes
+        self.orphan_max_age = orphan_max_age
+
+        self._lock = threading.Lock()
+        self._active: Set[str] = set()  # scratch dirs of renders in progress
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.orphans_removed = 0
+        self.last_sweep: Optional[dict] = None
+
+    def filename(self, key: str) -> str:
+        return f"video_{key}{VIDEO_EXTENSION}"
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.output_dir, self.filename(key))
+
+    def url(self, key: str) -> str:
+        return f"/static/videos/{self.filename(key)}"
+
+    def stream_dir(self, filename: str) -> str:
+        """Directory of the HLS playlist and segments published while `filename` renders."""
+        return os.path.join(self.output_dir, os.path.splitext(filename)[0] + STREAM_DIR_SUFFIX)
+
+    def stream_url(self, filename: str) -> str:
+        return f"/static/videos/{os.path.splitext(filename)[0]}{STREAM_DIR_SUFFIX}/{HLS_PLAYLIST}"
+
+    def lookup(self, key: str) -> Optional[str]:
+        """URL of the cached video for `key`, or None."""
+        path = self.path(key)
+        try:
+            os.utime(path)  # marks it recently used
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.url(key)
+
+    def register(self, workdir: str):
+        """Protects a render's scratch directory from the janitor until release()."""
+        with self._lock:
+            self._active.add(os.path.abspath(workdir))
+
+    def release(self, workdir: str):
+        with self._lock:
+            self._active.discard(os.path.abspath(workdir))
+
+    def sweep(self) -> dict:
+        started = time.perf_counter()
+        orphans = self._remove_orphans()
+
+        def evicted(path: str):
+            name = os.path.basename(path)
+            stream_dir = self.stream_dir(name)
+            if os.path.isdir(stream_dir):
+                _remove(stream_dir)
+
+        videos = evict_lru(self.output_dir, self.max_bytes, (VIDEO_EXTENSION,), evicted)
+        audio = evict_lru(self.audio_dir, self.audio_max_bytes) if self.audio_dir else None
+        self.evicted += videos["evicted"]
+        self.orphans_removed += orphans
+        self.last_sweep = {
+            "videos": videos,
+            "audio": audio,
+            "orphans": orphans,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        if orphans or videos["evicted"] or (audio and audio["evicted"]):
+            log.info("media.sweep", **self.last_sweep)
+        return self.last_sweep
+
+    async def run_janitor(self, interval: float = VIDEO_JANITOR_INTERVAL):
+        """Sweeps every `interval` seconds until cancelled."""
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                log.error("media.sweep_failed", error=str(e))
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "orphans_removed": self.orphans_removed,
+            "active_renders": len(self._active),
+            "max_bytes": self.max_bytes,
+            "last_sweep": self.last_sweep,
+        }
+
+    def _remove_orphans(self) -> int:
+        cutoff = time.time() - self.orphan_max_age
+        with self._lock:
+            active = set(self._active)
+        candidates = []
+
+        # Render scratch dirs no live render owns
+        if os.path.isdir(self.scratch_dir):
+            for entry in os.scandir(self.scratch_dir):
+                if os.path.abspath(entry.path) not in active:
+                    candidates.append(entry.path)
+        # Half-written audio (tts writes "<key>.<uuid>.tmp<ext>" then renames)
+        if self.audio_dir:
+            candidates.extend(entry.path for entry in _files(self.audio_dir) if ".tmp" in entry.name)
+        # Anything in the video dir that is not a finished video, HLS streams no render is
+        # writing (viewers have moved on to the MP4 by now), and moviepy temp audio in the cwd
+        if os.path.isdir(self.output_dir):
+            for entry in os.scandir(self.output_dir):
+                if entry.is_dir():
+                    if os.path.abspath(entry.path) not in active:
+                        candidates.append(entry.path)
+                elif not entry.name.endswith(VIDEO_EXTENSION):
+                    candidates.append(entry.path)
+        candidates.extend(entry.path for entry in os.scandir(os.getcwd())
+                          if entry.is_file() and _MOVIEPY_TEMP_MARKER in entry.name)
+
+        removed = 0
+        for path in candidates:
+            try:
+                if os.path.getmtime(path) > cutoff:
+                    continue
+            except OSError:
+                continue
+            if _remove(path):
+                removed += 1
+        return removed
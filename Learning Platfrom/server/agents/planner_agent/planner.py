@@ -1,5 +1,7 @@
-import json
 from server.core.llm import LLMService
+from server.core.json_parser import parse_agent_output
+from server.core.metrics import stage_timer
+from server.core.logger import log
 from server.shared.schemas import CourseRoadmap, Chapter
 from typing import Optional
 
@@ -7,7 +9,7 @@ class PlannerAgent:
     def __init__(self):
         self.llm = LLMService()
 
-    def generate_roadmap(self, topic: str, grade_level: str) -> Optional[CourseRoadmap]:
+    async def generate_roadmap(self, topic: str, grade_level: str) -> Optional[CourseRoadmap]:
         system_prompt = (
             "You are an expert curriculum planner. Create a structured learning roadmap "
             "for the given topic and grade level. Return ONLY valid JSON matching the following structure: "
@@ -15,34 +17,21 @@ class PlannerAgent:
         )
         user_prompt = f"Create a course roadmap for '{topic}' at a '{grade_level}' level."
         
-        with open("debug_planner.txt", "a", encoding="utf-8") as f:
-            f.write(f"DEBUG: Generating roadmap for {topic}\n")
+        log.info("planner.generate", topic=topic, grade_level=grade_level)
         
-        response_text = self.llm.generate(user_prompt, system_prompt, json_mode=True)
+        with stage_timer("PlannerAgent", "llm"):
+            response_text = await self.llm.agenerate(user_prompt, system_prompt, json_mode=True)
         
-        with open("debug_planner.txt", "a", encoding="utf-8") as f:
-            f.write(f"DEBUG: Roadmap response: {response_text}\n")
+        log.info("planner.response", topic=topic, response=response_text)
         
         if not response_text:
             return None
 
-        # Clean markdown code blocks if present
-        cleaned_text = response_text.replace("```json", "").replace("```", "").strip()
-
-        try:
-            data = json.loads(cleaned_text)
-            # Validate with Pydantic
-            roadmap = CourseRoadmap(**data)
-            return roadmap
-        except json.JSONDecodeError:
-            msg = f"Failed to parse JSON: {cleaned_text}"
-            print(msg)
-            with open("debug_planner.txt", "a", encoding="utf-8") as f:
-                f.write(msg + "\n")
-            return None
-        except Exception as e:
-            msg = f"Validation error: {e}"
-            print(msg)
-            with open("debug_planner.txt", "a", encoding="utf-8") as f:
-                f.write(msg + "\n")
-            return None
+        # Repairs and validates; a truncated roadmap is continued rather than regenerated
+        roadmap = await parse_agent_output(
+            response_text, CourseRoadmap, "PlannerAgent",
+            continue_fn=lambda partial: self.llm.acontinue(partial, system_prompt),
+        )
+        if roadmap is None:
+            self.llm.invalidate(user_prompt, system_prompt, json_mode=True)
+        return roadmap
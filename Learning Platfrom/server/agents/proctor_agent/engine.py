@@ -0,0 +1,323 @@
+import os
+import time
+import zlib
+import queue
+import asyncio
+import itertools
+import threading
+import multiprocessing
+from typing import Dict, List, Optional, Tuple
+from server.shared.schemas import ProctorStatus
+from server.core.logger import log
+from server.core.metrics import AGENT_STAGE_SECONDS, PROCTOR_FRAMES, PROCTOR_FRAMES_REUSED, proctor_frame_rate
+
+# One inference process per core by default; each user is pinned to one of them
+PROCTOR_WORKERS = int(os.getenv("PROCTOR_WORKERS", str(os.cpu_count() or 2)))
+PROCTOR_FRAME_TIMEOUT = float(os.getenv("PROCTOR_FRAME_TIMEOUT", "10"))
+PROCTOR_HEALTH_INTERVAL = float(os.getenv("PROCTOR_HEALTH_INTERVAL", "5"))
+PROCTOR_HEALTH_TIMEOUT = float(os.getenv("PROCTOR_HEALTH_TIMEOUT", "10"))
+# Minimum gap between restarts of one worker, so a crash loop does not spin
+PROCTOR_RESTART_BACKOFF = float(os.getenv("PROCTOR_RESTART_BACKOFF", "1"))
+
+
+class WorkerLost(Exception):
+    """The worker died or hung while handling a request; it is being restarted."""
+
+
+def _worker_main(conn, index: int):
+    """Entry point of a proctor process: answers (request id, op, args) messages in order."""
+    agent = None
+    while True:
+        try:
+            request_id, op, args = conn.recv()
+        except (EOFError, OSError):
+            return  # parent went away
+        try:
+            if op == "ping":
+                # Doubles as the stats report: the parent keeps the latest one
+                result = {"pid": os.getpid(), **(agent.sessions.stats() if agent else {"sessions": 0})}
+            elif op == "frame":
+                if agent is None:
+                    # Imported here: cv2/mediapipe load in the workers, never in the API process
+                    from server.agents.proctor_agent.proctor import ProctorAgent
+                    agent = ProctorAgent()
+                status, reused = agent.process_frame_gated(*args)
+                result = (status.model_dump(), reused, agent.stage_seconds)
+            elif op == "close":
+                result = agent.close_session(*args) if agent else False
+            else:
+                raise ValueError(f"Unknown op: {op}")
+            conn.send((request_id, True, result))
+        except Exception as e:
+            conn.send((request_id, False, f"{type(e).__name__}: {e}"))
+
+
+class ProctorWorker:
+    """
+    One inference process with its own FaceMesh, driven over a pipe. A
+    writer thread sends requests and a reader thread receives replies, so a
+    frame larger than the pipe buffer never blocks the event loop while the
+    worker is busy.
+    """
+
+    def __init__(self, index: int, context):
+        self.index = index
+        self._context = context
+        self._process = None
+        self._conn = None
+        self._outbox: Optional[queue.Queue] = None
+        self._pending_lock = threading.Lock()
+        self._pending: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+        self._ids = itertools.count()
+        self.generation = 0  # bumped on every (re)start
+
+        self.frames = 0
+        self.reused = 0
+        self.errors = 0
+        self.restarts = 0
+        self.started_at = 0.0
+        self.ping_seconds: Optional[float] = None
+        self.sessions: Optional[dict] = None  # session pool stats from the last ping
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self._process.pid if self._process else None
+
+    def alive(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        # Fresh map and outbox per connection: the old threads can only fail requests sent on the old pipe
+        self._pending = {}
+        self._outbox = queue.Queue()
+        parent_conn, child_conn = self._context.Pipe()
+        self._process = self._context.Process(
+            target=_worker_main, args=(child_conn, self.index), name=f"proctor-{self.index}", daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+        self.started_at = time.monotonic()
+        # Bumped only once the process is up: a caller that saw the worker down while
+        # it was starting still holds the old generation and will not restart it again
+        self.generation += 1
+        threading.Thread(target=self._read, args=(parent_conn, self._pending), name=f"proctor-{self.index}-reader", daemon=True).start()
+        threading.Thread(target=self._write, args=(parent_conn, self._outbox, self._pending), name=f"proctor-{self.index}-writer", daemon=True).start()
+
+    def stop(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.join(timeout=5)
+        if self._outbox is not None:
+            self._outbox.put(None)  # ends the writer thread once it is past any send in progress
+        if self._conn is not None:
+            self._conn.close()  # ends the reader thread, which fails anything still pending
+        self._process = None
+        self._conn = None
+        self._outbox = None
+
+    def restart(self, reason: str):
+        self.restarts += 1
+        log.warning("proctor.worker_restart", worker=self.index, pid=self.pid, reason=reason, restarts=self.restarts)
+        self.stop()
+        self.start()
+
+    async def call(self, op: str, *args, timeout: float):
+        loop = asyncio.get_running_loop()
+        request_id = next(self._ids)
+        future = loop.create_future()
+        outbox, pending = self._outbox, self._pending
+        if outbox is None:
+            raise WorkerLost(f"worker {self.index} is not running")
+        with self._pending_lock:
+            pending[request_id] = (loop, future)
+        try:
+            outbox.put((request_id, op, args))
+            ok, result = await asyncio.wait_for(future, timeout)
+        finally:
+            with self._pending_lock:
+                pending.pop(request_id, None)
+        if not ok:
+            raise Exception(result)
+        return result
+
+    def _write(self, conn, outbox: queue.Queue, pending: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Future]]):
+        while True:
+            message = outbox.get()
+            if message is None:
+                return
+            try:
+                conn.send(message)  # pickles and may block on a full pipe: fine on this thread
+            except Exception as e:  # pipe broken or closed by stop()
+                with self._pending_lock:
+                    entry = pending.get(message[0])
+                if entry:
+                    loop, future = entry
+                    loop.call_soon_threadsafe(_fail, future, WorkerLost(f"worker {self.index} unavailable: {e}"))
+
+    def _read(self, conn, pending: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Future]]):
+        while True:
+            try:
+                request_id, ok, result = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._pending_lock:
+                entry = pending.get(request_id)
+            if entry:
+                loop, future = entry
+                loop.call_soon_threadsafe(_resolve, future, (ok, result))
+        # Pipe closed: the process died or was replaced
+        with self._pending_lock:
+            lost = list(pending.values())
+        for loop, future in lost:
+            loop.call_soon_threadsafe(_fail, future, WorkerLost(f"worker {self.index} exited"))
+
+
+def _resolve(future: asyncio.Future, value):
+    if not future.done():
+        future.set_result(value)
+
+
+def _fail(future: asyncio.Future, error: Exception):
+    if not future.done():
+        future.set_exception(error)
+
+
+class ProctorEngine:
+    """
+    Proctoring inference spread over PROCTOR_WORKERS processes (spawned, so
+    FaceMesh and its threads never share a process with the API).
+
+    Users are sharded by a stable hash of user_id, so all frames of a user
+    reach the same worker and its tracking state. Workers start on first
+    use; the health check pings them and restarts any that died or stopped
+    answering, and a frame that times out restarts its worker too.
+    """
+
+    def __init__(self, workers: int = PROCTOR_WORKERS):
+        self.workers = max(1, workers)
+        context = multiprocessing.get_context("spawn")
+        self._workers: List[ProctorWorker] = [ProctorWorker(i, context) for i in range(self.workers)]
+        self._last_restart: Dict[int, float] = {}
+        self._restart_locks: Dict[int, asyncio.Lock] = {}
+        self._health_task: Optional[asyncio.Task] = None
+
+    def worker_for(self, user_id: str) -> ProctorWorker:
+        # crc32, not hash(): stable across processes and restarts
+        return self._workers[zlib.crc32(user_id.encode("utf-8")) % self.workers]
+
+    async def analyze(self, frame_bytes: bytes, user_id: str) -> ProctorStatus:
+        worker = self.worker_for(user_id)
+        if not worker.alive():
+            await self._restart(worker, "not running" if worker.pid is None else "exited", worker.generation)
+        generation = worker.generation
+        try:
+            result = await worker.call("frame", frame_bytes, user_id, timeout=PROCTOR_FRAME_TIMEOUT)
+        except asyncio.TimeoutError:
+            worker.errors += 1
+            await self._restart(worker, "frame timeout", generation)
+            raise WorkerLost(f"worker {worker.index} timed out")
+        except WorkerLost:
+            worker.errors += 1
+            raise
+        except Exception as e:
+            worker.errors += 1
+            log.error("proctor.frame_failed", user_id=user_id, worker=worker.index, error=str(e))
+            raise
+        status, reused, stage_seconds = result
+        status = ProctorStatus(**status)
+        # Counted here: metrics incremented inside the workers would never reach /metrics
+        for stage, seconds in stage_seconds.items():
+            AGENT_STAGE_SECONDS.observe(seconds, agent="ProctorAgent", stage=stage)
+        worker.frames += 1
+        proctor_frame_rate.mark()
+        if reused:
+            worker.reused += 1
+            PROCTOR_FRAMES_REUSED.inc()
+        if status.fraud_detected:
+            PROCTOR_FRAMES.inc(result="invalid")
+        elif status.is_looking_away:
+            PROCTOR_FRAMES.inc(result="looking_away")
+        else:
+            PROCTOR_FRAMES.inc(result="attentive")
+        return status
+
+    async def release(self, user_id: str):
+        """Frees the user's tracker in their worker (e.g. when their websocket closes)."""
+        worker = self.worker_for(user_id)
+        if not worker.alive():
+            return
+        try:
+            await worker.call("close", user_id, timeout=PROCTOR_HEALTH_TIMEOUT)
+        except Exception as e:  # timeout, lost worker or an error reply; idle expiry frees it anyway
+            log.warning("proctor.release_failed", user_id=user_id, worker=worker.index, error=str(e))
+
+    def start(self):
+        """Starts the periodic health check (workers themselves start on demand)."""
+        if self._health_task is None:
+            self._health_task = asyncio.ensure_future(self._health_loop())
+
+    def shutdown(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for worker in self._workers:
+            worker.stop()
+
+    async def check_health(self):
+        for worker in self._workers:
+            if worker.pid is None:
+                continue  # never used
+            generation = worker.generation
+            if not worker.alive():
+                await self._restart(worker, "exited", generation)
+                continue
+            started = time.perf_counter()
+            try:
+                worker.sessions = await worker.call("ping", timeout=PROCTOR_HEALTH_TIMEOUT)
+                worker.ping_seconds = time.perf_counter() - started
+            except (asyncio.TimeoutError, WorkerLost):
+                await self._restart(worker, "health check failed", generation)
+
+    def stats(self) -> dict:
+        return {
+            "workers": [
+                {
+                    "index": worker.index,
+                    "pid": worker.pid,
+                    "alive": worker.alive(),
+                    "frames": worker.frames,
+                    "reused": worker.reused,
+                    "errors": worker.errors,
+                    "restarts": worker.restarts,
+                    "ping_seconds": round(worker.ping_seconds, 4) if worker.ping_seconds is not None else None,
+                    "sessions": worker.sessions,
+                }
+                for worker in self._workers
+            ],
+            "frames": sum(worker.frames for worker in self._workers),
+        }
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(PROCTOR_HEALTH_INTERVAL)
+            try:
+                await self.check_health()
+            except Exception as e:
+                log.error("proctor.health_check_failed", error=str(e))
+
+    async def _restart(self, worker: ProctorWorker, reason: str, generation: int):
+        """(Re)starts `worker` unless someone already did since `generation` was observed."""
+        lock = self._restart_locks.setdefault(worker.index, asyncio.Lock())
+        async with lock:
+            if worker.generation != generation:
+                return
+            wait = self._last_restart.get(worker.index, 0.0) + PROCTOR_RESTART_BACKOFF - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._last_restart[worker.index] = time.monotonic()
+            # Killing and spawning take a moment; keep them off the event loop
+            if worker.pid is None:
+                await asyncio.to_thread(worker.start)
+            else:
+                await asyncio.to_thread(worker.restart, reason)
@@ -1,69 +1,205 @@
+import os
 import cv2
+import functools
+from contextlib import contextmanager
 import mediapipe as mp
 import numpy as np
+from typing import Dict, Optional, Tuple
 from server.shared.schemas import ProctorStatus
+from server.agents.proctor_agent.sessions import FaceSession, FaceSessionPool
+from server.agents.proctor_agent.protocol import CODEC_RGB, FrameHeader, jpeg_scale, parse_frame
 import time
 
+# Mean absolute difference (0-255) between grayscale thumbnails below which
+# the student is considered not to have moved since the last analyzed frame
+PROCTOR_MOTION_THRESHOLD = float(os.getenv("PROCTOR_MOTION_THRESHOLD", "4.0"))
+# A still student is still re-analyzed at least this often
+PROCTOR_MAX_REUSE_SECONDS = float(os.getenv("PROCTOR_MAX_REUSE_SECONDS", "1.0"))
+# After looking away / no face, every frame is analyzed for this long
+PROCTOR_ALERT_SECONDS = float(os.getenv("PROCTOR_ALERT_SECONDS", "3.0"))
+MOTION_THUMBNAIL_SIZE = (64, 48)
+
+# Landmarks for PnP
+# Nose tip: 1, Chin: 152, Left eye left corner: 33, Right eye right corner: 263
+# Left Mouth corner: 61, Right Mouth corner: 291
+POSE_LANDMARKS = (1, 152, 33, 263, 61, 291)
+DIST_MATRIX = np.zeros((4, 1), dtype=np.float64)
+_JPEG_COLOR_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                     4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+@functools.lru_cache(maxsize=32)
+def camera_matrix(img_w: int, img_h: int) -> np.ndarray:
+    """Pinhole approximation per resolution: focal length = width, principal point at the center."""
+    focal_length = 1 * img_w
+    matrix = np.array([[focal_length, 0, img_w / 2],
+                       [0, focal_length, img_h / 2],
+                       [0, 0, 1]], dtype=np.float64)
+    matrix.setflags(write=False)  # shared between frames
+    return matrix
+
+
+def rgb_view(header: FrameHeader, payload) -> Optional[np.ndarray]:
+    """A raw RGB24 payload as an (h, w, 3) array without copying, or None if the size is wrong."""
+    if len(payload) != header.width * header.height * 3:
+        return None
+    return np.frombuffer(payload, np.uint8).reshape(header.height, header.width, 3)
+
+
+def motion_thumbnail(header: Optional[FrameHeader], payload) -> Optional[np.ndarray]:
+    """
+    Tiny grayscale version of the frame. Compressed frames are decoded by
+    libjpeg at 1/8 scale, far cheaper than a full decode; raw frames are
+    just resampled.
+    """
+    if header is not None and header.codec == CODEC_RGB:
+        frame = rgb_view(header, payload)
+        if frame is None:
+            return None
+        small = cv2.resize(frame, MOTION_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+    small = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if small is None:
+        return None
+    return cv2.resize(small, MOTION_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+
+
 class ProctorAgent:
     def __init__(self):
         self.mp_face_mesh = mp.solutions.face_mesh
-        self.face_mesh = self.mp_face_mesh.FaceMesh(
+        # One tracker per user: a FaceMesh fed interleaved users loses tracking
+        # and falls back to full detection on nearly every frame
+        self.sessions = FaceSessionPool(self._new_face_mesh, self._new_static_face_mesh)
+        # Stage durations of the last frame. This runs in a worker process whose
+        # metrics never reach /metrics, so the engine records them instead
+        self.stage_seconds: Dict[str, float] = {}
+
+    def _new_face_mesh(self):
+        return self.mp_face_mesh.FaceMesh(
             min_detection_confidence=0.5,
             min_tracking_confidence=0.5,
             refine_landmarks=True
         )
 
+    @contextmanager
+    def _stage(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + time.perf_counter() - start
+
+    def _new_static_face_mesh(self):
+        # Shared by the users a full pool has no tracker for: detection on every
+        # frame, so no tracking state carries over from one user to the next
+        return self.mp_face_mesh.FaceMesh(
+            static_image_mode=True,
+            min_detection_confidence=0.5,
+            refine_landmarks=True
+        )
+
+    def close_session(self, user_id: str) -> bool:
+        return self.sessions.close(user_id)
+
     def process_frame(self, frame_bytes: bytes, user_id: str) -> ProctorStatus:
-        # Convert bytes to numpy array
-        nparr = np.frombuffer(frame_bytes, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        status, _ = self.process_frame_gated(frame_bytes, user_id)
+        return status
+
+    def process_frame_gated(self, frame_bytes: bytes, user_id: str) -> Tuple[ProctorStatus, bool]:
+        """
+        Skips FaceMesh when the frame barely differs from the last analyzed
+        one and returns that result again, with reused=True. Analysis is
+        forced at least every PROCTOR_MAX_REUSE_SECONDS, and on every frame
+        for a while after the student looked away, so detections are never
+        delayed by more than that.
+
+        `frame_bytes` is either a framed message (see protocol.py) or a bare
+        image.
+        """
+        now = time.time()
+        self.stage_seconds = {}
+        try:
+            header, payload = parse_frame(frame_bytes)
+        except ValueError:
+            return self._invalid(user_id, None), False
+        sequence = header.sequence if header else None
+        with self._stage("motion"):
+            thumbnail = motion_thumbnail(header, payload)
+        session = self.sessions.get(user_id)
+        session.frames += 1
+        if thumbnail is not None and session.thumbnail is not None and now >= session.alert_until \
+                and now - session.analyzed_at < PROCTOR_MAX_REUSE_SECONDS:
+            motion = float(cv2.absdiff(thumbnail, session.thumbnail).mean())
+            if motion < PROCTOR_MOTION_THRESHOLD:
+                return session.status.model_copy(update={"timestamp": now, "frame_seq": sequence}), True
 
+        status = self._analyze_frame(header, payload, user_id, session)
+        if thumbnail is not None:
+            alert = status.is_looking_away or status.fraud_detected
+            session.thumbnail = thumbnail
+            session.status = status
+            session.analyzed_at = now
+            session.alert_until = now + PROCTOR_ALERT_SECONDS if alert else 0.0
+        return status, False
+
+    def _decode(self, header: Optional[FrameHeader], payload, session: FaceSession) -> Optional[np.ndarray]:
+        """The frame as RGB for MediaPipe, written into the session's reusable buffer where a conversion is needed."""
+        if header is not None and header.codec == CODEC_RGB:
+            return rgb_view(header, payload)  # already RGB: no decode, no copy
+
+        # Large JPEGs are decoded straight to ~PROCTOR_ANALYSIS_WIDTH by libjpeg's DCT scaling
+        scale = jpeg_scale(header.width) if header is not None else 1
+        frame = cv2.imdecode(np.frombuffer(payload, np.uint8), _JPEG_COLOR_FLAGS[scale])
         if frame is None:
-            return ProctorStatus(user_id=user_id, attention_score=0.0, is_looking_away=True, fraud_detected=True, timestamp=time.time())
+            return None
+        if session.rgb_buffer is None or session.rgb_buffer.shape != frame.shape:
+            session.rgb_buffer = np.empty_like(frame)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=session.rgb_buffer)
+
+    def _invalid(self, user_id: str, sequence: Optional[int]) -> ProctorStatus:
+        return ProctorStatus(user_id=user_id, attention_score=0.0, is_looking_away=True, fraud_detected=True,
+                             timestamp=time.time(), frame_seq=sequence)
+
+    def _analyze_frame(self, header: Optional[FrameHeader], payload, user_id: str, session: FaceSession) -> ProctorStatus:
+        sequence = header.sequence if header else None
+        with self._stage("decode"):
+            rgb_frame = self._decode(header, payload, session)
+
+        if rgb_frame is None:
+            return self._invalid(user_id, sequence)
 
         # MediaPipe expects RGB
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = self.face_mesh.process(rgb_frame)
+        with self._stage("inference"):
+            results = session.face_mesh.process(rgb_frame)
 
         attention_score = 1.0
         is_looking_away = False
         fraud_detected = False
 
         if results.multi_face_landmarks:
+            img_h, img_w = rgb_frame.shape[:2]
+            # Pixel scale for (x, y); z stays in MediaPipe's relative units
+            scale = np.array([img_w, img_h, 1.0])
+            points = session.pose_points
+            if points is None:
+                points = session.pose_points = np.empty((len(POSE_LANDMARKS), 3), dtype=np.float64)
             for face_landmarks in results.multi_face_landmarks:
                 # Simple Head Pose Estimation (Yaw) logic
                 # Using nose tip (1) and chin (152) and ear approximations
                 # This is a simplified heuristic for strict 3D pose estimation
-                
-                img_h, img_w, _ = frame.shape
-                face_3d = []
-                face_2d = []
-
-                # Landmarks for PnP
-                # Nose tip: 1, Chin: 152, Left eye left corner: 33, Right eye right corner: 263
-                # Left Mouth corner: 61, Right Mouth corner: 291
-                idx_list = [1, 152, 33, 263, 61, 291]
-                
-                for idx in idx_list:
-                    lm = face_landmarks.landmark[idx]
-                    x, y = int(lm.x * img_w), int(lm.y * img_h)
-                    face_2d.append([x, y])
-                    face_3d.append([x, y, lm.z]) # Approximate Z, or use model Z
-                
-                face_2d = np.array(face_2d, dtype=np.float64)
-                face_3d = np.array(face_3d, dtype=np.float64)
-
-                # Camera matrix
-                focal_length = 1 * img_w
-                cam_matrix = np.array([ [focal_length, 0, img_h / 2],
-                                        [0, focal_length, img_w / 2],
-                                        [0, 0, 1]])
-
-                # Distortion matrix
-                dist_matrix = np.zeros((4, 1), dtype=np.float64)
+                landmarks = face_landmarks.landmark
+                for row, idx in enumerate(POSE_LANDMARKS):
+                    lm = landmarks[idx]
+                    points[row] = (lm.x, lm.y, lm.z)
+                np.multiply(points, scale, out=points)
+                np.trunc(points[:, :2], out=points[:, :2])  # whole pixels, as before
+
+                face_3d = points
+                face_2d = np.ascontiguousarray(points[:, :2])
 
                 # Solve PnP
-                success, rot_vec, trans_vec = cv2.solvePnP(face_3d, face_2d, cam_matrix, dist_matrix)
+                with self._stage("pose"):
+                    success, rot_vec, trans_vec = cv2.solvePnP(face_3d, face_2d, camera_matrix(img_w, img_h), DIST_MATRIX)
 
                 if success:
                     rmat, jac = cv2.Rodrigues(rot_vec)
@@ -89,5 +225,6 @@ class ProctorAgent:
             attention_score=attention_score,
             is_looking_away=is_looking_away,
             fraud_detected=fraud_detected,
-            timestamp=time.time()
+            timestamp=time.time(),
+            frame_seq=sequence
         )
@@ -0,0 +1,67 @@
+import os
+import struct
+from typing import NamedTuple, Optional, Tuple
+
+# Binary frames on /ws/proctor: a 12-byte header followed by the image.
+#   magic "PF" | version u8 | codec u8 | width u16 | height u16 | sequence u32   (network byte order)
+# Messages without the magic are treated as a bare JPEG/PNG (the original format).
+FRAME_MAGIC = b"PF"
+FRAME_PROTOCOL_VERSION = 1
+FRAME_HEADER = struct.Struct("!2sBBHHI")
+
+CODEC_JPEG = 1  # any format cv2.imdecode reads; decoded at reduced scale when large
+CODEC_RGB = 2   # raw packed RGB24, width * height * 3 bytes; no decode at all
+CODECS = {CODEC_JPEG: "jpeg", CODEC_RGB: "rgb24"}
+
+# FaceMesh gains nothing from more pixels than this; larger JPEGs are decoded downscaled
+PROCTOR_ANALYSIS_WIDTH = int(os.getenv("PROCTOR_ANALYSIS_WIDTH", "640"))
+
+
+class FrameHeader(NamedTuple):
+    codec: int
+    width: int
+    height: int
+    sequence: int
+
+
+def peek_header(data: bytes) -> Optional[FrameHeader]:
+    """The header of a framed message, or None for a bare image."""
+    if len(data) < FRAME_HEADER.size or data[:2] != FRAME_MAGIC:
+        return None
+    _, version, codec, width, height, sequence = FRAME_HEADER.unpack_from(data)
+    if version != FRAME_PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported frame protocol version {version}")
+    if codec not in CODECS:
+        raise ValueError(f"Unsupported frame codec {codec}")
+    return FrameHeader(codec, width, height, sequence)
+
+
+def parse_frame(data: bytes) -> Tuple[Optional[FrameHeader], memoryview]:
+    """(header or None, image payload); the payload is a view, not a copy."""
+    header = peek_header(data)
+    view = memoryview(data)
+    return header, view[FRAME_HEADER.size:] if header else view
+
+
+def pack_frame(payload: bytes, codec: int, width: int, height: int, sequence: int) -> bytes:
+    """Builds a framed message (what clients send)."""
+    return FRAME_HEADER.pack(FRAME_MAGIC, FRAME_PROTOCOL_VERSION, codec, width, height, sequence & 0xFFFFFFFF) + payload
+
+
+def jpeg_scale(width: int, target_width: int = PROCTOR_ANALYSIS_WIDTH) -> int:
+    """Largest libjpeg DCT scale (1, 2, 4 or 8) that keeps the image at least `target_width` wide."""
+    scale = 1
+    while scale < 8 and width // (scale * 2) >= target_width:
+        scale *= 2
+    return scale
+
+
+def protocol_hello() -> dict:
+    """Sent when a proctoring websocket opens, so clients can pick a format."""
+    return {
+        "type": "hello",
+        "protocol": FRAME_PROTOCOL_VERSION,
+        "header": "!2sBBHHI (magic 'PF', version, codec, width, height, sequence)",
+        "codecs": {name: code for code, name in CODECS.items()},
+        "analysis_width": PROCTOR_ANALYSIS_WIDTH,
+    }
@@ -0,0 +1,172 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+# FaceMesh instances per worker process; users beyond this share one tracker until a slot frees up
+PROCTOR_MAX_SESSIONS = int(os.getenv("PROCTOR_MAX_SESSIONS", "16"))
+# Sessions without a frame for this long are closed
+PROCTOR_SESSION_IDLE_SECONDS = float(os.getenv("PROCTOR_SESSION_IDLE_SECONDS", "120"))
+_REAP_EVERY_SECONDS = 10.0
+
+
+def rss_bytes() -> Optional[int]:
+    """Resident memory of this process, or None where it cannot be read."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class FaceSession:
+    """
+    One user's tracker and temporal state: their FaceMesh (their own, so
+    tracking continues from their previous frame, or the pool's shared one
+    when it is full) plus what the motion gate remembers about their last
+    analyzed frame.
+    """
+
+    def __init__(self, user_id: str, face_mesh, shared: bool = False):
+        self.user_id = user_id
+        self.face_mesh = face_mesh
+        self.shared = shared  # borrows the pool's shared FaceMesh
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.frames = 0
+
+        # Motion gate state (see ProctorAgent.process_frame_gated)
+        self.thumbnail = None
+        self.status = None
+        self.analyzed_at = 0.0
+        self.alert_until = 0.0
+
+        # Reused across frames instead of allocating per frame
+        self.rgb_buffer = None
+        self.pose_points = None
+
+    def close(self):
+        close = getattr(self.face_mesh, "close", None)
+        if close and not self.shared:
+            close()
+        self.face_mesh = None
+
+
+class FaceSessionPool:
+    """
+    Per-user sessions for one worker process. At most `max_sessions` of them
+    own a FaceMesh; users beyond that share a single one built by
+    `shared_factory`, which must keep no state between frames (static image
+    mode) so nothing leaks from one user to the next. They get their own
+    tracker on a later frame once a slot is free. Nobody is evicted while
+    active, so a worker with more users than slots never rebuilds trackers
+    frame after frame. Sessions idle longer than `idle_seconds` are closed.
+    """
+
+    def __init__(self, factory: Callable[[], object], shared_factory: Callable[[], object],
+                 max_sessions: int = PROCTOR_MAX_SESSIONS, idle_seconds: float = PROCTOR_SESSION_IDLE_SECONDS):
+        self.factory = factory
+        self.shared_factory = shared_factory
+        self.max_sessions = max(1, max_sessions)
+        self.idle_seconds = idle_seconds
+        self._sessions: "OrderedDict[str, FaceSession]" = OrderedDict()
+        self._owned = 0
+        self._shared_face_mesh = None
+        self._last_reap = time.monotonic()
+
+        self.created = 0
+        self.overflowed = 0
+        self.promoted = 0
+        self.expired = 0
+
+    def get(self, user_id: str) -> FaceSession:
+        now = time.monotonic()
+        if now - self._last_reap >= _REAP_EVERY_SECONDS:
+            self.reap_idle(now)
+
+        session = self._sessions.get(user_id)
+        if session is None:
+            if self._owned < self.max_sessions:
+                session = FaceSession(user_id, self.factory())
+                self._owned += 1
+            else:
+                session = FaceSession(user_id, self._shared(), shared=True)
+                self.overflowed += 1
+            self._sessions[user_id] = session
+            self.created += 1
+        else:
+            self._sessions.move_to_end(user_id)
+            if session.shared and self._owned < self.max_sessions:
+                session.face_mesh = self.factory()
+                session.shared = False
+                self._owned += 1
+                self.promoted += 1
+                self._release_shared()
+        session.last_used = now
+        return session
+
+    def close(self, user_id: str) -> bool:
+        session = self._sessions.pop(user_id, None)
+        if session is None:
+            return False
+        self._close(session)
+        return True
+
+    def reap_idle(self, now: Optional[float] = None):
+        now = now or time.monotonic()
+        self._last_reap = now
+        # Oldest first: stop at the first session still in use
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used < self.idle_seconds:
+                break
+            del self._sessions[user_id]
+            self._close(session)
+            self.expired += 1
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "own_trackers": self._owned,
+            "shared_tracker_users": len(self._sessions) - self._owned,
+            "max_sessions": self.max_sessions,
+            "created": self.created,
+            "overflowed": self.overflowed,
+            "promoted": self.promoted,
+            "expired": self.expired,
+            # Whole worker: MediaPipe allocates on the first process() call, not
+            # when a FaceMesh is built, so per-tracker figures would be misleading
+            "rss_bytes": rss_bytes(),
+            "per_session": {
+                user_id: {"frames": s.frames, "shared_tracker": s.shared,
+                          "idle_seconds": round(time.monotonic() - s.last_used, 1)}
+                for user_id, s in self._sessions.items()
+            },
+        }
+
+    def _shared(self):
+        if self._shared_face_mesh is None:
+            self._shared_face_mesh = self.shared_factory()
+        return self._shared_face_mesh
+
+    def _release_shared(self):
+        """Closes the shared FaceMesh once no session uses it any more."""
+        if self._shared_face_mesh is not None and len(self._sessions) == self._owned:
+            close = getattr(self._shared_face_mesh, "close", None)
+            if close:
+                close()
+            self._shared_face_mesh = None
+
+    def _close(self, session: FaceSession):
+        if not session.shared:
+            self._owned -= 1
+        session.close()
+        self._release_shared()
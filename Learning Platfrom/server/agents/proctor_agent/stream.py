@@ -0,0 +1,130 @@
+import time
+import asyncio
+from typing import Awaitable, Callable, Generic, Optional, TypeVar
+from fastapi import WebSocket
+from server.shared.schemas import ProctorStatus
+from server.core.metrics import PROCTOR_FRAMES, PROCTOR_FRAMES_DROPPED
+from server.agents.proctor_agent.engine import WorkerLost
+from server.agents.proctor_agent.protocol import peek_header, protocol_hello
+
+T = TypeVar("T")
+
+
+class LatestSlot(Generic[T]):
+    """
+    One-item mailbox: put() overwrites whatever has not been taken yet, so
+    the consumer only ever sees the newest item and a slow consumer costs
+    dropped items, never queueing delay or memory.
+    """
+
+    def __init__(self):
+        self._item: Optional[T] = None
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, item: T) -> bool:
+        """Returns True if an unconsumed item was replaced."""
+        replaced = self._ready.is_set()
+        if replaced:
+            self.dropped += 1
+        self._item = item
+        self._ready.set()
+        return replaced
+
+    async def get(self) -> T:
+        await self._ready.wait()
+        self._ready.clear()
+        item, self._item = self._item, None
+        return item
+
+
+class ProctorSession:
+    """
+    One proctoring websocket as three concurrent stages:
+    receive (frames into a latest-frame slot), analyze (one frame at a time,
+    off the event loop) and send (statuses from a latest-status slot).
+    A stage finishing (disconnect) or failing stops the other two; a frame
+    the worker fails on is answered with an invalid status instead.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: str,
+                 analyze: Callable[[bytes, str], Awaitable[ProctorStatus]]):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.analyze = analyze
+        self.frames = LatestSlot()
+        self.statuses = LatestSlot()
+        self.received = 0
+        self.analyzed = 0
+        self.stale = 0
+        self.errors = 0
+        self.last_sequence = -1
+
+    async def run(self):
+        await self.websocket.send_json(protocol_hello())
+        tasks = [asyncio.ensure_future(stage()) for stage in (self._receive, self._analyze, self._send)]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()  # re-raises WebSocketDisconnect or a stage error
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "analyzed": self.analyzed,
+            "frames_dropped": self.frames.dropped,
+            "frames_stale": self.stale,
+            "frame_errors": self.errors,
+            "statuses_dropped": self.statuses.dropped,
+        }
+
+    async def _receive(self):
+        while True:
+            frame = await self.websocket.receive_bytes()
+            self.received += 1
+            try:
+                header = peek_header(frame)
+            except ValueError:
+                header = None  # the worker reports it as an invalid frame
+            if header is not None:
+                # Frames that arrive out of order are older than one already queued or analyzed
+                if header.sequence <= self.last_sequence:
+                    self.stale += 1
+                    PROCTOR_FRAMES_DROPPED.inc(stage="stale")
+                    continue
+                self.last_sequence = header.sequence
+            if self.frames.put(frame):
+                PROCTOR_FRAMES_DROPPED.inc(stage="receive")
+
+    async def _analyze(self):
+        while True:
+            frame = await self.frames.get()
+            try:
+                status = await self.analyze(frame, self.user_id)
+            except WorkerLost:
+                continue  # its worker is being restarted; the next frame goes to the new one
+            except Exception:
+                # One bad frame (undecodable, malformed header) must not end the session
+                self.errors += 1
+                PROCTOR_FRAMES.inc(result="error")  # the engine logs the cause
+                status = self._invalid(frame)
+            self.analyzed += 1
+            if self.statuses.put(status):
+                PROCTOR_FRAMES_DROPPED.inc(stage="send")
+
+    def _invalid(self, frame: bytes) -> ProctorStatus:
+        try:
+            header = peek_header(frame)
+        except ValueError:
+            header = None
+        return ProctorStatus(user_id=self.user_id, attention_score=0.0, is_looking_away=True, fraud_detected=True,
+                             timestamp=time.time(), frame_seq=header.sequence if header else None)
+
+    async def _send(self):
+        while True:
+            status = await self.statuses.get()
+            await self.websocket.send_json(status.model_dump())
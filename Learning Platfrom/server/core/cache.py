@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+from server.core.metrics import LLM_CACHE_LOOKUPS
+
+# In-memory tier: bounded LRU in front of the on-disk SQLite tier
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "512"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LLM_CACHE_DISABLED = os.getenv("LLM_CACHE_DISABLED", "0") == "1"
+
+
+def make_cache_key(model: str, system_instruction: str, prompt: str, json_mode: bool) -> str:
+    """Content-addressed key for one LLM request."""
+    payload = json.dumps([model, system_instruction, prompt, bool(json_mode)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Two-tier cache for LLM completions: an in-process LRU backed by a
+    persistent SQLite table. Entries expire after `ttl_seconds`; the disk tier
+    evicts least-recently-used rows once it grows past `max_disk_bytes`.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_memory_items: int = LLM_CACHE_MEMORY_ITEMS,
+                 ttl_seconds: float = LLM_CACHE_TTL_SECONDS, max_disk_bytes: int = LLM_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_bytes = max_disk_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (value, expires_at)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_created_at ON llm_cache(created_at)")
+        self._conn.commit()
+        self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    def peek(self, key: str) -> Optional[str]:
+        """Memory-tier lookup only; cheap enough to call on the event loop."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            LLM_CACHE_LOOKUPS.inc(result="memory_hits")
+            return value
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.peek(key)
+        if value is not None:
+            return value
+
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                LLM_CACHE_LOOKUPS.inc(result="misses")
+                return None
+            value, created_at = row
+            if created_at + self.ttl_seconds < now:
+                self._delete_disk(key)
+                self._conn.commit()
+                self.misses += 1
+                LLM_CACHE_LOOKUPS.inc(result="misses")
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._remember(key, value, created_at + self.ttl_seconds)
+            self.disk_hits += 1
+            LLM_CACHE_LOOKUPS.inc(result="disk_hits")
+            return value
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._delete_disk(key)
+            self._conn.execute(
+                "INSERT INTO llm_cache (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._disk_bytes += size
+            self._evict_disk()
+            self._conn.commit()
+            self._remember(key, value, now + self.ttl_seconds)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._memory.pop(key, None)
+            self._delete_disk(key)
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+            self._disk_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_items": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    # --- internals (caller holds self._lock) ---
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _delete_disk(self, key: str):
+        row = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row:
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._disk_bytes -= row[0]
+
+    def _evict_disk(self):
+        expired = self._conn.execute(
+            "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+        ).rowcount
+        if expired > 0:
+            self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        while self._disk_bytes > self.max_disk_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM llm_cache ORDER BY last_access ASC LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._memory.pop(key, None)
+                self._disk_bytes -= size
+                self.evictions += 1
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
+
+
+_llm_cache: Optional[LLMCache] = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """Process-wide LLM cache, or None when disabled via LLM_CACHE_DISABLED."""
+    global _llm_cache
+    if LLM_CACHE_DISABLED:
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMCache()
+        return _llm_cache
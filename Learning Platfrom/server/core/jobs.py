@@ -0,0 +1,294 @@
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Set
+from server.core.logger import log
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Progress is pushed to subscribers immediately but persisted at most this often
+JOB_PROGRESS_SAVE_SECONDS = float(os.getenv("JOB_PROGRESS_SAVE_SECONDS", "2"))
+JOB_MEMORY_ITEMS = int(os.getenv("JOB_MEMORY_ITEMS", "500"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+_STOP = object()
+
+# runner(payload, report) -> result; report(**progress) publishes progress fields
+Runner = Callable[[dict, Callable[..., None]], Awaitable[Optional[str]]]
+
+
+class JobQueue:
+    """
+    Persistent queue of background jobs (e.g. video renders) drained by a
+    fixed number of async workers.
+
+    Every job is written to SQLite, so anything queued or running when the
+    server stops is queued again by start(). Progress reported by the runner
+    is pushed to subscribers (the job websocket) as it happens; get() serves
+    polling. Writes go through a queue to one writer thread, so submit()
+    and progress reports never wait for a SQLite commit on the event loop.
+    """
+
+    def __init__(self, name: str, runner: Runner, workers: int = JOB_WORKERS, path: str = JOBS_DB_PATH):
+        self.name = name
+        self.runner = runner
+        self.workers = workers
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, dict]" = OrderedDict()  # job id -> job, active and recently finished
+        self._payloads: Dict[str, dict] = {}
+        self._active_keys: Dict[str, str] = {}  # dedupe key -> job id while queued/running
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._last_saved: Dict[str, float] = {}
+        self._pending: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._writes: "queue.Queue" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+
+        self.completed = 0
+        self.failed = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " queue TEXT NOT NULL,"
+            " dedupe_key TEXT,"
+            " payload TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " progress TEXT NOT NULL,"
+            " result TEXT,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queue_status ON jobs(queue, status)")
+        self._conn.commit()
+
+    async def start(self):
+        """Re-queues unfinished jobs from a previous run and starts the workers."""
+        self._pending = asyncio.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name=f"jobs-{self.name}-writer", daemon=True)
+        self._writer.start()
+        rows = await asyncio.to_thread(self._unfinished_rows)
+        for job_id, dedupe_key, payload, progress, created_at in rows:
+            job = self._new_job(job_id, dedupe_key, created_at)
+            self._payloads[job_id] = json.loads(payload)
+            self._remember(job)
+            if dedupe_key:
+                self._active_keys[dedupe_key] = job_id
+            self._save(job)
+            self._pending.put_nowait(job_id)
+        if rows:
+            log.info("jobs.recovered", queue=self.name, count=len(rows))
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Jobs interrupted here stay "running" on disk and are picked up by the next start()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._writer is not None:
+            # Let queued writes land before the connection closes
+            self._writes.put(_STOP)
+            await asyncio.to_thread(self._writer.join, 10.0)
+            self._writer = None
+        with self._lock:
+            self._conn.close()
+
+    def submit(self, payload: dict, dedupe_key: Optional[str] = None) -> dict:
+        """Queues a job and returns its status; an identical queued/running job is returned instead."""
+        if dedupe_key and dedupe_key in self._active_keys:
+            return self.get(self._active_keys[dedupe_key])
+
+        job = self._new_job(uuid.uuid4().hex, dedupe_key, time.time())
+        self._payloads[job["job_id"]] = payload
+        self._remember(job)
+        if dedupe_key:
+            self._active_keys[dedupe_key] = job["job_id"]
+        self._save(job, payload)
+        self._pending.put_nowait(job["job_id"])
+        log.info("jobs.submitted", queue=self.name, job_id=job["job_id"])
+        return self._snapshot(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return self._snapshot(job)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, progress, result, error, created_at, updated_at FROM jobs WHERE id = ? AND queue = ?",
+                (job_id, self.name),
+            ).fetchone()
+        if row is None:
+            return None
+        status, progress, result, error, created_at, updated_at = row
+        return {
+            "job_id": job_id,
+            "status": status,
+            "progress": json.loads(progress),
+            "result": result,
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def report(self, job_id: str, **progress):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        job["progress"].update(progress)
+        job["updated_at"] = time.time()
+        self._publish(job)
+        if job["updated_at"] - self._last_saved.get(job_id, 0.0) >= JOB_PROGRESS_SAVE_SECONDS:
+            self._save(job)
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    def stats(self) -> dict:
+        statuses = [job["status"] for job in self._jobs.values()]
+        return {
+            "queued": statuses.count(QUEUED),
+            "running": statuses.count(RUNNING),
+            "completed": self.completed,
+            "failed": self.failed,
+            "workers": self.workers,
+        }
+
+    async def _worker(self):
+        while True:
+            job_id = await self._pending.get()
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] in FINISHED:
+                continue
+            job["status"] = RUNNING
+            job["updated_at"] = time.time()
+            self._save(job)
+            self._publish(job)
+
+            def report(**progress):
+                self.report(job_id, **progress)
+
+            try:
+                result = await self.runner(self._payloads[job_id], report)
+                if not result:
+                    raise Exception("Job produced no result")
+                job["status"] = DONE
+                job["result"] = result
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job["status"] = FAILED
+                job["error"] = str(e)
+                self.failed += 1
+                log.error("jobs.failed", queue=self.name, job_id=job_id, error=str(e))
+            job["updated_at"] = time.time()
+            self._payloads.pop(job_id, None)
+            self._last_saved.pop(job_id, None)
+            if job["dedupe_key"] and self._active_keys.get(job["dedupe_key"]) == job_id:
+                del self._active_keys[job["dedupe_key"]]
+            self._save(job)
+            self._publish(job)
+
+    def _new_job(self, job_id: str, dedupe_key: Optional[str], created_at: float) -> dict:
+        return {
+            "job_id": job_id,
+            "dedupe_key": dedupe_key,
+            "status": QUEUED,
+            "progress": {},
+            "result": None,
+            "error": None,
+            "created_at": created_at,
+            "updated_at": time.time(),
+        }
+
+    def _remember(self, job: dict):
+        self._jobs[job["job_id"]] = job
+        # Finished jobs age out of memory; get() falls back to the database
+        while len(self._jobs) > JOB_MEMORY_ITEMS:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest["status"] not in FINISHED:
+                break
+            del self._jobs[oldest_id]
+
+    def _snapshot(self, job: dict) -> dict:
+        snapshot = {k: v for k, v in job.items() if k != "dedupe_key"}
+        snapshot["progress"] = dict(job["progress"])
+        return snapshot
+
+    def _publish(self, job: dict):
+        snapshot = self._snapshot(job)
+        for queue in self._subscribers.get(job["job_id"], ()):
+            queue.put_nowait(snapshot)
+
+    def _unfinished_rows(self) -> list:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, dedupe_key, payload, progress, created_at FROM jobs"
+                " WHERE queue = ? AND status IN (?, ?) ORDER BY created_at",
+                (self.name, QUEUED, RUNNING),
+            ).fetchall()
+
+    def _save(self, job: dict, payload: Optional[dict] = None):
+        """Queues a write of the job's current state; the writer thread commits it."""
+        self._last_saved[job["job_id"]] = time.time()
+        if payload is not None:
+            self._writes.put((
+                "INSERT INTO jobs (id, queue, dedupe_key, payload, status, progress, result, error, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job["job_id"], self.name, job["dedupe_key"], json.dumps(payload), job["status"],
+                 json.dumps(job["progress"]), job["result"], job["error"], job["created_at"], job["updated_at"]),
+            ))
+        else:
+            self._writes.put((
+                "UPDATE jobs SET status = ?, progress = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (job["status"], json.dumps(job["progress"]), job["result"], job["error"], job["updated_at"], job["job_id"]),
+            ))
+
+    def _write_loop(self):
+        while True:
+            batch = [self._writes.get()]
+            # Drain whatever else is waiting so one commit covers many writes
+            while len(batch) < 256:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            try:
+                with self._lock:
+                    for item in batch:
+                        if item is _STOP:
+                            stop = True
+                        else:
+                            self._conn.execute(*item)
+                    self._conn.commit()
+            except sqlite3.Error as e:
+                log.error("jobs.save_failed", queue=self.name, error=str(e))
+            if stop:
+                return
@@ -0,0 +1,487 @@
+import os
+import json
+import functools
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from server.core.metrics import JSON_PARSE_FAILURES, JSON_RECOVERIES
+from server.core.logger import log
+from typing import Awaitable, Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+# Decoded form of JSON string escapes
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class IncrementalJsonParser:
+    """
+    Parses a JSON object as it streams in, one chunk at a time.
+
+    feed() returns a list of events:
+      ("delta", key, text)  - newly decoded characters of a top-level string
+                              value whose key is in `stream_keys`
+      ("value", key, obj)   - a top-level value that has been fully received
+
+    Anything before the opening '{' (e.g. a ```json fence) is ignored, and raw
+    newlines inside strings are tolerated since models emit them regardless of
+    instructions.
+    """
+
+    def __init__(self, stream_keys: Iterable[str] = ()):
+        self.stream_keys = set(stream_keys)
+        self.done = False
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._unicode = None
+        self._expect_key = False
+        self._reading_key = False
+        self._key = None
+        self._key_buf: List[str] = []
+        self._str_buf = None      # decoded chars of a top-level string value
+        self._capture = None      # raw chars of a top-level container/scalar value
+        self._high_surrogate = None
+
+    def feed(self, chunk: str) -> List[Tuple]:
+        events = []
+        deltas: List[str] = []
+
+        for c in chunk:
+            if self.done:
+                break
+
+            if self._in_string:
+                if self._capture is not None:
+                    self._capture.append(c)
+                decoded = None
+                if self._escape:
+                    self._escape = False
+                    if c == 'u':
+                        self._unicode = ""
+                    else:
+                        decoded = _ESCAPES.get(c, c)
+                elif self._unicode is not None:
+                    self._unicode += c
+                    if len(self._unicode) == 4:
+                        try:
+                            decoded = self._decode_codepoint(int(self._unicode, 16))
+                        except ValueError:
+                            decoded = ""
+                        self._unicode = None
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._end_string(events, deltas)
+                else:
+                    decoded = c
+
+                if decoded:
+                    if self._reading_key:
+                        self._key_buf.append(decoded)
+                    elif self._str_buf is not None:
+                        self._str_buf.append(decoded)
+                        if self._key in self.stream_keys:
+                            deltas.append(decoded)
+                continue
+
+            depth = len(self._stack)
+            if c == '"':
+                self._in_string = True
+                if depth == 1 and self._expect_key:
+                    self._reading_key = True
+                    self._key_buf = []
+                elif depth == 1:
+                    self._str_buf = []
+                elif self._capture is not None:
+                    self._capture.append(c)
+            elif c in '{[':
+                if depth == 0:
+                    if c == '{':
+                        self._stack.append(c)
+                        self._expect_key = True
+                    continue
+                if depth == 1:
+                    self._capture = [c]
+                elif self._capture is not None:
+                    self._capture.append(c)
+                self._stack.append(c)
+            elif c in '}]':
+                if depth == 0:
+                    continue
+                if depth == 1:
+                    self._flush_scalar(events)
+                    self._stack.pop()
+                    self.done = True
+                    continue
+                self._stack.pop()
+                if self._capture is not None:
+                    self._capture.append(c)
+                    if len(self._stack) == 1:
+                        self._emit_value(events, "".join(self._capture))
+                        self._capture = None
+            elif depth == 1 and c == ',':
+                self._flush_scalar(events)
+                self._expect_key = True
+            elif depth == 1 and c == ':':
+                self._expect_key = False
+            elif self._capture is not None:
+                self._capture.append(c)
+            elif depth == 1 and not self._expect_key and not c.isspace():
+                # Start of a top-level number / true / false / null
+                self._capture = [c]
+
+        if deltas:
+            events.append(("delta", self._key, "".join(deltas)))
+        return events
+
+    def _decode_codepoint(self, code: int) -> str:
+        # Escaped astral characters arrive as a surrogate pair (\ud83d\ude00)
+        if 0xD800 <= code <= 0xDBFF:
+            self._high_surrogate = code
+            return ""
+        if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._high_surrogate = None
+        return chr(code)
+
+    def _end_string(self, events, deltas):
+        if self._reading_key:
+            self._reading_key = False
+            self._key = "".join(self._key_buf)
+        elif self._str_buf is not None:
+            if deltas:
+                events.append(("delta", self._key, "".join(deltas)))
+                deltas.clear()
+            events.append(("value", self._key, "".join(self._str_buf)))
+            self._str_buf = None
+
+    def _flush_scalar(self, events):
+        if self._capture is not None and self._capture[0] not in '{[':
+            self._emit_value(events, "".join(self._capture).strip())
+            self._capture = None
+
+    def _emit_value(self, events, raw: str):
+        try:
+            events.append(("value", self._key, json.loads(raw, strict=False)))
+        except json.JSONDecodeError:
+            # Leave it to the final whole-document parse
+            pass
+
+
+# --- Tolerant extraction and repair of whole (possibly malformed) outputs ---
+
+JSON_MAX_CONTINUATIONS = int(os.getenv("JSON_MAX_CONTINUATIONS", "2"))
+# How much of a cut-off output is sent back when asking the model to continue it
+JSON_CONTINUATION_TAIL_CHARS = int(os.getenv("JSON_CONTINUATION_TAIL_CHARS", "1500"))
+
+_MISSING = object()
+_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+_LITERAL_END = set(",:}]\"'") | set(" \t\r\n")
+
+
+class _TolerantParser:
+    """
+    Recursive-descent JSON reader that accepts what models actually emit:
+    raw newlines in strings, single-quoted strings, bare keys, Python
+    literals, trailing or missing commas, unescaped quotes inside strings,
+    and output that simply stops. On truncation `truncated` is set and the
+    incomplete trailing element is dropped, except that a cut-off list keeps
+    the items it completed.
+    """
+
+    def __init__(self, text: str, pos: int = 0):
+        self.text = text
+        self.pos = pos
+        self.n = len(text)
+        self.truncated = False
+        self._high_surrogate = None
+
+    def parse_value(self):
+        self._skip_ws()
+        if self.pos >= self.n:
+            self.truncated = True
+            return _MISSING
+        c = self.text[self.pos]
+        if c == '{':
+            return self._parse_container('}')
+        if c == '[':
+            return self._parse_container(']')
+        if c in '"\'':
+            return self._parse_string(c)
+        return self._parse_literal()
+
+    def _skip_ws(self):
+        while self.pos < self.n and self.text[self.pos].isspace():
+            self.pos += 1
+
+    def _parse_container(self, closer: str):
+        is_object = closer == '}'
+        result = {} if is_object else []
+        self.pos += 1
+        while True:
+            while self.pos < self.n and (self.text[self.pos].isspace() or self.text[self.pos] == ','):
+                self.pos += 1
+            if self.pos >= self.n:
+                self.truncated = True
+                return result
+            c = self.text[self.pos]
+            if c in '}]':
+                # A mismatched closer still ends the container
+                self.pos += 1
+                return result
+
+            start = self.pos
+            if is_object:
+                key = self._parse_key()
+                if key is _MISSING:
+                    return result
+                self._skip_ws()
+                if self.pos < self.n and self.text[self.pos] == ':':
+                    self.pos += 1
+            value = self.parse_value()
+            if self.truncated or value is _MISSING:
+                if self.truncated:
+                    # Keep a cut-off list's complete items; a cut-off object or scalar is dropped
+                    if isinstance(value, list):
+                        if is_object:
+                            result[key] = value
+                        else:
+                            result.append(value)
+                    return result
+                if self.pos == start:
+                    self.pos += 1  # unparseable character, skip it
+                continue
+            if is_object:
+                result[key] = value
+            else:
+                result.append(value)
+
+    def _parse_key(self):
+        c = self.text[self.pos]
+        if c in '"\'':
+            key = self._parse_string(c)
+            return _MISSING if self.truncated else key
+        start = self.pos
+        while self.pos < self.n and self.text[self.pos] not in ':,}]' and not self.text[self.pos].isspace():
+            self.pos += 1
+        if self.pos >= self.n:
+            self.truncated = True
+            return _MISSING
+        return self.text[start:self.pos]
+
+    def _parse_string(self, quote: str) -> str:
+        self.pos += 1
+        buf = []
+        text, n = self.text, self.n
+        while self.pos < n:
+            c = text[self.pos]
+            if c == '\\':
+                if self.pos + 1 >= n:
+                    break
+                e = text[self.pos + 1]
+                if e == 'u':
+                    digits = text[self.pos + 2:self.pos + 6]
+                    if len(digits) < 4 and self.pos + 6 > n:
+                        break
+                    try:
+                        buf.append(self._decode_codepoint(int(digits, 16)))
+                        self.pos += 6
+                    except ValueError:
+                        buf.append(e)
+                        self.pos += 2
+                    continue
+                # Unknown escapes are usually LaTeX (\alpha): keep the backslash
+                buf.append(_ESCAPES.get(e, '\\' + e))
+                self.pos += 2
+            elif c == quote and self._closes_string():
+                self.pos += 1
+                return "".join(buf)
+            else:
+                buf.append(c)
+                self.pos += 1
+        self.pos = n
+        self.truncated = True
+        return "".join(buf)
+
+    def _closes_string(self) -> bool:
+        # A quote only ends the string if what follows could follow a string;
+        # otherwise it's an unescaped quote inside the text ("She said "hi"")
+        i = self.pos + 1
+        while i < self.n and self.text[i] in ' \t\r\n':
+            i += 1
+        return i >= self.n or self.text[i] in ',:}]"\''
+
+    def _decode_codepoint(self, code: int) -> str:
+        if 0xD800 <= code <= 0xDBFF:
+            self._high_surrogate = code
+            return ""
+        if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._high_surrogate = None
+        return chr(code)
+
+    def _parse_literal(self):
+        start = self.pos
+        while self.pos < self.n and self.text[self.pos] not in _LITERAL_END:
+            self.pos += 1
+        token = self.text[start:self.pos]
+        if not token:
+            return _MISSING
+        if self.pos >= self.n:
+            # Can't tell "12" from the start of "1234"
+            self.truncated = True
+            return _MISSING
+        if token in _LITERALS:
+            return _LITERALS[token]
+        try:
+            return json.loads(token)
+        except json.JSONDecodeError:
+            return token
+
+
+def extract_json(text: str) -> Tuple[object, bool]:
+    """
+    Finds and repairs the largest JSON structure in `text` (prose and code
+    fences around it are ignored). Returns (value, truncated); value is None
+    if there is no object or array at all.
+    """
+    best, best_span, best_truncated = None, -1, False
+    pos = 0
+    while True:
+        starts = [i for i in (text.find('{', pos), text.find('[', pos)) if i != -1]
+        if not starts:
+            break
+        start = min(starts)
+        parser = _TolerantParser(text, start)
+        value = parser.parse_value()
+        span = parser.pos - start
+        if value is not _MISSING and span > best_span:
+            best, best_span, best_truncated = value, span, parser.truncated
+        if parser.truncated:
+            break
+        pos = max(parser.pos, start + 1)
+    return best, best_truncated
+
+
+def _strip_fences(text: str) -> str:
+    return text.replace("```json", "").replace("```", "").strip()
+
+
+def _validate(value, schema):
+    adapter = _adapter(schema)
+    try:
+        return adapter.validate_python(value)
+    except ValidationError:
+        # {"script": [...]} when a bare list was asked for
+        if isinstance(value, dict):
+            for inner in value.values():
+                if isinstance(inner, (list, dict)):
+                    try:
+                        return adapter.validate_python(inner)
+                    except ValidationError:
+                        continue
+        raise
+
+
+def _empty_field(value) -> Optional[str]:
+    """Name of an empty collection in a validated result ('' for the result itself), else None."""
+    if isinstance(value, (list, tuple, dict)) and not value:
+        return ""
+    if isinstance(value, BaseModel):
+        for name in type(value).model_fields:
+            field = getattr(value, name)
+            if isinstance(field, (list, tuple, dict)) and not field:
+                return name
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _adapter(schema) -> TypeAdapter:
+    return TypeAdapter(schema)
+
+
+class ParseResult(NamedTuple):
+    value: Optional[object]
+    truncated: bool
+    repaired: bool
+    error: Optional[str]
+
+
+def parse_model(text: str, schema) -> ParseResult:
+    """
+    Parses an LLM output into `schema` (a pydantic model or typing construct
+    such as List[ScriptSegment]). Well-formed output takes the fast
+    json.loads path; anything else goes through the tolerant parser.
+    A result with an empty collection (a roadmap without chapters) is an
+    error: it validates, but it is never what was asked for.
+    """
+    cleaned = _strip_fences(text)
+    truncated = repaired = False
+    try:
+        value = json.loads(cleaned, strict=False)
+    except json.JSONDecodeError:
+        value, truncated = extract_json(cleaned)
+        repaired = True
+        if value is None:
+            return ParseResult(None, truncated, repaired, "no JSON structure found")
+    try:
+        result = _validate(value, schema)
+    except ValidationError as e:
+        return ParseResult(None, truncated, repaired, str(e))
+    empty = _empty_field(result)
+    if empty is not None:
+        return ParseResult(None, truncated, repaired, f"empty {empty or 'result'}")
+    return ParseResult(result, truncated, repaired, None)
+
+
+def continuation_prompt(partial: str) -> str:
+    return (
+        "Your previous JSON output was cut off. Continue it from exactly where it stops: "
+        "output ONLY the remaining characters, do not repeat anything already written, "
+        "and do not use code fences. The output so far ends with:\n\n"
+        + partial[-JSON_CONTINUATION_TAIL_CHARS:]
+    )
+
+
+def _join_continuation(partial: str, more: str) -> str:
+    more = _strip_fences(more) if "```" in more else more
+    # Models often restate the last few characters before continuing
+    for size in range(min(len(partial), len(more), 200), 0, -1):
+        if partial.endswith(more[:size]):
+            return partial + more[size:]
+    return partial + more
+
+
+async def parse_agent_output(text: str, schema, agent: str,
+                             continue_fn: Optional[Callable[[str], Awaitable[Optional[str]]]] = None,
+                             max_continuations: int = JSON_MAX_CONTINUATIONS):
+    """
+    parse_model plus recovery: when the output was truncated, asks for a
+    continuation (via `continue_fn(partial_text)`) instead of regenerating
+    the whole thing. Returns the validated result or None.
+
+    Output that is still truncated once continuing stops is a failure even
+    when the elements received so far validate: the first chapters of a
+    roadmap would otherwise be cached and stored as the whole course.
+    """
+    parsed = parse_model(text, schema)
+    attempts = 0
+    while parsed.truncated and continue_fn is not None and attempts < max_continuations:
+        attempts += 1
+        more = await continue_fn(text)
+        if not more:
+            break
+        text = _join_continuation(text, more)
+        parsed = parse_model(text, schema)
+    if parsed.truncated and parsed.value is not None:
+        parsed = parsed._replace(value=None, error="output truncated")
+
+    if parsed.value is not None:
+        if attempts:
+            JSON_RECOVERIES.inc(agent=agent, method="continuation")
+            log.info("json.continued", agent=agent, continuations=attempts)
+        elif parsed.repaired:
+            JSON_RECOVERIES.inc(agent=agent, method="repair")
+        return parsed.value
+
+    JSON_PARSE_FAILURES.inc(agent=agent)
+    log.error("json.parse_failed", agent=agent, error=parsed.error, truncated=parsed.truncated, response=text)
+    return None
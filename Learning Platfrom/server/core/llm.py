@@ -1,24 +1,69 @@
 import os
 import sys
+import asyncio
 print(f"DEBUG: sys.stdout.encoding = {sys.stdout.encoding}")
 import time
-from typing import Optional
+from typing import AsyncIterator, Optional
+import httpx
 from dotenv import load_dotenv
-from groq import Groq
+from groq import Groq, AsyncGroq
 import google.generativeai as genai
+from server.core.cache import get_llm_cache, make_cache_key
+from server.core.router import router
+from server.core.scheduler import PRIORITY_INTERACTIVE, Priority, estimate_tokens, get_scheduler
+from server.core.metrics import LLM_PROMPT_TOKENS, LLM_COMPLETION_TOKENS
+from server.core.logger import log
+from server.core.json_parser import continuation_prompt
 
 load_dotenv()
 
+GROQ_MODEL = "llama-3.1-8b-instant"
+GEMINI_MODEL = "gemini-pro"
+
+# Connection pool limits for the shared async provider clients
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+
+# One pooled async client per provider, shared by every LLMService instance
+# (and therefore by every agent) in this process.
+_async_groq_client: Optional[AsyncGroq] = None
+
+
+def get_async_groq_client(api_key: str) -> AsyncGroq:
+    global _async_groq_client
+    if _async_groq_client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            ),
+            timeout=LLM_TIMEOUT_SECONDS,
+        )
+        _async_groq_client = AsyncGroq(api_key=api_key, http_client=http_client)
+    return _async_groq_client
+
+
+async def close_async_clients():
+    """Closes the shared async provider clients (call on app shutdown)."""
+    global _async_groq_client
+    if _async_groq_client is not None:
+        await _async_groq_client.close()
+        _async_groq_client = None
+
 class LLMService:
     def __init__(self, provider: str = "groq"):
         self.provider = provider
         self.groq_api_key = os.getenv("GROQ_API_KEY")
         self.gemini_api_key = os.getenv("GEMINI_API_KEY")
 
-        with open("debug_init.txt", "a") as f:
-             f.write(f"Init LLMService. Provider: {provider}\n")
-             f.write(f"GROQ_KEY: {'Found' if self.groq_api_key else 'Missing'}\n")
-             f.write(f"CWD: {os.getcwd()}\n")
+        log.info(
+            "llm.init",
+            provider=provider,
+            groq_key=bool(self.groq_api_key),
+            gemini_key=bool(self.gemini_api_key),
+            cwd=os.getcwd(),
+        )
 
         self.groq_client = None
         if self.groq_api_key:
@@ -27,67 +72,376 @@ class LLMService:
             except Exception as e:
                 print(f"Failed to init Groq client: {e}")
 
+        self.gemini_model = None
         if self.gemini_api_key:
             try:
                 genai.configure(api_key=self.gemini_api_key)
-                self.gemini_model = genai.GenerativeModel('gemini-pro')
+                self.gemini_model = genai.GenerativeModel(GEMINI_MODEL)
             except Exception as e:
                 print(f"Failed to init Gemini client: {e}")
 
-    def generate(self, prompt: str, system_instruction: str = "", retries: int = 3, json_mode: bool = False) -> Optional[str]:
-        # Try primary provider first
+        self.cache = get_llm_cache()
+
+    @property
+    def model(self) -> str:
+        return self._model_for(self.provider)
+
+    def _route(self, provider: str) -> str:
+        return f"{provider}:{self._model_for(provider)}"
+
+    def _model_for(self, provider: str) -> str:
+        return GEMINI_MODEL if provider == "gemini" else GROQ_MODEL
+
+    def _ordered_providers(self) -> list:
+        """Configured providers, ranked by the router (primary first until there is latency data)."""
+        configured = []
+        for provider in [self.provider] + [p for p in ("groq", "gemini") if p != self.provider]:
+            if provider == "groq" and self.groq_api_key:
+                configured.append(provider)
+            elif provider == "gemini" and self.gemini_model is not None:
+                configured.append(provider)
+        routes = {self._route(p): p for p in configured}
+        return [routes[r] for r in router.order(list(routes))]
+
+    def _log_failure(self, provider: str, e: Exception):
+        print(f"Provider ({provider}) failed: {e}")
+        log.error("llm.provider_failed", provider=provider, error=str(e), rate_limited=_is_rate_limited(e))
+        if _is_rate_limited(e):
+            get_scheduler(provider).penalize(_retry_after(e))
+
+    def cache_key(self, prompt: str, system_instruction: str = "", json_mode: bool = False) -> str:
+        return make_cache_key(self.model, system_instruction, prompt, json_mode)
+
+    def invalidate(self, prompt: str, system_instruction: str = "", json_mode: bool = False):
+        """Drops a cached response, e.g. one that turned out to be unparseable."""
+        if self.cache:
+            self.cache.delete(self.cache_key(prompt, system_instruction, json_mode))
+
+    async def acontinue(self, partial: str, system_instruction: str = "",
+                        priority: Priority = PRIORITY_INTERACTIVE) -> Optional[str]:
+        """Asks for the rest of a cut-off JSON output (sent in plain mode: the reply is a fragment)."""
+        return await self.agenerate(continuation_prompt(partial), system_instruction, json_mode=False, priority=priority)
+
+    def generate(self, prompt: str, system_instruction: str = "", retries: int = 3, json_mode: bool = False,
+                 use_cache: bool = True) -> Optional[str]:
+        key = None
+        if use_cache and self.cache:
+            key = self.cache_key(prompt, system_instruction, json_mode)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        result = self._generate_uncached(prompt, system_instruction, json_mode, retries)
+        if key and result:
+            self.cache.set(key, result)
+        return result
+
+    def _generate_uncached(self, prompt: str, system_instruction: str, json_mode: bool, retries: int = 3) -> Optional[str]:
+        # Providers in router order, falling back to the next one on failure
+        for attempt in range(max(1, retries)):
+            providers = self._ordered_providers()
+            if not providers:
+                break
+            for provider in providers:
+                health = router.health(self._route(provider))
+                if not health.try_acquire():
+                    continue
+                start = time.monotonic()
+                try:
+                    if provider == "groq":
+                        result = self._call_groq(prompt, system_instruction, json_mode)
+                    else:
+                        result = self._call_gemini(prompt, system_instruction)
+                except Exception as e:
+                    health.record_failure()
+                    self._log_failure(provider, e)
+                    continue
+                if result:
+                    health.record_success(time.monotonic() - start)
+                    return result
+                health.record_failure()
+            if attempt < retries - 1:
+                time.sleep(0.5 * 2 ** attempt)
+        return None
+
+    async def agenerate(self, prompt: str, system_instruction: str = "", retries: int = 3, json_mode: bool = False,
+                        use_cache: bool = True, priority: Priority = PRIORITY_INTERACTIVE) -> Optional[str]:
+        """
+        Async counterpart of generate(). Uses the shared pooled async clients so
+        an LLM round trip never blocks the event loop. Pass use_cache=False to
+        bypass the response cache. Calls are admitted through the per-provider
+        rate limiter; background work should pass PRIORITY_BACKGROUND so it
+        queues behind interactive requests.
+        """
+        key = None
+        if use_cache and self.cache:
+            key = self.cache_key(prompt, system_instruction, json_mode)
+            cached = self.cache.peek(key)
+            if cached is None:
+                cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                return cached
+
+        result = await self._agenerate_uncached(prompt, system_instruction, json_mode, retries, priority)
+        if key and result:
+            await asyncio.to_thread(self.cache.set, key, result)
+        return result
+
+    async def _agenerate_uncached(self, prompt: str, system_instruction: str, json_mode: bool, retries: int = 3,
+                                  priority: Priority = PRIORITY_INTERACTIVE) -> Optional[str]:
+        for attempt in range(max(1, retries)):
+            if not self._ordered_providers():
+                break
+            result = await self._ahedged(prompt, system_instruction, json_mode, priority)
+            if result:
+                return result
+            if attempt < retries - 1:
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        return None
+
+    async def _ahedged(self, prompt: str, system_instruction: str, json_mode: bool,
+                       priority: Priority = PRIORITY_INTERACTIVE) -> Optional[str]:
+        """
+        Calls the best provider; if it is still running past its p95 latency,
+        sends the same request to the next provider and takes whichever answers
+        first. A failed call falls through to the next provider immediately.
+        """
+        queue = self._ordered_providers()
+        tasks = {}
+
+        def launch() -> bool:
+            while queue:
+                provider = queue.pop(0)
+                if router.health(self._route(provider)).try_acquire():
+                    task = asyncio.ensure_future(
+                        self._timed_acall(provider, prompt, system_instruction, json_mode, priority)
+                    )
+                    tasks[task] = provider
+                    return True
+            return False
+
+        if not launch():
+            return None
+        try:
+            while tasks:
+                timeout = None
+                if queue and len(tasks) == 1:
+                    running = next(iter(tasks.values()))
+                    timeout = router.health(self._route(running)).hedge_delay()
+                done, _ = await asyncio.wait(list(tasks), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    log.warning("llm.hedge", provider=running, model=self._model_for(running),
+                                timeout=round(timeout, 3), hedge_provider=queue[0])
+                    launch()
+                    continue
+                for task in done:
+                    tasks.pop(task)
+                    if not task.cancelled() and task.exception() is None:
+                        return task.result()
+                if not tasks:
+                    launch()
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _timed_acall(self, provider: str, prompt: str, system_instruction: str, json_mode: bool,
+                           priority: Priority = PRIORITY_INTERACTIVE) -> str:
+        health = router.health(self._route(provider))
+        est_tokens = estimate_tokens(system_instruction, prompt)
+        try:
+            await get_scheduler(provider).acquire(priority, est_tokens)
+        except asyncio.CancelledError:
+            health.record_cancelled()
+            raise
+        start = time.monotonic()
         try:
-            if self.provider == "groq" and self.groq_client:
-                return self._call_groq(prompt, system_instruction, json_mode)
-            elif self.provider == "gemini" and self.gemini_api_key:
-                return self._call_gemini(prompt, system_instruction)
+            if provider == "groq":
+                result = await self._acall_groq(prompt, system_instruction, json_mode, est_tokens)
+            else:
+                result = await self._acall_gemini(prompt, system_instruction, est_tokens)
+        except asyncio.CancelledError:
+            health.record_cancelled(time.monotonic() - start)
+            raise
         except Exception as e:
-             error_msg = f"Primary provider ({self.provider}) failed: {e}"
-             print(error_msg)
-             with open("debug_log.txt", "a") as f:
-                 f.write(error_msg + "\n")
- 
-        # Fallback logic could go here, but for now we just return None or retry internally
-        return None
+            health.record_failure()
+            self._log_failure(provider, e)
+            raise
+        if not result:
+            health.record_failure()
+            raise ValueError(f"Empty response from {provider}")
+        health.record_success(time.monotonic() - start)
+        return result
+
+    async def astream(self, prompt: str, system_instruction: str = "", json_mode: bool = False,
+                      use_cache: bool = True, priority: Priority = PRIORITY_INTERACTIVE) -> AsyncIterator[str]:
+        """
+        Yields the completion as text deltas while the provider generates it.
+        A cached response is yielded as a single chunk; a completed stream is
+        written back to the cache.
+        """
+        key = None
+        if use_cache and self.cache:
+            key = self.cache_key(prompt, system_instruction, json_mode)
+            cached = self.cache.peek(key)
+            if cached is None:
+                cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                yield cached
+                return
+
+        # Tokens already sent can't be taken back, so fallback only happens
+        # before the first chunk; there is no hedging on this path.
+        parts = []
+        for provider in self._ordered_providers():
+            health = router.health(self._route(provider))
+            if not health.try_acquire():
+                continue
+            est_tokens = estimate_tokens(system_instruction, prompt)
+            if provider == "groq":
+                chunks = self._astream_groq(prompt, system_instruction, json_mode, est_tokens)
+            else:
+                chunks = self._astream_gemini(prompt, system_instruction, est_tokens)
+            start = None
+            try:
+                await get_scheduler(provider).acquire(priority, est_tokens)
+                start = time.monotonic()
+                async for chunk in chunks:
+                    parts.append(chunk)
+                    yield chunk
+            except (asyncio.CancelledError, GeneratorExit):
+                health.record_cancelled(time.monotonic() - start if start else None)
+                raise
+            except Exception as e:
+                health.record_failure()
+                self._log_failure(provider, e)
+                if parts:
+                    raise
+                continue
+            if not parts:
+                health.record_failure()
+                continue
+            health.record_success(time.monotonic() - start)
+            break
+
+        if key and parts:
+            await asyncio.to_thread(self.cache.set, key, "".join(parts))
+
+    def _groq_kwargs(self, prompt: str, system_instruction: str, json_mode: bool) -> dict:
+        kwargs = {
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_instruction,
+                },
+                {
+                    "role": "user",
+                    "content": prompt,
+                }
+            ],
+            "model": GROQ_MODEL,
+        }
+        if json_mode:
+            kwargs["response_format"] = {"type": "json_object"}
+        return kwargs
+
+    def _log_usage(self, chat_completion, provider: str = "groq", est_tokens: Optional[int] = None):
+        if getattr(chat_completion, 'usage', None):
+            usage = chat_completion.usage
+            print(f"Token Usage: {usage.total_tokens} (In: {usage.prompt_tokens}, Out: {usage.completion_tokens})")
+            LLM_PROMPT_TOKENS.inc(usage.prompt_tokens or 0, provider=provider, model=GROQ_MODEL)
+            LLM_COMPLETION_TOKENS.inc(usage.completion_tokens or 0, provider=provider, model=GROQ_MODEL)
+            if est_tokens is not None:
+                get_scheduler(provider).record_usage(est_tokens, usage.total_tokens)
 
     def _call_groq(self, prompt: str, system_instruction: str, json_mode: bool = False) -> str:
         try:
-            kwargs = {
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": system_instruction,
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt,
-                    }
-                ],
-                "model": "llama-3.1-8b-instant",
-            }
-            if json_mode:
-                kwargs["response_format"] = {"type": "json_object"}
-
-            chat_completion = self.groq_client.chat.completions.create(**kwargs)
-            
-            if hasattr(chat_completion, 'usage'):
-                usage = chat_completion.usage
-                print("DEBUG: ABOUT TO PRINT TOKEN USAGE")
-                print(f"Token Usage: {usage.total_tokens} (In: {usage.prompt_tokens}, Out: {usage.completion_tokens})")
-                
+            chat_completion = self.groq_client.chat.completions.create(
+                **self._groq_kwargs(prompt, system_instruction, json_mode)
+            )
+            self._log_usage(chat_completion)
+            return chat_completion.choices[0].message.content
+        except Exception as e:
+            print(f"Groq SDK Error: {e}")
+            raise e
+
+    async def _acall_groq(self, prompt: str, system_instruction: str, json_mode: bool = False,
+                          est_tokens: Optional[int] = None) -> str:
+        try:
+            client = get_async_groq_client(self.groq_api_key)
+            chat_completion = await client.chat.completions.create(
+                **self._groq_kwargs(prompt, system_instruction, json_mode)
+            )
+            self._log_usage(chat_completion, "groq", est_tokens)
             return chat_completion.choices[0].message.content
         except Exception as e:
             error_msg = f"Groq SDK Error: {e}"
             print(error_msg)
-            with open("debug_log.txt", "a") as f:
-                f.write(error_msg + "\n")
             raise e
 
     def _call_gemini(self, prompt: str, system_instruction: str) -> str:
         try:
             full_prompt = f"System: {system_instruction}\n\nUser: {prompt}"
             response = self.gemini_model.generate_content(full_prompt)
+            self._record_gemini_usage(response, None)
+            return response.text
+        except Exception as e:
+             print(f"Gemini SDK Error: {e}")
+             raise e
+
+    async def _acall_gemini(self, prompt: str, system_instruction: str, est_tokens: Optional[int] = None) -> str:
+        try:
+            full_prompt = f"System: {system_instruction}\n\nUser: {prompt}"
+            response = await self.gemini_model.generate_content_async(full_prompt)
+            self._record_gemini_usage(response, est_tokens)
             return response.text
         except Exception as e:
              print(f"Gemini SDK Error: {e}")
              raise e
+
+    async def _astream_groq(self, prompt: str, system_instruction: str, json_mode: bool = False,
+                            est_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        client = get_async_groq_client(self.groq_api_key)
+        # Groq rejects response_format together with stream=True, so JSON output
+        # relies on the prompt here (json_mode still selects the cache entry).
+        stream = await client.chat.completions.create(
+            stream=True, **self._groq_kwargs(prompt, system_instruction, json_mode=False)
+        )
+        async for chunk in stream:
+            x_groq = getattr(chunk, "x_groq", None)
+            if x_groq is not None and getattr(x_groq, "usage", None):
+                self._log_usage(x_groq, "groq", est_tokens)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def _astream_gemini(self, prompt: str, system_instruction: str,
+                              est_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        full_prompt = f"System: {system_instruction}\n\nUser: {prompt}"
+        response = await self.gemini_model.generate_content_async(full_prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+        self._record_gemini_usage(response, est_tokens)
+
+    def _record_gemini_usage(self, response, est_tokens: Optional[int]):
+        usage = getattr(response, "usage_metadata", None)
+        if not usage:
+            return
+        LLM_PROMPT_TOKENS.inc(getattr(usage, "prompt_token_count", 0) or 0, provider="gemini", model=GEMINI_MODEL)
+        LLM_COMPLETION_TOKENS.inc(getattr(usage, "candidates_token_count", 0) or 0, provider="gemini", model=GEMINI_MODEL)
+        total = getattr(usage, "total_token_count", None)
+        if total is not None and est_tokens is not None:
+            get_scheduler("gemini").record_usage(est_tokens, total)
+
+
+def _is_rate_limited(e: Exception) -> bool:
+    return getattr(e, "status_code", None) == 429 or getattr(e, "code", None) == 429
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import queue
+import random
+import hashlib
+import threading
+import contextvars
+from typing import Optional
+
+LOG_PATH = os.getenv("LOG_PATH", os.path.join("logs", "educore.jsonl"))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# String fields longer than this are truncated, except for a sampled fraction
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "2000"))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.05"))
+
+# Correlation ID of the request being served; copied into threads started via
+# asyncio.to_thread / run_in_executor along with the rest of the context.
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+_STOP = object()
+
+
+class JsonLineLogger:
+    """
+    Structured logger whose callers only pay for a dict build and a queue put.
+    A background thread serializes records as JSON lines, appends them to
+    `path` and rotates the file once it passes `max_bytes`.
+    """
+
+    def __init__(self, path: str = LOG_PATH, max_bytes: int = LOG_MAX_BYTES, backup_count: int = LOG_BACKUP_COUNT):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def info(self, event: str, **fields):
+        self._emit("info", event, fields)
+
+    def warning(self, event: str, **fields):
+        self._emit("warning", event, fields)
+
+    def error(self, event: str, **fields):
+        self._emit("error", event, fields)
+
+    def flush(self, timeout: float = 5.0):
+        """Blocks until everything queued so far has been written (used on shutdown)."""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout=5.0)
+        self._thread = None
+
+    def _emit(self, level: str, event: str, fields: dict):
+        record = {"ts": time.time(), "level": level, "event": event}
+        request_id = request_id_var.get()
+        if request_id:
+            record["request_id"] = request_id
+        for key, value in fields.items():
+            record[key] = _sample(value)
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # Never block the caller on logging
+            self.dropped += 1
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="jsonl-logger", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        f = open(self.path, "a", encoding="utf-8")
+        try:
+            while True:
+                item = self._queue.get()
+                batch = [item]
+                # Drain whatever else is waiting so one write covers many records
+                while len(batch) < 512:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stop = False
+                for item in batch:
+                    if item is _STOP:
+                        stop = True
+                    elif isinstance(item, threading.Event):
+                        f.flush()
+                        item.set()
+                    else:
+                        f.write(json.dumps(item, ensure_ascii=False, default=str) + "\n")
+                f.flush()
+
+                if f.tell() >= self.max_bytes:
+                    f.close()
+                    self._rotate()
+                    f = open(self.path, "a", encoding="utf-8")
+                if stop:
+                    return
+        finally:
+            f.close()
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+def _sample(value):
+    """Large string payloads (LLM responses, tracebacks) are kept whole only for a sampled fraction."""
+    if isinstance(value, str) and len(value) > LOG_MAX_FIELD_CHARS and random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+        return {
+            "truncated": value[:LOG_MAX_FIELD_CHARS],
+            "length": len(value),
+            "sha1": hashlib.sha1(value.encode("utf-8", "replace")).hexdigest(),
+        }
+    return value
+
+
+log = JsonLineLogger()
@@ -0,0 +1,204 @@
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Latency buckets in seconds, from a fast cache hit up to a full video render
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Tuple = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            idx = bisect_left(self.buckets, value)
+            if idx < len(self.buckets):
+                entry[0][idx] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_sample(self, key, value) -> List[str]:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, c in zip(self.buckets, counts):
+            cumulative += c
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, (('le', repr(float(bound))),))} {cumulative}")
+        lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, (('le', '+Inf'),))} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class RateMeter:
+    """Events per second over a sliding window (e.g. proctor frames/sec)."""
+
+    def __init__(self, window_seconds: float = 10.0):
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._events = deque()
+
+    def mark(self):
+        now = time.monotonic()
+        with self._lock:
+            self._events.append(now)
+            self._trim(now)
+
+    def rate(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            return len(self._events) / self.window_seconds
+
+    def _trim(self, now: float):
+        while self._events and self._events[0] < now - self.window_seconds:
+            self._events.popleft()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._scrape_hooks: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.setdefault(metric.name, metric)
+        return self._metrics[metric.name]
+
+    def on_scrape(self, hook: Callable[[], None]):
+        """Registers a callback that refreshes gauges right before rendering."""
+        self._scrape_hooks.append(hook)
+
+    def render(self) -> str:
+        for hook in self._scrape_hooks:
+            try:
+                hook()
+            except Exception as e:
+                print(f"Metrics scrape hook failed: {e}")
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help_text, labelnames))
+
+
+def gauge(name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help_text, labelnames))
+
+
+def histogram(name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help_text, labelnames, buckets))
+
+
+# --- Application metrics ---
+
+HTTP_REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds", "HTTP request latency by endpoint", ["method", "path", "status"]
+)
+AGENT_STAGE_SECONDS = histogram(
+    "agent_stage_duration_seconds", "Time spent in each agent stage", ["agent", "stage"]
+)
+LLM_PROMPT_TOKENS = counter("llm_prompt_tokens_total", "Prompt tokens sent to the LLM", ["provider", "model"])
+LLM_COMPLETION_TOKENS = counter("llm_completion_tokens_total", "Completion tokens received from the LLM", ["provider", "model"])
+LLM_CACHE_LOOKUPS = counter("llm_cache_lookups_total", "LLM cache lookups by result", ["result"])
+COALESCED_REQUESTS = counter("coalesced_requests_total", "Single-flight leaders and deduplicated followers", ["endpoint", "role"])
+JSON_PARSE_FAILURES = counter("llm_json_parse_failures_total", "Agent outputs that could not be parsed", ["agent"])
+JSON_RECOVERIES = counter("llm_json_recoveries_total", "Malformed agent outputs recovered by repair or continuation", ["agent", "method"])
+VIDEO_ENCODE_SECONDS = histogram("video_encode_duration_seconds", "Time to encode a lecture video")
+PROCTOR_FRAMES = counter("proctor_frames_total", "Frames processed by the proctor", ["result"])
+PROCTOR_FRAMES_REUSED = counter("proctor_frames_reused_total", "Frames answered from the last analysis (no motion)")
+PROCTOR_FRAMES_DROPPED = counter("proctor_frames_dropped_total", "Stale frames/statuses replaced before use", ["stage"])
+PROCTOR_FPS = gauge("proctor_frames_per_second", "Proctor frames processed per second (10s window)")
+
+proctor_frame_rate = RateMeter()
+REGISTRY.on_scrape(lambda: PROCTOR_FPS.set(proctor_frame_rate.rate()))
+
+
+def stage_timer(agent: str, stage: str):
+    """Context manager timing one stage of an agent: `with stage_timer("PlannerAgent", "llm"): ...`"""
+    return AGENT_STAGE_SECONDS.time(agent=agent, stage=stage)
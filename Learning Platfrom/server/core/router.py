@@ -0,0 +1,160 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+from server.core.logger import log
+
+# Rolling window of recent calls used for latency percentiles and error rate
+ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "100"))
+ROUTER_MIN_SAMPLES = int(os.getenv("LLM_ROUTER_MIN_SAMPLES", "10"))
+# Circuit breaker: open after this many consecutive failures, retry after cooldown
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+# Never hedge earlier than this, however fast the provider's p95 is
+HEDGE_MIN_SECONDS = float(os.getenv("LLM_HEDGE_MIN_SECONDS", "1.0"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+class ProviderHealth:
+    """Rolling latency/error statistics and a circuit breaker for one provider:model."""
+
+    def __init__(self, name: str, window: int = ROUTER_WINDOW):
+        self.name = name
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)  # True = success
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+            self._outcomes.append(True)
+            self.consecutive_failures = 0
+            self.state = CLOSED
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._outcomes.append(False)
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= BREAKER_FAILURE_THRESHOLD:
+                if self.state != OPEN:
+                    provider, _, model = self.name.partition(":")
+                    log.warning("llm.circuit_open", provider=provider, model=model,
+                                failures=self.consecutive_failures, cooldown_seconds=BREAKER_COOLDOWN_SECONDS)
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def record_cancelled(self, elapsed: Optional[float] = None):
+        """
+        A call abandoned by the caller (e.g. it lost a hedge). Its elapsed time
+        is a lower bound on the real latency and still counts, otherwise a
+        provider that keeps losing hedges would never look slow.
+        """
+        with self._lock:
+            if elapsed is not None:
+                self._latencies.append(elapsed)
+            self._trial_in_flight = False
+
+    def is_available(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= BREAKER_COOLDOWN_SECONDS
+            return not self._trial_in_flight
+
+    def try_acquire(self) -> bool:
+        """Claims permission for one call; an open breaker admits a single trial after cooldown."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= BREAKER_COOLDOWN_SECONDS:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < ROUTER_MIN_SAMPLES:
+                return None
+            return _percentile(sorted(self._latencies), q)
+
+    def p50(self) -> Optional[float]:
+        return self.percentile(0.5)
+
+    def p95(self) -> Optional[float]:
+        return self.percentile(0.95)
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return 1.0 - sum(self._outcomes) / len(self._outcomes)
+
+    def hedge_delay(self) -> Optional[float]:
+        p95 = self.p95()
+        return max(p95, HEDGE_MIN_SECONDS) if p95 is not None else None
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "p50": self.p50(),
+            "p95": self.p95(),
+            "error_rate": self.error_rate(),
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class ProviderRouter:
+    """Orders providers by health and observed latency."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._health: Dict[str, ProviderHealth] = {}
+
+    def health(self, name: str) -> ProviderHealth:
+        with self._lock:
+            if name not in self._health:
+                self._health[name] = ProviderHealth(name)
+            return self._health[name]
+
+    def order(self, names: List[str]) -> List[str]:
+        """
+        Available providers first, fastest p50 first. The given order is the
+        tie-breaker, so the configured primary wins until there is data.
+        Providers with an open circuit are left out.
+        """
+        def sort_key(item):
+            position, name = item
+            p50 = self.health(name).p50()
+            return (p50 if p50 is not None else float("inf"), position)
+
+        available = [(i, n) for i, n in enumerate(names) if self.health(n).is_available()]
+        measured = all(self.health(n).p50() is not None for _, n in available)
+        if not measured:
+            return [n for _, n in available]
+        return [n for _, n in sorted(available, key=sort_key)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            items = list(self._health.items())
+        return {name: health.stats() for name, health in items}
+
+
+router = ProviderRouter()
@@ -0,0 +1,195 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Dict, Optional, Union
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0   # roadmap / chapter requests a user is waiting on
+PRIORITY_BACKGROUND = 10   # video scripts, prefetch
+
+# Provider quotas (requests and tokens per minute)
+PROVIDER_LIMITS = {
+    "groq": (int(os.getenv("GROQ_RPM", "30")), int(os.getenv("GROQ_TPM", "6000"))),
+    "gemini": (int(os.getenv("GEMINI_RPM", "15")), int(os.getenv("GEMINI_TPM", "32000"))),
+}
+# Completion size assumed before the real usage is known
+LLM_DEFAULT_COMPLETION_TOKENS = int(os.getenv("LLM_DEFAULT_COMPLETION_TOKENS", "1024"))
+# Back-off applied on a 429 that carries no Retry-After header
+RATE_LIMIT_PENALTY_SECONDS = float(os.getenv("LLM_RATE_LIMIT_PENALTY_SECONDS", "5"))
+
+
+class PriorityTicket:
+    """
+    A priority that can be raised while the call holding it waits in a
+    scheduler queue, e.g. when a reader starts waiting on a chapter that is
+    being prefetched at background priority.
+    """
+
+    def __init__(self, value: int):
+        self.value = value
+        self._queued: Dict[asyncio.Future, "ProviderScheduler"] = {}
+
+    def raise_to(self, value: int):
+        if value >= self.value:
+            return
+        self.value = value
+        for future, scheduler in list(self._queued.items()):
+            scheduler.requeue(future, value)
+
+
+Priority = Union[int, PriorityTicket]
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough prompt size (~4 chars per token) plus the expected completion."""
+    return sum(len(t) for t in texts) // 4 + LLM_DEFAULT_COMPLETION_TOKENS
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until `amount` can be taken (0 if available now)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+    def drain(self, seconds: float):
+        """Empties the bucket so nothing is granted for `seconds`."""
+        self._refill()
+        self.tokens = min(self.tokens, -self.rate * seconds)
+
+
+class ProviderScheduler:
+    """
+    Admission control for one provider: a request bucket and a token bucket
+    (the quota), and a priority queue deciding who goes next when the quota
+    is the bottleneck.
+    """
+
+    def __init__(self, name: str, rpm: int, tpm: int):
+        self.name = name
+        self.requests = TokenBucket(rpm / 60.0, rpm)
+        self.tokens = TokenBucket(tpm / 60.0, tpm)
+        self._waiters = []  # heap of (priority, seq, est_tokens, future, enqueued_at)
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pump_task: Optional[asyncio.Task] = None
+
+        self.granted = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def acquire(self, priority: Priority = PRIORITY_INTERACTIVE, est_tokens: int = LLM_DEFAULT_COMPLETION_TOKENS):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        ticket = priority if isinstance(priority, PriorityTicket) else None
+        value = ticket.value if ticket else priority
+        heapq.heappush(self._waiters, (value, next(self._seq), est_tokens, future, time.monotonic()))
+        if ticket:
+            ticket._queued[future] = self
+        self._wake()
+        try:
+            await future
+        finally:
+            if ticket:
+                ticket._queued.pop(future, None)
+
+    def requeue(self, future: asyncio.Future, priority: int):
+        """Queues a waiting call again at a higher priority; its old entry is skipped once granted."""
+        entry = next((w for w in self._waiters if w[3] is future), None)
+        if entry is None or future.done():
+            return
+        # Same sequence number: it keeps its place among calls of the new priority
+        heapq.heappush(self._waiters, (priority, entry[1], entry[2], future, entry[4]))
+        self._wake()
+
+    def record_usage(self, est_tokens: int, actual_tokens: Optional[int]):
+        """Corrects the token bucket once the provider reports real usage."""
+        if actual_tokens is not None:
+            self.tokens.consume(actual_tokens - est_tokens)
+
+    def penalize(self, retry_after: Optional[float] = None):
+        """Called on a 429: hold every queued call until the provider's window resets."""
+        self.rate_limited += 1
+        self.requests.drain(retry_after or RATE_LIMIT_PENALTY_SECONDS)
+
+    def queue_depth(self) -> int:
+        # A requeued call has two entries
+        return len({id(w[3]) for w in self._waiters if not w[3].done()})
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth(),
+            "queued_interactive": len({id(w[3]) for w in self._waiters if not w[3].done() and w[0] <= PRIORITY_INTERACTIVE}),
+            "granted": self.granted,
+            "rate_limited": self.rate_limited,
+            "avg_wait_seconds": self.total_wait / self.granted if self.granted else 0.0,
+            "max_wait_seconds": self.max_wait,
+            "request_tokens": round(self.requests.tokens, 2),
+            "token_budget": round(self.tokens.tokens, 2),
+        }
+
+    def _wake(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.ensure_future(self._pump())
+
+    async def _pump(self):
+        while self._waiters:
+            priority, seq, est_tokens, future, enqueued_at = self._waiters[0]
+            if future.done():
+                # Caller gave up (cancelled) while queued
+                heapq.heappop(self._waiters)
+                continue
+            wait = max(self.requests.time_until(1), self.tokens.time_until(est_tokens))
+            if wait <= 0:
+                heapq.heappop(self._waiters)
+                self.requests.consume(1)
+                self.tokens.consume(est_tokens)
+                waited = time.monotonic() - enqueued_at
+                self.granted += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+                future.set_result(None)
+                continue
+            # Sleep until the bucket refills, or until a new (possibly higher priority) caller arrives
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+
+_schedulers: Dict[str, ProviderScheduler] = {}
+
+
+def get_scheduler(provider: str) -> ProviderScheduler:
+    if provider not in _schedulers:
+        rpm, tpm = PROVIDER_LIMITS.get(provider, (60, 100000))
+        _schedulers[provider] = ProviderScheduler(provider, rpm, tpm)
+    return _schedulers[provider]
+
+
+def scheduler_stats() -> dict:
+    return {name: scheduler.stats() for name, scheduler in _schedulers.items()}
@@ -0,0 +1,111 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+from server.core.metrics import COALESCED_REQUESTS
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller (the leader)
+    runs the work, every caller that arrives while it is in flight (followers)
+    awaits the same task and receives the leader's result or exception.
+
+    A leader can pass `state` (e.g. a feed of partial results); followers
+    read it with shared() for as long as the flight can still be joined.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, List] = {}  # key -> [task, waiter count, leader state]
+        self.leaders = 0
+        self.deduplicated = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]], state: Any = None) -> T:
+        entry = self._inflight.get(key)
+        if entry is None:
+            self.leaders += 1
+            COALESCED_REQUESTS.inc(endpoint=self.name, role="leader")
+            task = asyncio.ensure_future(fn())
+            entry = self._inflight[key] = [task, 0, state]
+            task.add_done_callback(lambda t, key=key: self._forget(key, t))
+        else:
+            self.deduplicated += 1
+            COALESCED_REQUESTS.inc(endpoint=self.name, role="deduplicated")
+
+        task = entry[0]
+        entry[1] += 1
+        try:
+            # Shield so one caller going away doesn't cancel the work for the others
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if entry[1] == 1 and not task.done():
+                # Last interested caller is gone: stop the work too
+                task.cancel()
+            raise
+        finally:
+            entry[1] -= 1
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    def shared(self, key: str) -> Any:
+        """The state the leader of the in-flight call for `key` passed, or None."""
+        entry = self._inflight.get(key)
+        return entry[2] if entry is not None else None
+
+    def stats(self) -> dict:
+        return {
+            "leaders": self.leaders,
+            "deduplicated": self.deduplicated,
+            "in_flight": len(self._inflight),
+        }
+
+    def _forget(self, key: str, task: asyncio.Task):
+        entry = self._inflight.get(key)
+        if entry is not None and entry[0] is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved even if every caller went away
+        if not task.cancelled():
+            task.exception()
+
+
+class Broadcast:
+    """
+    The events of one in-flight stream, kept so that a subscriber joining
+    late first replays what it missed and then follows live.
+    """
+
+    def __init__(self):
+        self.events: List[Tuple[str, Any]] = []
+        self.closed = False
+        self._changed = asyncio.Event()
+
+    def publish(self, event: str, payload: Any):
+        self.events.append((event, payload))
+        self._notify()
+
+    def close(self):
+        self.closed = True
+        self._notify()
+
+    async def follow(self, until: Optional[asyncio.Future] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """Every event, from the first; ends when the broadcast closes or `until` completes."""
+        idx = 0
+        while True:
+            while idx < len(self.events):
+                yield self.events[idx]
+                idx += 1
+            if self.closed or (until is not None and until.done()):
+                return
+            changed = asyncio.ensure_future(self._changed.wait())
+            try:
+                await asyncio.wait([changed, until] if until is not None else [changed],
+                                   return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                changed.cancel()
+
+    def _notify(self):
+        # Wake current followers; later waits use a fresh event
+        self._changed.set()
+        self._changed = asyncio.Event()
@@ -0,0 +1,201 @@
+import os
+import time
+import threading
+from typing import Dict, List, Optional
+from sqlalchemy import Float, Index, Integer, String, Text, create_engine, event, select
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
+from server.shared.schemas import Chapter, ChapterContent, CourseRoadmap
+
+EDUCORE_DB_URL = os.getenv("EDUCORE_DB_URL", "sqlite:///educore.sqlite3")
+STORE_POOL_SIZE = int(os.getenv("STORE_POOL_SIZE", "5"))
+STORE_MAX_OVERFLOW = int(os.getenv("STORE_MAX_OVERFLOW", "10"))
+STORE_POOL_RECYCLE_SECONDS = int(os.getenv("STORE_POOL_RECYCLE_SECONDS", "1800"))
+STORE_DISABLED = os.getenv("STORE_DISABLED", "0") == "1"
+
+
+def normalize_text(text: Optional[str]) -> str:
+    return " ".join((text or "").lower().split())
+
+
+def chapter_key(chapter: Chapter) -> str:
+    """Chapter content only depends on the chapter itself, so this identifies it across roadmaps."""
+    return f"{chapter.chapter_number}|{normalize_text(chapter.title)}|{normalize_text(chapter.description)}"
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class RoadmapRow(Base):
+    __tablename__ = "roadmaps"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    topic: Mapped[str] = mapped_column(String(512))
+    topic_normalized: Mapped[str] = mapped_column(String(512))
+    grade_level: Mapped[str] = mapped_column(String(64))
+    framework: Mapped[str] = mapped_column(String(64))
+    data: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[float] = mapped_column(Float)
+
+    __table_args__ = (
+        Index("idx_roadmaps_lookup", "topic_normalized", "grade_level", "framework"),
+    )
+
+
+class ChapterRow(Base):
+    __tablename__ = "chapters"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    chapter_key: Mapped[str] = mapped_column(String(2048), unique=True)
+    chapter_number: Mapped[int] = mapped_column(Integer, index=True)
+    topic_normalized: Mapped[Optional[str]] = mapped_column(String(512), nullable=True)
+    grade_level: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    data: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[float] = mapped_column(Float)
+
+    __table_args__ = (
+        Index("idx_chapters_course", "topic_normalized", "grade_level", "chapter_number"),
+    )
+
+
+class CourseStore:
+    """
+    Persists generated roadmaps and chapter content so a repeated request is served by one indexed query instead of the LLM.
+
+    Methods are blocking; call them through asyncio.to_thread from the API.
+    Sessions come from a pooled engine, so concurrent readers don't reconnect.
+    """
+
+    def __init__(self, url: str = EDUCORE_DB_URL):
+        self.url = url
+        kwargs = {"pool_pre_ping": True, "pool_recycle": STORE_POOL_RECYCLE_SECONDS}
+        if url.startswith("sqlite"):
+            kwargs["connect_args"] = {"check_same_thread": False}
+        if url not in ("sqlite://", "sqlite:///:memory:"):
+            kwargs["pool_size"] = STORE_POOL_SIZE
+            kwargs["max_overflow"] = STORE_MAX_OVERFLOW
+        self.engine = create_engine(url, **kwargs)
+        if url.startswith("sqlite"):
+            event.listen(self.engine, "connect", _sqlite_pragmas)
+        Base.metadata.create_all(self.engine)
+        self._session = sessionmaker(self.engine, expire_on_commit=False)
+
+        self.hits = 0
+        self.misses = 0
+
+    # --- Roadmaps ---
+
+    def get_roadmap(self, topic: str, grade_level: str, framework: str = "General") -> Optional[CourseRoadmap]:
+        stmt = (
+            select(RoadmapRow.data)
+            .where(RoadmapRow.topic_normalized == normalize_text(topic),
+                   RoadmapRow.grade_level == grade_level,
+                   RoadmapRow.framework == (framework or "General"))
+            .order_by(RoadmapRow.created_at.desc())
+            .limit(1)
+        )
+        with self._session() as session:
+            data = session.execute(stmt).scalar_one_or_none()
+        return self._count(CourseRoadmap.model_validate_json(data) if data else None)
+
+    def get_roadmap_by_id(self, row_id: int) -> Optional[CourseRoadmap]:
+        with self._session() as session:
+            row = session.get(RoadmapRow, row_id)
+        return CourseRoadmap.model_validate_json(row.data) if row else None
+
+    def save_roadmap(self, topic: str, grade_level: str, framework: str, roadmap: CourseRoadmap) -> int:
+        row = RoadmapRow(
+            topic=topic,
+            topic_normalized=normalize_text(topic),
+            grade_level=grade_level,
+            framework=framework or "General",
+            data=roadmap.model_dump_json(),
+            created_at=time.time(),
+        )
+        with self._session.begin() as session:
+            session.add(row)
+        return row.id
+
+    def list_roadmaps(self, grade_level: Optional[str] = None, framework: Optional[str] = None) -> List[dict]:
+        """Lightweight listing (no payloads) of stored roadmaps."""
+        stmt = select(RoadmapRow.id, RoadmapRow.topic, RoadmapRow.topic_normalized,
+                      RoadmapRow.grade_level, RoadmapRow.framework)
+        if grade_level is not None:
+            stmt = stmt.where(RoadmapRow.grade_level == grade_level)
+        if framework is not None:
+            stmt = stmt.where(RoadmapRow.framework == framework)
+        with self._session() as session:
+            return [dict(row._mapping) for row in session.execute(stmt)]
+
+    # --- Chapters ---
+
+    def get_chapter(self, chapter: Chapter) -> Optional[ChapterContent]:
+        stmt = select(ChapterRow.data).where(ChapterRow.chapter_key == chapter_key(chapter))
+        with self._session() as session:
+            data = session.execute(stmt).scalar_one_or_none()
+        return self._count(ChapterContent.model_validate_json(data) if data else None)
+
+    def get_chapters(self, chapters: List[Chapter]) -> Dict[int, ChapterContent]:
+        """Bulk read: every stored chapter of a roadmap in one query, keyed by chapter number."""
+        keys = {chapter_key(c): c.chapter_number for c in chapters}
+        if not keys:
+            return {}
+        stmt = select(ChapterRow.chapter_key, ChapterRow.data).where(ChapterRow.chapter_key.in_(list(keys)))
+        with self._session() as session:
+            rows = session.execute(stmt).all()
+        return {keys[key]: ChapterContent.model_validate_json(data) for key, data in rows}
+
+    def save_chapter(self, chapter: Chapter, content: ChapterContent,
+                     topic: Optional[str] = None, grade_level: Optional[str] = None):
+        key = chapter_key(chapter)
+        with self._session.begin() as session:
+            row = session.execute(select(ChapterRow).where(ChapterRow.chapter_key == key)).scalar_one_or_none()
+            if row is None:
+                row = ChapterRow(chapter_key=key, chapter_number=chapter.chapter_number)
+                session.add(row)
+            row.data = content.model_dump_json()
+            row.created_at = time.time()
+            if topic is not None:
+                row.topic_normalized = normalize_text(topic)
+            if grade_level is not None:
+                row.grade_level = grade_level
+
+    def stats(self) -> dict:
+        pool = self.engine.pool
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "pool": pool.status(),
+        }
+
+    def close(self):
+        self.engine.dispose()
+
+    def _count(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+_store: Optional[CourseStore] = None
+_store_lock = threading.Lock()
+
+
+def get_course_store() -> Optional[CourseStore]:
+    """Shared store, or None when persistence is disabled (STORE_DISABLED=1)."""
+    global _store
+    if STORE_DISABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = CourseStore()
+        return _store
@@ -0,0 +1,160 @@
+import os
+import re
+import zlib
+import random
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+# Minimum word-level similarity for a stored roadmap to be reused
+TOPIC_MATCH_THRESHOLD = float(os.getenv("TOPIC_MATCH_THRESHOLD", "0.8"))
+TOPIC_MINHASH_PERMUTATIONS = int(os.getenv("TOPIC_MINHASH_PERMUTATIONS", "64"))
+TOPIC_MINHASH_BANDS = int(os.getenv("TOPIC_MINHASH_BANDS", "16"))
+TOPIC_SHINGLE_SIZE = 3
+
+# Words that change how a request is phrased but not what the course is about
+_FILLER = {
+    "a", "an", "the", "of", "to", "in", "on", "for", "and", "with",
+    "intro", "introduction", "introductory", "basic", "basics", "fundamentals",
+    "fundamental", "course", "lesson", "lessons", "beginner", "beginners", "overview",
+}
+_PRIME = (1 << 61) - 1
+_ROMAN = re.compile(r"(x{0,3})(ix|iv|v?i{0,3})")
+_ROMAN_VALUES = {"i": 1, "v": 5, "x": 10}
+
+
+def normalize_topic(topic: str) -> str:
+    """'Intro to  Quantum-Physics!' -> 'quantum physics'"""
+    words = re.findall(r"[a-z0-9]+", (topic or "").lower())
+    kept = [w for w in words if w not in _FILLER]
+    return " ".join(kept or words)
+
+
+def _shingles(text: str) -> Set[str]:
+    padded = f" {text} "
+    if len(padded) <= TOPIC_SHINGLE_SIZE:
+        return {padded}
+    return {padded[i:i + TOPIC_SHINGLE_SIZE] for i in range(len(padded) - TOPIC_SHINGLE_SIZE + 1)}
+
+
+def _words(text: str) -> Set[str]:
+    """Word tokens for scoring: roman numerals become numbers, a plural 's' is dropped."""
+    words = set()
+    for word in text.split():
+        if _ROMAN.fullmatch(word):
+            word = str(_roman_value(word))
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.add(word)
+    return words
+
+
+def _roman_value(numeral: str) -> int:
+    total = 0
+    for idx, char in enumerate(numeral):
+        value = _ROMAN_VALUES[char]
+        following = _ROMAN_VALUES[numeral[idx + 1]] if idx + 1 < len(numeral) else 0
+        total += -value if value < following else value
+    return total
+
+
+def _numbers(words: Set[str]) -> Set[str]:
+    # "Statistics 2" / "Linear Algebra II" are different courses from the unnumbered one
+    return {w for w in words if w.isdigit()}
+
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class TopicIndex:
+    """
+    Near-duplicate lookup over the topics of stored roadmaps.
+
+    Topics are normalized (case, punctuation, filler words like "intro to"),
+    split into character trigrams and MinHashed; LSH bands over the signature
+    narrow the search to a few candidates. Candidates are scored on word
+    tokens, not trigrams, because one word can change the subject while
+    sharing most of its characters ("Inorganic" / "Organic Chemistry"). A
+    candidate whose numbers or roman numerals differ never matches. Entries
+    are partitioned by (grade_level, framework) so a match never crosses
+    audiences.
+    """
+
+    def __init__(self, threshold: float = TOPIC_MATCH_THRESHOLD,
+                 permutations: int = TOPIC_MINHASH_PERMUTATIONS, bands: int = TOPIC_MINHASH_BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = max(1, permutations // bands)
+        rng = random.Random(1729)  # fixed so signatures are stable across restarts
+        self._coeffs = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(self.bands * self.rows)]
+
+        self._lock = threading.Lock()
+        self._entries: Dict[int, Tuple[str, str, Set[str]]] = {}  # roadmap id -> (scope, normalized, words)
+        self._buckets: Dict[Tuple[str, int, Tuple[int, ...]], List[int]] = defaultdict(list)
+
+        self.lookups = 0
+        self.matches = 0
+
+    def add(self, roadmap_id: int, topic: str, grade_level: str, framework: str = "General"):
+        scope = self._scope(grade_level, framework)
+        normalized = normalize_topic(topic)
+        shingles = _shingles(normalized)
+        signature = self._signature(shingles)
+        with self._lock:
+            self._entries[roadmap_id] = (scope, normalized, _words(normalized))
+            for band, key in self._band_keys(signature):
+                self._buckets[(scope, band, key)].append(roadmap_id)
+
+    def lookup(self, topic: str, grade_level: str, framework: str = "General") -> Optional[Tuple[int, float, str]]:
+        """Best (roadmap id, similarity, normalized topic) at or above the threshold, else None."""
+        scope = self._scope(grade_level, framework)
+        normalized = normalize_topic(topic)
+        signature = self._signature(_shingles(normalized))
+        words = _words(normalized)
+        numbers = _numbers(words)
+        best = None
+        with self._lock:
+            self.lookups += 1
+            candidates = set()
+            for band, key in self._band_keys(signature):
+                candidates.update(self._buckets.get((scope, band, key), ()))
+            for roadmap_id in candidates:
+                entry_scope, entry_topic, entry_words = self._entries[roadmap_id]
+                if entry_topic == normalized:
+                    score = 1.0
+                elif _numbers(entry_words) != numbers:
+                    continue
+                else:
+                    score = _jaccard(words, entry_words)
+                # Ties go to the newest roadmap (ids increase)
+                if best is None or (score, roadmap_id) > (best[1], best[0]):
+                    best = (roadmap_id, score, entry_topic)
+            if best is None or best[1] < self.threshold:
+                return None
+            self.matches += 1
+            return best
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            "topics": len(self._entries),
+            "lookups": self.lookups,
+            "matches": self.matches,
+            "threshold": self.threshold,
+        }
+
+    def _scope(self, grade_level: str, framework: str) -> str:
+        return f"{' '.join((grade_level or '').lower().split())}|{' '.join((framework or 'General').lower().split())}"
+
+    def _signature(self, shingles: Set[str]) -> List[int]:
+        hashed = [zlib.crc32(s.encode("utf-8")) for s in shingles]
+        return [min((a * h + b) % _PRIME for h in hashed) for a, b in self._coeffs]
+
+    def _band_keys(self, signature: List[int]):
+        for band in range(self.bands):
+            yield band, tuple(signature[band * self.rows:(band + 1) * self.rows])
@@ -1,18 +1,39 @@
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from server.shared.schemas import CourseRequest, CourseRoadmap, ChapterContent, ChapterRequest
+from server.shared.schemas import CourseRequest, CourseRoadmap, ChapterContent, ChapterRequest, FullCourseRequest
 from server.agents.planner_agent.planner import PlannerAgent
 from server.agents.content_agent.content import ContentAgent
-# from server.agents.proctor_agent.proctor import ProctorAgent
+from server.agents.course_agent.course import CourseAgent
+from server.agents.course_agent.prefetch import ChapterPrefetcher
+from server.core.llm import close_async_clients
+from server.core.cache import get_llm_cache
+from server.core.singleflight import Broadcast, SingleFlight
+from server.core.jobs import JobQueue, FINISHED
+from server.core.store import chapter_key, get_course_store
+from server.core.topic_index import TopicIndex, normalize_topic
+from server.core.router import router
+from server.core.scheduler import PRIORITY_INTERACTIVE, PriorityTicket, scheduler_stats
+from server.core.metrics import REGISTRY, HTTP_REQUEST_SECONDS, gauge
+from server.core.logger import log, request_id_var
+from server.agents.proctor_agent.engine import ProctorEngine
+from server.agents.proctor_agent.stream import ProctorSession
 import asyncio
+import json
+import time
+import uuid
+from typing import NamedTuple, Optional
 
 app = FastAPI(title="EduCore API", version="1.0.0")
 
 from fastapi.staticfiles import StaticFiles
-from server.agents.media_agent.media import MediaAgent
+from server.agents.media_agent.media import MediaAgent, shutdown_render_pool
 import os
+import mimetypes
 from pydantic import BaseModel
 
+# HLS types are missing from many platforms' tables (.ts even maps to Qt translations on some)
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/mp2t", ".ts")
 app.mount("/static", StaticFiles(directory="client/static"), name="static")
 
 app.add_middleware(
@@ -23,14 +44,50 @@ app.add_middleware(
 )
 
 from fastapi import Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    # Correlation ID shared by every log line written while serving this request
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        request_id_var.reset(token)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # For streaming responses this measures time to first byte
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", None) or "unmatched"
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start, method=request.method, path=path, status=str(status)
+        )
+
+@app.middleware("http")
+async def no_cache_playlists(request: Request, call_next):
+    # HLS playlists grow while the video renders; players must always re-fetch them
+    response = await call_next(request)
+    if request.url.path.endswith(".m3u8"):
+        response.headers["Cache-Control"] = "no-cache"
+    return response
 
 @app.exception_handler(Exception)
 async def debug_exception_handler(request: Request, exc: Exception):
     error_msg = f"Unhandled Exception: {exc}"
     print(error_msg)
-    with open("debug_error.txt", "a") as f:
-        f.write(error_msg + "\n")
+    log.error("unhandled_exception", path=request.url.path, error=str(exc))
     return JSONResponse(
         status_code=500,
         content={"message": "Internal Server Error", "debug": str(exc)},
@@ -40,6 +97,156 @@ planner_agent = PlannerAgent()
 content_agent = ContentAgent()
 media_agent = MediaAgent()
 
+# Identical in-flight generations share one LLM call
+course_flight = SingleFlight("course")
+chapter_flight = SingleFlight("chapter")
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+def course_key(topic: str, grade_level: str, framework: str = "General") -> str:
+    return f"{normalize_topic(topic)}|{_normalize(grade_level)}|{_normalize(framework)}"
+
+# Near-duplicate topics ("Intro to Quantum Physics") reuse stored roadmaps
+topic_index = TopicIndex()
+
+async def plan_roadmap(topic: str, grade_level: str, framework: str = "General") -> CourseRoadmap:
+    async def plan():
+        store = get_course_store()
+        if store:
+            stored = await asyncio.to_thread(store.get_roadmap, topic, grade_level, framework)
+            if stored:
+                log.info("course.roadmap_stored", topic=topic)
+                return stored
+
+            match = topic_index.lookup(topic, grade_level, framework)
+            if match:
+                roadmap_row_id, score, matched_topic = match
+                stored = await asyncio.to_thread(store.get_roadmap_by_id, roadmap_row_id)
+                log.info("course.topic_match", topic=topic, matched_topic=matched_topic,
+                         score=round(score, 3), reused=stored is not None)
+                if stored:
+                    return stored
+
+        roadmap = await planner_agent.generate_roadmap(topic, grade_level)
+        log.info("course.roadmap_ready", topic=topic, ok=roadmap is not None)
+
+        if not roadmap:
+            raise HTTPException(status_code=500, detail="Failed to generate roadmap")
+        if store:
+            roadmap_row_id = await asyncio.to_thread(store.save_roadmap, topic, grade_level, framework, roadmap)
+            topic_index.add(roadmap_row_id, topic, grade_level, framework)
+        return roadmap
+
+    return await course_flight.do(course_key(topic, grade_level, framework), plan)
+
+class ChapterFlight(NamedTuple):
+    """What a chapter_flight leader shares with the requests that join it."""
+    priority: PriorityTicket
+    events: Optional[Broadcast]
+
+async def write_chapter(chapter, priority: int = PRIORITY_INTERACTIVE,
+                        topic: Optional[str] = None, grade_level: Optional[str] = None,
+                        events: Optional[Broadcast] = None) -> ChapterContent:
+    """
+    Stored content, or one generation shared by every concurrent request for
+    the chapter. With `events`, a leader streams the generation and publishes
+    its `delta`/`quiz` events there for streaming followers to replay.
+
+    A reader joining a prefetch raises its priority to their own, so they
+    never wait at background priority behind other interactive calls.
+    """
+    key = chapter_key(chapter)
+    joined = chapter_flight.shared(key)
+    if joined is not None:
+        joined.priority.raise_to(priority)
+    ticket = PriorityTicket(priority)
+
+    async def write():
+        store = get_course_store()
+        if store:
+            stored = await asyncio.to_thread(store.get_chapter, chapter)
+            if stored:
+                return stored
+
+        if events is None:
+            content = await content_agent.generate_chapter_content(chapter, priority=ticket)
+        else:
+            content = None
+            try:
+                async for event, payload in content_agent.stream_chapter_content(chapter, priority=ticket):
+                    if event == "done":
+                        content = payload
+                    elif event != "error":
+                        events.publish(event, payload)
+            finally:
+                events.close()
+
+        if not content:
+            raise HTTPException(status_code=500, detail="Failed to generate chapter content")
+        if store:
+            await asyncio.to_thread(store.save_chapter, chapter, content, topic, grade_level)
+        return content
+
+    return await chapter_flight.do(key, write, state=ChapterFlight(ticket, events))
+
+course_agent = CourseAgent(planner_agent, content_agent, plan_roadmap=plan_roadmap, generate_chapter=write_chapter)
+
+async def write_video_script(content_markdown: str):
+    return await media_agent._generate_script(content_markdown)
+
+# Generates the chapters a reader is likely to open next while they read
+prefetcher = ChapterPrefetcher(write_chapter, generate_script=write_video_script)
+
+def sse_event(event: str, payload) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(payload))}\n\n"
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+async def run_video_job(payload: dict, report) -> str:
+    # Videos are content-addressed (media_agent.videos is their index): an existing render comes back straight away
+    video_path = await media_agent.generate_video(payload["topic"], payload["content_markdown"], progress=report)
+    if not video_path:
+        raise Exception("Failed to generate video")
+    return video_path
+
+# Video renders run as background jobs; identical requests share one job
+video_jobs = JobQueue("video", run_video_job)
+
+# Frame analysis runs in worker processes, users sharded across them; open sessions by user
+proctor_engine = ProctorEngine()
+proctor_sessions = {}
+video_janitor: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_video_jobs():
+    global video_janitor
+    await video_jobs.start()
+    # Keeps rendered videos and TTS audio within their disk budgets, removes crash leftovers
+    video_janitor = asyncio.ensure_future(media_agent.videos.run_janitor())
+    proctor_engine.start()
+
+@app.on_event("startup")
+async def load_topic_index():
+    store = get_course_store()
+    if store:
+        for row in await asyncio.to_thread(store.list_roadmaps):
+            topic_index.add(row["id"], row["topic"], row["grade_level"], row["framework"])
+        log.info("course.topic_index_loaded", topics=len(topic_index))
+
+@app.on_event("shutdown")
+async def close_llm_clients():
+    await close_async_clients()
+    await video_jobs.stop()
+    if video_janitor:
+        video_janitor.cancel()
+    shutdown_render_pool()
+    proctor_engine.shutdown()
+    store = get_course_store()
+    if store:
+        store.close()
+    log.close()
+
 @app.get("/")
 def read_root():
     return {"message": "EduCore API is running"}
@@ -52,21 +259,18 @@ async def generate_course(request: CourseRequest):
     2. Generate first chapter content (Content Agent)
     """
     print(f"Generating course for: {request.topic} ({request.grade_level})")
-    with open("debug_main.txt", "a") as f:
-        f.write(f"Received request: {request.topic}, {request.grade_level}\n")
+    log.info("course.request", topic=request.topic, grade_level=request.grade_level)
     
     # Step 1: Generate Roadmap
-    roadmap = planner_agent.generate_roadmap(request.topic, request.grade_level)
-    print("DEBUG: Roadmap generated object")
-    with open("debug_main.txt", "a") as f:
-        f.write("Roadmap generated object. Returning...\n")
-        
-    if not roadmap:
-        raise HTTPException(status_code=500, detail="Failed to generate roadmap")
+    roadmap = await plan_roadmap(request.topic, request.grade_level, request.framework or "General")
     
-    # Step 2: Return Roadmap immediately (Frontend will request chapters later)
+    # Step 2: Start writing the first chapters in the background
+    roadmap_id = prefetcher.schedule(roadmap)
+
+    # Step 3: Return Roadmap immediately (Frontend will request chapters later)
     return {
         "roadmap": roadmap,
+        "roadmap_id": roadmap_id,
         "first_chapter_content": None, # Deprecated in favor of on-demand
         "message": "Roadmap generated successfully."
     }
@@ -74,12 +278,76 @@ async def generate_course(request: CourseRequest):
 @app.post("/generate/chapter")
 async def generate_chapter(request: ChapterRequest):
     print(f"Generating content for Chapter {request.chapter.chapter_number}: {request.chapter.title}")
-    content = content_agent.generate_chapter_content(request.chapter)
-    
-    if not content:
-        raise HTTPException(status_code=500, detail="Failed to generate chapter content")
-        
-    return content
+    prefetcher.touch(request.chapter)
+    return await write_chapter(request.chapter, topic=request.topic, grade_level=request.grade_level)
+
+@app.get("/course/stored")
+async def get_stored_course(topic: str, grade_level: str, framework: str = "General"):
+    """A previously generated roadmap with whatever chapter content is already stored."""
+    store = get_course_store()
+    roadmap = await asyncio.to_thread(store.get_roadmap, topic, grade_level, framework) if store else None
+    if not roadmap:
+        raise HTTPException(status_code=404, detail="Course not found")
+    chapters = await asyncio.to_thread(store.get_chapters, roadmap.chapters)
+    return {"roadmap": roadmap, "chapters": chapters}
+
+@app.delete("/prefetch/{roadmap_id}")
+async def cancel_prefetch(roadmap_id: str):
+    """Stops background generation for a roadmap the user has navigated away from."""
+    return {"cancelled": prefetcher.cancel(roadmap_id)}
+
+@app.post("/generate/course/full")
+async def generate_full_course(request: FullCourseRequest):
+    """
+    Plans the roadmap and generates every chapter concurrently (capped by
+    max_concurrency). Server-Sent Events: `roadmap`, then `chapter` /
+    `chapter_failed` as each one finishes, then `done` (or `error`).
+    """
+    log.info("course.full_request", topic=request.topic, grade_level=request.grade_level)
+
+    async def events():
+        async for event, payload in course_agent.generate_full_course(
+            request.topic, request.grade_level, request.framework or "General",
+            max_concurrency=request.max_concurrency
+        ):
+            yield sse_event(event, payload)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.post("/generate/chapter/stream")
+async def generate_chapter_stream(request: ChapterRequest):
+    """
+    Server-Sent Events version of /generate/chapter. Emits `delta` events with
+    content_markdown text as it is generated, a `quiz` event once the quiz is
+    complete, then `done` with the full ChapterContent (or `error`).
+    """
+    log.info("chapter.stream_request", chapter=request.chapter.chapter_number, title=request.chapter.title)
+    prefetcher.touch(request.chapter)
+
+    async def events():
+        # Joins a generation already in flight (a prefetch, another reader) and
+        # replays its stream when it has one; otherwise leads a streamed one
+        joined = chapter_flight.shared(chapter_key(request.chapter))
+        feed = joined.events if joined is not None and joined.events is not None else Broadcast()
+        task = asyncio.ensure_future(write_chapter(
+            request.chapter, topic=request.topic, grade_level=request.grade_level, events=feed
+        ))
+        try:
+            async for event, payload in feed.follow(until=task):
+                yield sse_event(event, payload)
+            content = await task
+        except HTTPException as e:
+            yield sse_event("error", e.detail)
+            return
+        except Exception as e:
+            log.error("chapter.stream_failed", chapter=request.chapter.chapter_number, error=str(e))
+            yield sse_event("error", "Failed to generate chapter content")
+            return
+        finally:
+            task.cancel()  # client went away: the flight only stops if nobody else waits on it
+        yield sse_event("done", content)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 class VideoRequest(BaseModel):
     topic: str
@@ -87,30 +355,136 @@ class VideoRequest(BaseModel):
 
 @app.post("/generate/video")
 async def generate_video(request: VideoRequest):
+    """
+    Queues a video render and returns immediately with a job id. Poll
+    GET /jobs/{job_id} or listen on /ws/jobs/{job_id} for progress; the
+    finished job's `result` is the video URL. While it renders, the job's
+    progress carries a `stream_url` (HLS playlist) as soon as the first
+    segment is playable. Already rendered videos come back with status
+    "done" and `video_url` set.
+    """
     print(f"Generating video for: {request.topic}")
-    video_path = await media_agent.generate_video(request.topic, request.content_markdown)
-    
-    if not video_path:
-        raise HTTPException(status_code=500, detail="Failed to generate video")
-        
-    return {"video_url": video_path}
+
+    key = media_agent.video_key(request.content_markdown)
+    stored = media_agent.videos.lookup(key)
+    if stored:
+        return {"job_id": None, "status": "done", "video_url": stored}
+
+    job = video_jobs.submit({"topic": request.topic, "content_markdown": request.content_markdown}, dedupe_key=key)
+    return {"job_id": job["job_id"], "status": job["status"], "video_url": job["result"],
+            "stream_url": job["progress"].get("stream_url")}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = video_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.websocket("/ws/jobs/{job_id}")
+async def job_updates(websocket: WebSocket, job_id: str):
+    """Pushes the job's status every time it changes, until it is done or failed."""
+    await websocket.accept()
+    updates = video_jobs.subscribe(job_id)
+    try:
+        job = video_jobs.get(job_id)
+        if job is None:
+            await websocket.send_json({"job_id": job_id, "status": "not_found"})
+            return
+        while True:
+            await websocket.send_json(job)
+            if job["status"] in FINISHED:
+                return
+            job = await updates.get()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        video_jobs.unsubscribe(job_id, updates)
+        try:
+            await websocket.close()
+        except RuntimeError:
+            pass
+
+# Point-in-time gauges refreshed on every /metrics scrape
+LLM_QUEUE_DEPTH = gauge("llm_queue_depth", "Calls waiting for the provider rate limiter", ["provider"])
+LLM_QUEUE_WAIT = gauge("llm_queue_wait_seconds", "Average rate limiter wait", ["provider"])
+LLM_PROVIDER_LATENCY = gauge("llm_provider_latency_seconds", "Rolling provider latency", ["route", "quantile"])
+VIDEO_JOBS = gauge("video_jobs", "Video jobs by state", ["status"])
+PROCTOR_SESSIONS = gauge("proctor_sessions", "Open proctoring websockets")
+LLM_PROVIDER_OPEN = gauge("llm_provider_circuit_open", "1 when the provider circuit breaker is not closed", ["route"])
+
+def _refresh_gauges():
+    for status, count in video_jobs.stats().items():
+        if status != "workers":
+            VIDEO_JOBS.set(count, status=status)
+    PROCTOR_SESSIONS.set(len(proctor_sessions))
+    for provider, stats in scheduler_stats().items():
+        LLM_QUEUE_DEPTH.set(stats["queue_depth"], provider=provider)
+        LLM_QUEUE_WAIT.set(stats["avg_wait_seconds"], provider=provider)
+    for route, stats in router.stats().items():
+        for quantile in ("p50", "p95"):
+            if stats[quantile] is not None:
+                LLM_PROVIDER_LATENCY.set(stats[quantile], route=route, quantile=quantile)
+        LLM_PROVIDER_OPEN.set(0 if stats["state"] == "closed" else 1, route=route)
+
+REGISTRY.on_scrape(_refresh_gauges)
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats")
+def get_stats():
+    cache = get_llm_cache()
+    store = get_course_store()
+    return {
+        "llm_cache": cache.stats() if cache else None,
+        "course_store": store.stats() if store else None,
+        "topic_index": topic_index.stats(),
+        "llm_providers": router.stats(),
+        "llm_scheduler": scheduler_stats(),
+        "coalescing": {
+            flight.name: flight.stats()
+            for flight in (course_flight, chapter_flight)
+        },
+        "video_jobs": video_jobs.stats(),
+        "video_cache": media_agent.videos.stats(),
+        "proctor": {
+            **proctor_engine.stats(),
+            "sessions": {user_id: session.stats() for user_id, session in proctor_sessions.items()},
+        },
+        "prefetch": prefetcher.stats(),
+    }
 
 @app.websocket("/ws/proctor/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
+    """
+    Binary webcam frames in, ProctorStatus JSON out. Only the newest frame
+    is analyzed and only the newest status is sent, so a slow client or
+    slow inference drops stale frames instead of building up latency.
+
+    The first message is a `hello` describing the frame header (see
+    proctor_agent/protocol.py); bare JPEG frames are still accepted.
+    """
     await websocket.accept()
-    # try:
-    #     while True:
-    #         # Expecting bytes (frame)
-    #         data = await websocket.receive_bytes()
-            
-    #         # Process frame
-    #         status = proctor_agent.process_frame(data, user_id)
-            
-    #         # Send back status
-    #         await websocket.send_json(status.model_dump())
-            
-    # except WebSocketDisconnect:
-    #     print(f"User {user_id} disconnected")
+    session = ProctorSession(websocket, user_id, proctor_engine.analyze)
+    proctor_sessions[user_id] = session
+    try:
+        await session.run()
+    except WebSocketDisconnect:
+        print(f"User {user_id} disconnected")
+    except Exception as e:
+        log.error("proctor.session_failed", user_id=user_id, error=str(e))
+        try:
+            await websocket.close(code=1011)
+        except RuntimeError:
+            pass
+    finally:
+        if proctor_sessions.get(user_id) is session:
+            del proctor_sessions[user_id]
+            # A reconnect keeps the tracker; otherwise free it now rather than at idle expiry
+            await proctor_engine.release(user_id)
+        log.info("proctor.session_closed", user_id=user_id, **session.stats())
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,5 +1,5 @@
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import AliasChoices, BaseModel, Field, model_validator
 
 # --- Course Generation Schemas ---
 
@@ -8,6 +8,9 @@ class CourseRequest(BaseModel):
     grade_level: str
     framework: Optional[str] = "General"  # e.g., "CBSE", "IGCSE", "General"
 
+class FullCourseRequest(CourseRequest):
+    max_concurrency: Optional[int] = None  # Chapters generated in parallel (server default if unset)
+
 class Chapter(BaseModel):
     chapter_number: int
     title: str
@@ -27,6 +30,15 @@ class ChapterContent(BaseModel):
     content_markdown: str
     quiz: List[QuizQuestion]
 
+class ScriptSegment(BaseModel):
+    text: str = Field(validation_alias=AliasChoices("text", "content", "narration", "script"))
+
+    @model_validator(mode="before")
+    @classmethod
+    def _from_string(cls, data):
+        # Models sometimes return the script as a plain list of strings
+        return {"text": data} if isinstance(data, str) else data
+
 class ChapterRequest(BaseModel):
     chapter: Chapter
     topic: str
@@ -40,3 +52,4 @@ class ProctorStatus(BaseModel):
     is_looking_away: bool
     fraud_detected: bool
     timestamp: float
+    frame_seq: Optional[int] = None  # sequence number from the frame header, if the client sent one